@@ -136,6 +136,15 @@ class Expression(abc.ABC):
     def is_root():
         return True
 
+    def get_longest_back_rolling(self):
+        """
+        the number of rows before the current one which the latest value depends on, np.inf if it depends on the
+        whole history (e.g. an expanding window)
+
+        For example `Mean(Ref($close,5),20)` needs the 24 rows before the current one.
+        """
+        return 0
+
     def __call__(self, *args, **kwargs):
         pass
 
@@ -156,5 +165,6 @@ class Feature(Expression):
         return "$" + self._name
 
     def __call__(self, df):
-        series = df.loc[:, self.__str__()]
+        # a column of a DataFrame, or an ndarray of a dict of arrays for the numpy backend
+        series = df[self.__str__()]
         return series
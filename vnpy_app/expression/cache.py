@@ -0,0 +1,116 @@
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import Text, Union
+
+import numpy as np
+import pandas as pd
+
+# the size of the cache directory by default, in bytes
+CACHE_SIZE = 2 ** 30
+
+
+def get_digest(*parts) -> Text:
+    """the hex digest of the bytes or strings `parts`"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode() if isinstance(part, str) else part)
+        # separates ("ab", "c") from ("a", "bc")
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def get_fingerprint(values) -> Text:
+    """the fingerprint of a column of raw data, or of an index, its dtype and shape included"""
+    if isinstance(values, pd.Index):
+        values = pd.util.hash_pandas_object(values, index=False).values
+    values = np.ascontiguousarray(values)
+    return get_digest(str(values.dtype), str(values.shape), values.view(np.uint8).reshape(-1).data)
+
+
+class ExpressionCache:
+    """
+    A content-addressed cache of computed expressions on disk
+
+    Every value is a `.npy` file named by the digest of (canonical expression, fingerprint of the input columns the
+    expression depends on, row range), so a value is reused by any evaluation of the same expression on the same
+    data, whatever the other fields of the DAG, and a changed column only misses the expressions on it. Files are
+    loaded memory-mapped, and the least recently used ones are removed once the directory exceeds `max_size`.
+
+    Example:
+        cache = ExpressionCache("~/.cache/expression")
+        df_feature = dag.evaluate(df, cache=cache)
+
+    Parameters
+    ----------
+    path : str
+        the cache directory, created if missing
+    max_size : int
+        the size of the directory, in bytes
+    """
+
+    def __init__(self, path: Union[Text, Path], max_size: int = CACHE_SIZE):
+        self.path = Path(path).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.size = sum(file.stat().st_size for file in self.path.glob("*.npy"))
+
+    @staticmethod
+    def get_key(expression: Text, fingerprint: Text, start: int, stop: int) -> Text:
+        """the name of the value of `expression` on rows [start, stop) of the data identified by `fingerprint`"""
+        return get_digest(expression, fingerprint, str(start), str(stop))
+
+    def load(self, key: Text):
+        """
+        the cached value of `key` as a copy-on-write memory-mapped array, None if missing: the array is writable like
+        a computed value, and a modification only touches the copied pages in memory, never the file
+        """
+        file = self.path / (key + ".npy")
+        try:
+            value = np.load(file, mmap_mode="c")
+            # the modification time is the last use of the file
+            os.utime(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        return value
+
+    def save(self, key: Text, value):
+        """store a computed value, values which are not arrays, e.g. constants, are skipped"""
+        if isinstance(value, pd.Series):
+            value = value.values
+        if not isinstance(value, np.ndarray) or value.ndim != 1 or value.dtype.hasobject:
+            return
+        file = self.path / (key + ".npy")
+        if file.exists():
+            return
+        # written aside then renamed, so a concurrent reader never loads a partial file
+        temp = self.path / "{}.{}.tmp".format(key, uuid.uuid4().hex)
+        with open(temp, "wb") as f:
+            np.save(f, value)
+        os.replace(temp, file)
+        self.size += file.stat().st_size
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """remove the least recently used files until the directory fits `max_size`"""
+        files = []
+        for file in self.path.glob("*.npy"):
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file))
+        self.size = sum(size for _, size, _ in files)
+        for _, size, file in sorted(files, key=lambda x: x[0]):
+            if self.size <= self.max_size:
+                break
+            file.unlink(missing_ok=True)
+            self.size -= size
+
+    def clear(self):
+        """remove every cached value"""
+        for file in self.path.glob("*.npy"):
+            file.unlink(missing_ok=True)
+        self.size = 0
@@ -0,0 +1,136 @@
+from typing import Iterable, Iterator, Text
+
+import numpy as np
+import pandas as pd
+
+from .dag import ExpressionDAG
+from .ops import PairRolling, Rolling, get_instrument_level
+# noinspection PyProtectedMember
+from .rolling import BLOCK_SIZE, _block_size
+
+# the number of rows of a chunk by default, rounded up to the alignment of the DAG
+CHUNK_SIZE = 1 << 20
+
+
+def get_alignment(dag: ExpressionDAG) -> int:
+    """
+    the number of rows which every chunk should start at a multiple of
+
+    The kernels of `rolling.py` restart their running sums every block of `_block_size(window)` rows, or of
+    `BLOCK_SIZE` rows at least for `block_apply`, so a chunk starting at a multiple of every block size of the DAG
+    computes the same blocks as the whole frame. The block sizes are powers of 2, so the alignment is the largest
+    one, less than twice the longest window.
+    """
+    sizes = [_block_size(node.n) for node in dag.nodes.values()
+             if isinstance(node, (Rolling, PairRolling)) and isinstance(node.n, int) and node.n > 0]
+    return max(BLOCK_SIZE, *sizes)
+
+
+def check_chunked(dag: ExpressionDAG):
+    """raise a ValueError if the DAG could not be evaluated by chunks, i.e. if it reads the whole history or future
+    rows"""
+    if np.isinf(dag.get_lookback()):
+        raise ValueError("The fields depend on the whole history, e.g. by EMA or an expanding window (n=0), "
+                         "and could not be evaluated by chunks")
+    for key, node in dag.nodes.items():
+        if isinstance(node, Rolling) and node.n < 0:
+            raise ValueError("{} reads future rows and could not be evaluated by chunks".format(key))
+
+
+def evaluate_chunks(dag: ExpressionDAG, blocks: Iterable[pd.DataFrame], chunk_size: int = CHUNK_SIZE,
+                    dtype=None) -> Iterator[pd.DataFrame]:
+    """
+    evaluate `dag` on a long series given as time-ordered blocks of rows, and yield its feature matrix by chunks
+
+    Every chunk is evaluated with a halo of the `dag.get_lookback() - 1` rows before it, which is dropped from the
+    output. Chunks and halos start at a multiple of `get_alignment(dag)`, so every value is bit-identical to the
+    evaluation of the whole frame, while only a chunk and its halo are held in memory. The blocks of a chunk are
+    concatenated once, and blocks with a RangeIndex, e.g. the batches of a Parquet file, are numbered by their global
+    row, so the index of the output is unique.
+
+    Example:
+        blocks = (batch.to_pandas() for batch in pq.ParquetFile("ticks.parquet").iter_batches())
+        for df_feature in evaluate_chunks(dag, blocks):
+            ...
+
+    Parameters
+    ----------
+    dag : ExpressionDAG
+        the compiled fields, their lookback should be finite and they should not read future rows
+    blocks : iterable
+        DataFrames of raw data of one instrument with `$`-prefixed columns, in time order, of any size
+    chunk_size : int
+        the number of rows of the output chunks, the last one excepted, rounded up to the alignment
+    dtype : np.dtype
+        the dtype of the float outputs, see `ExpressionDAG.evaluate`
+
+    Returns
+    -------
+    iterator
+        the feature matrix of the consecutive chunks
+    """
+    check_chunked(dag)
+    halo = dag.get_lookback() - 1
+    align = get_alignment(dag)
+    chunk_size = -(-max(chunk_size, 1) // align) * align
+    # the global row of the first row of `buffer`, the first row which is not yielded yet, and the number of rows read
+    buffer, offset, emitted, n_rows = None, 0, 0, 0
+    # the blocks read since `buffer` was concatenated
+    pending = []
+
+    def evaluate(stop: int) -> pd.DataFrame:
+        start = max(emitted - halo, 0)
+        start -= start % align
+        df_feature = dag.evaluate(buffer.iloc[start - offset:stop - offset], dtype=dtype)
+        return df_feature.iloc[emitted - start:]
+
+    for block in blocks:
+        if get_instrument_level(block.index) is not None:
+            raise ValueError("A panel could not be evaluated by chunks, evaluate each instrument")
+        if isinstance(block.index, pd.RangeIndex):
+            block = block.copy(deep=False)
+            block.index = pd.RangeIndex(n_rows, n_rows + len(block))
+        pending.append(block)
+        n_rows += len(block)
+        while n_rows - emitted >= chunk_size:
+            if pending:
+                buffer = pd.concat(pending if buffer is None else [buffer] + pending)
+                pending = []
+            stop = emitted + chunk_size
+            yield evaluate(stop)
+            emitted = stop
+            # only the halo of the next chunk is kept
+            start = max(emitted - halo, 0)
+            start -= start % align
+            buffer = buffer.iloc[start - offset:]
+            offset = start
+    if n_rows > emitted:
+        if pending:
+            buffer = pd.concat(pending if buffer is None else [buffer] + pending)
+        yield evaluate(n_rows)
+
+
+def evaluate_to_parquet(dag: ExpressionDAG, blocks: Iterable[pd.DataFrame], path: Text,
+                        chunk_size: int = CHUNK_SIZE, dtype=np.float32) -> int:
+    """
+    evaluate `dag` by chunks, see `evaluate_chunks`, and write the feature matrix to the Parquet file `path`, one
+    row group per chunk, the float features are written as float32 by default
+
+    Returns the number of rows written.
+    """
+    import pyarrow as pa  # pylint: disable=C0415
+    import pyarrow.parquet as pq  # pylint: disable=C0415
+
+    writer = None
+    n_rows = 0
+    try:
+        for df_feature in evaluate_chunks(dag, blocks, chunk_size, dtype):
+            table = pa.Table.from_pandas(df_feature)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            n_rows += len(df_feature)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
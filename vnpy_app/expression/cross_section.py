@@ -0,0 +1,94 @@
+import numpy as np
+
+
+def _group_order(a: np.array, groups: np.array):
+    """
+    the order of the rows sorted by group then by value, nan last, and the first sorted row of the group of every
+    sorted row
+    """
+    # sorted by value (nan last), then stably by group, which is faster than `np.lexsort`
+    order = np.argsort(a)
+    order = order[np.argsort(groups[order], kind="stable")]
+    index = np.arange(len(a))
+    sorted_groups = groups[order]
+    new = np.ones(len(a), dtype=bool)
+    new[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    return order, np.maximum.accumulate(np.where(new, index, 0))
+
+
+def _group_count(mask: np.array, groups: np.array) -> np.array:
+    """number of True of the group of every row"""
+    return np.bincount(groups, weights=mask)[groups]
+
+
+def _group_mean(a: np.array, groups: np.array):
+    """the mean of the not nan values of the group of every row, and their number"""
+    mask = ~np.isnan(a)
+    count = _group_count(mask, groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.bincount(groups, weights=np.where(mask, a, 0))[groups] / count, count
+
+
+def cs_rank(a: np.array, groups: np.array) -> np.array:
+    """
+    vectorized cross-sectional percentile rank, same as `series.groupby(groups).rank(pct=True)`
+
+    `groups` is the non-negative integer group of every row, e.g. the code of its datetime in a panel; the ties get
+    their average rank, and nan values stay nan
+    """
+    a = np.asarray(a, dtype=np.float64)
+    n = len(a)
+    index = np.arange(n)
+    order, start = _group_order(a, groups)
+    values = a[order]
+    # the runs of equal values of a group
+    new = np.ones(n, dtype=bool)
+    new[1:] = (values[1:] != values[:-1]) | (start[1:] != start[:-1])
+    end = np.ones(n, dtype=bool)
+    end[:-1] = new[1:]
+    first = np.maximum.accumulate(np.where(new, index, 0))
+    last = np.minimum.accumulate(np.where(end, index, n)[::-1])[::-1]
+    rank = np.empty(n)
+    rank[order] = (first + last) / 2 - start + 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rank /= _group_count(~np.isnan(a), groups)
+    rank[np.isnan(a)] = np.nan
+    return rank
+
+
+def cs_demean(a: np.array, groups: np.array) -> np.array:
+    """
+    vectorized cross-sectional demean, same as `series - series.groupby(groups).transform("mean")`
+    """
+    a = np.asarray(a, dtype=np.float64)
+    return a - _group_mean(a, groups)[0]
+
+
+def cs_zscore(a: np.array, groups: np.array) -> np.array:
+    """
+    vectorized cross-sectional z-score, same as `series.groupby(groups).transform(lambda x: (x - x.mean()) / x.std())`
+    """
+    a = np.asarray(a, dtype=np.float64)
+    mean, count = _group_mean(a, groups)
+    demeaned = a - mean
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.sqrt(np.bincount(groups, weights=np.where(np.isnan(a), 0, demeaned ** 2))[groups] / (count - 1))
+        return demeaned / std
+
+
+def cs_quantile(a: np.array, groups: np.array, qscore: float) -> np.array:
+    """
+    vectorized cross-sectional quantile with linear interpolation, same as
+    `series.groupby(groups).transform(lambda x: x.quantile(qscore))`
+    """
+    a = np.asarray(a, dtype=np.float64)
+    order, start = _group_order(a, groups)
+    values = a[order]
+    count = _group_count(~np.isnan(a), groups)[order].astype(np.int64)
+    pos = qscore * np.maximum(count - 1, 0)
+    lower = np.floor(pos).astype(np.int64)
+    upper = np.minimum(lower + 1, np.maximum(count - 1, 0))
+    low, high = values[start + lower], values[start + upper]
+    ret = np.empty(len(a))
+    ret[order] = np.where(count > 0, low + (high - low) * (pos - lower), np.nan)
+    return ret
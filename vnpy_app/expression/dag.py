@@ -0,0 +1,633 @@
+import time
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Text, Union
+
+import numpy as np
+import pandas as pd
+
+from .base import Expression, Feature
+from .cache import ExpressionCache, get_digest, get_fingerprint
+from .profile import ExpressionProfile
+from .ops import Rolling, get_instrument_level, get_starts
+from .parser import parser_expression
+from .rolling import FUSED_STATS, rolling_stats
+
+CHILD_ATTRS = ("condition", "feature", "feature_left", "feature_right")
+
+# `pandas` computes pd.Series on the index of a DataFrame, `numpy` computes ndarrays without any index
+BACKENDS = ("pandas", "numpy")
+
+
+def get_children(expression: Expression) -> List[Expression]:
+    """the direct sub-expressions of `expression`, constants are skipped"""
+    children = []
+    for attr in CHILD_ATTRS:
+        child = getattr(expression, attr, None)
+        if isinstance(child, Expression):
+            children.append(child)
+    return children
+
+
+def get_inputs(expression: Expression) -> list:
+    """the direct inputs of `expression` in the order of its arguments, constants included"""
+    return [getattr(expression, attr) for attr in CHILD_ATTRS if hasattr(expression, attr)]
+
+
+def get_window(expression: Expression):
+    """
+    the number of rows before a row of `expression` which its inputs are needed for, e.g. 19 for `Mean($close,20)`,
+    0 for element-wise operators and np.inf for expanding windows
+    """
+    back = expression.get_longest_back_rolling()
+    if np.isinf(back):
+        return np.inf
+    return max(back - max([child.get_longest_back_rolling() for child in get_children(expression)] + [0]), 0)
+
+
+def get_tail(value, size: int):
+    """the last `size` rows of a computed value, constants are returned unchanged"""
+    if isinstance(value, pd.Series):
+        return value.iloc[len(value) - size:] if len(value) > size else value
+    if isinstance(value, np.ndarray) and value.ndim > 0:
+        return value[len(value) - size:] if len(value) > size else value
+    return value
+
+
+def as_dtype(value, dtype=None):
+    """cast a float output to `dtype`, e.g. np.float32, other values, e.g. the booleans of a comparison, are kept"""
+    if dtype is None or not isinstance(value, (pd.Series, np.ndarray)) or value.dtype.kind != "f":
+        return value
+    return value.astype(dtype, copy=False)
+
+
+def get_data(data, backend: Text = "pandas", columns: List[Text] = None):
+    """
+    the input of an evaluation: a DataFrame for the pandas backend, a dict of arrays keyed by the `$`-prefixed
+    feature names for the numpy backend
+
+    Parameters
+    ----------
+    data : pd.DataFrame, dict or np.ndarray
+        a DataFrame, a dict of 1-D arrays, or a 2-D block with one column per name of `columns`
+    backend : str
+        one of `BACKENDS`
+    columns : list
+        the feature names of the columns of a 2-D block
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend {}, should be one of {}".format(backend, BACKENDS))
+    if isinstance(data, np.ndarray):
+        if columns is None or data.ndim != 2 or data.shape[1] != len(columns):
+            raise ValueError("The names of the {} columns of the block should be given".format(data.shape[-1]))
+        data = {column: data[:, i] for i, column in enumerate(columns)}
+    if backend == "pandas" and not isinstance(data, pd.DataFrame):
+        return pd.DataFrame(data)
+    if backend == "numpy" and isinstance(data, pd.DataFrame) and get_instrument_level(data.index) is not None:
+        raise ValueError("A panel is evaluated by the pandas backend")
+    return data
+
+
+def get_panel_order(index: pd.MultiIndex):
+    """
+    the order of the rows of a (datetime, instrument) panel sorted by instrument, None if they are already sorted
+
+    The sort is stable, so the rows of an instrument keep their order, e.g. by datetime.
+    """
+    instrument = pd.factorize(index.get_level_values(get_instrument_level(index)), sort=True)[0]
+    order = np.argsort(instrument, kind="stable")
+    if (order == np.arange(len(order))).all():
+        return None
+    return order
+
+
+def get_length(data) -> int:
+    """the number of rows of a DataFrame or of a dict of arrays"""
+    if isinstance(data, pd.DataFrame):
+        return len(data)
+    return len(next(iter(data.values()))) if len(data) else 0
+
+
+def is_fused(expression) -> bool:
+    """whether `expression` is a rolling statistic which could be computed by `rolling_stats`"""
+    return (isinstance(expression, Rolling) and type(expression).__call__ is Rolling.__call__
+            and expression.func in FUSED_STATS and isinstance(expression.n, int) and expression.n > 0)
+
+
+def get_bar_value(bar, key: Text):
+    """value of a feature like `$close` in a dict / pd.Series row, or in a `BarData` / `TickData` object"""
+    if isinstance(bar, (Mapping, pd.Series)):
+        return bar[key]
+    name = key[1:]
+    if hasattr(bar, name + "_price"):
+        return getattr(bar, name + "_price")
+    return getattr(bar, name)
+
+
+class ExpressionDAG:
+    """
+    A DAG shared by a list of expressions
+
+    Every sub-expression is a node identified by its canonical string (`str(expression)`), so identical subtrees
+    of different fields, e.g. `Mean($close,20)` in `MA20` and `RSV20`, are merged into one node and are computed
+    exactly once per evaluation. Nodes are kept in topological order (children before parents).
+
+    The rolling statistics of a same sub-expression, e.g. `Mean($close,5)`, `Std($close,20)` and `Max($close,60)`,
+    are computed together by one `rolling_stats` call, which shares the power sums of all windows.
+
+    Parameters
+    ----------
+    expressions : list
+        parsed expressions, or constants
+    names : list
+        the column name of each expression in the output feature matrix
+    """
+
+    def __init__(self, expressions: list, names: List[Text]):
+        if len(expressions) != len(names):
+            raise ValueError("The number of fields and names should be the same")
+        self.names = list(names)
+        self.nodes = {}
+        self.parents = {}
+        self.outputs = [self._add(expression) for expression in expressions]
+        # the first node of every group of fused rolling statistics -> the keys of the group
+        self.fused = {}
+        groups = {}
+        for key, node in self.nodes.items():
+            if is_fused(node):
+                groups.setdefault(str(node.feature), []).append(key)
+        for keys in groups.values():
+            self.fused[keys[0]] = keys
+        self.windows = {key: get_window(node) for key, node in self.nodes.items()}
+
+    def _add(self, expression):
+        if not isinstance(expression, Expression):
+            return expression
+        key = str(expression)
+        if key not in self.nodes:
+            for child in get_children(expression):
+                self.parents.setdefault(self._add(child), []).append(key)
+            self.nodes[key] = expression
+        return key
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def get_lookback(self):
+        """
+        the number of rows, the latest one included, needed to compute the latest value of every output exactly,
+        e.g. 25 for `Mean(Ref($close,5),20)`, and np.inf if an output depends on the whole history
+
+        It sizes the history kept by a strategy, e.g. `ArrayManager(dag.get_lookback())`.
+        """
+        back = [self.nodes[output].get_longest_back_rolling() for output in self.outputs if isinstance(output, Text)]
+        return max(back + [0]) + 1
+
+    def get_ancestors(self, key: Text) -> set:
+        """the keys of the nodes computed for the node `key`, itself included and the features excluded"""
+        ancestors = set()
+        stack = [key]
+        while stack:
+            key = stack.pop()
+            if key in ancestors or isinstance(self.nodes[key], Feature):
+                continue
+            ancestors.add(key)
+            stack.extend(str(child) for child in get_children(self.nodes[key]))
+        return ancestors
+
+    def partition(self, n_parts: int) -> List[List[int]]:
+        """
+        split the outputs into at most `n_parts` groups which could be evaluated independently
+
+        The outputs are taken from the largest sub-DAG to the smallest one, and each is put into the group whose
+        sub-DAG stays the smallest with it: fields sharing nodes, e.g. `Mean($close,20)`, tend to be grouped, and
+        the groups have about the same number of nodes. A node shared by two groups is computed by both.
+
+        Returns
+        -------
+        list
+            the positions in `outputs` of each group, constant outputs are skipped
+        """
+        ancestors = {}
+        for i, output in enumerate(self.outputs):
+            if isinstance(output, Text):
+                ancestors[i] = self.get_ancestors(output)
+        parts = [(set(), []) for _ in range(max(min(n_parts, len(ancestors)), 1))]
+        for i in sorted(ancestors, key=lambda i: -len(ancestors[i])):
+            nodes, positions = min(parts, key=lambda part: len(part[0] | ancestors[i]))
+            nodes.update(ancestors[i])
+            positions.append(i)
+        return [sorted(positions) for _, positions in parts if positions]
+
+    def _get_sizes(self, last_n: int, n_rows: int) -> dict:
+        """the number of last rows of every node needed for the last `last_n` rows of the outputs"""
+        sizes = {output: min(last_n, n_rows) for output in self.outputs if isinstance(output, Text)}
+        # parents before children
+        for key in reversed(list(self.nodes)):
+            size = min(sizes[key] + self.windows[key], n_rows)
+            for child in get_children(self.nodes[key]):
+                sizes[str(child)] = max(sizes.get(str(child), 0), size)
+        return sizes
+
+    def _compute_node(self, key: Text, df, values: dict, sizes: dict, n_rows: int, backend: Text):
+        """compute the node `key` from the values of its children"""
+        node = self.nodes[key]
+        if isinstance(node, Feature):
+            value = node(df)
+            if backend == "numpy" and isinstance(value, pd.Series):
+                value = value.values
+        elif sizes is None:
+            value = node(values)
+        else:
+            # the inputs are cut to the rows which the needed rows of the node depend on
+            size = min(sizes[key] + self.windows[key], n_rows)
+            value = node({str(child): get_tail(values[str(child)], size) for child in get_children(node)})
+        return value if sizes is None else get_tail(value, sizes[key])
+
+    def _compute_group(self, keys: List[Text], df, values: dict, sizes: dict, n_rows: int, backend: Text) -> dict:
+        """compute a group of fused rolling statistics, or a single node"""
+        results = self._fuse(keys, values) if is_fused(self.nodes[keys[0]]) else {}
+        if sizes is not None:
+            results = {key: get_tail(value, sizes[key]) for key, value in results.items()}
+        for key in keys:
+            if key not in results:
+                results[key] = self._compute_node(key, df, values, sizes, n_rows, backend)
+        return results
+
+    def _compute_task(self, keys: List[Text], df, values: dict, sizes: dict, n_rows: int, backend: Text,
+                      profile: ExpressionProfile = None) -> dict:
+        """`_compute_group`, timed if a profile is given"""
+        if profile is None:
+            return self._compute_group(keys, df, values, sizes, n_rows, backend)
+        start = time.perf_counter()
+        results = self._compute_group(keys, df, values, sizes, n_rows, backend)
+        profile.add(keys, time.perf_counter() - start, results)
+        return results
+
+    def _get_tasks(self, skip: set) -> dict:
+        """
+        the first key of every task -> the keys computed by the task, in topological order
+
+        A task is a node, or the group of fused rolling statistics of a same series, nodes in `skip` are left out.
+        """
+        firsts = {}
+        for keys in self.fused.values():
+            keys = [key for key in keys if key not in skip]
+            firsts.update({key: keys[0] for key in keys})
+        tasks = {}
+        for key in self.nodes:
+            if key not in skip:
+                tasks.setdefault(firsts.get(key, key), []).append(key)
+        return tasks
+
+    def _get_cache_keys(self, cache, df, sizes: dict, n_rows: int) -> dict:
+        """the key in `cache` of every node, from the fingerprints of the columns of `df` which the node depends on"""
+        index = get_fingerprint(df.index) if isinstance(df, pd.DataFrame) else ""
+        features = {}
+        keys = {}
+        for key, node in self.nodes.items():
+            if isinstance(node, Feature):
+                features[key] = {get_fingerprint(np.asarray(node(df)))}
+                continue
+            features[key] = set().union(*[features[str(child)] for child in get_children(node)])
+            size = n_rows if sizes is None else sizes[key]
+            keys[key] = cache.get_key(key, get_digest(index, *sorted(features[key])), n_rows - size, n_rows)
+        return keys
+
+    def _load_cached(self, cache, cache_keys: dict, df, sizes: dict, n_rows: int, backend: Text) -> tuple:
+        """
+        load the cached values which are needed, i.e. of the outputs and of the children of the needed nodes which
+        are not cached
+
+        Returns
+        -------
+        tuple
+            the loaded values, and the keys of the nodes which are not computed
+        """
+        needed = {output for output in self.outputs if isinstance(output, Text)}
+        values = {}
+        # parents before children
+        for key in reversed(list(self.nodes)):
+            if key not in needed or key not in cache_keys:
+                continue
+            value = cache.load(cache_keys[key])
+            if value is None:
+                needed.update(str(child) for child in get_children(self.nodes[key]))
+                continue
+            value = np.asarray(value)
+            if backend == "pandas":
+                size = n_rows if sizes is None else sizes[key]
+                value = pd.Series(value, index=df.index[n_rows - size:])
+            values[key] = value
+        return values, {key for key in self.nodes if key not in needed or key in values}
+
+    def _release(self, key: Text, values: dict, remaining: dict, keep: set, dtype=None):
+        """drop the children of `key` whose last consumer is `key`, the outputs among them are cast to `dtype`"""
+        for child in get_children(self.nodes[key]):
+            child_key = str(child)
+            remaining[child_key] -= 1
+            if remaining[child_key] == 0:
+                if child_key not in keep:
+                    del values[child_key]
+                elif dtype is not None:
+                    values[child_key] = as_dtype(values[child_key], dtype)
+
+    def _compute(self, df, last_n: int = None, backend: Text = "pandas", n_workers: int = None,
+                 cache: ExpressionCache = None, dtype=None, profile: ExpressionProfile = None) -> list:
+        """
+        compute every node once and return the value of each output, or only its last `last_n` rows
+
+        The nodes are computed in float64, and an output is cast to `dtype` once no other node reads it, so the
+        outputs are never all held in float64 at once.
+        """
+        keep = {output for output in self.outputs if isinstance(output, Text)}
+        n_rows = get_length(df)
+        sizes = None if last_n is None else self._get_sizes(last_n, n_rows)
+        values, skip, cache_keys = {}, set(), {}
+        if cache is not None:
+            cache_keys = self._get_cache_keys(cache, df, sizes, n_rows)
+            values, skip = self._load_cached(cache, cache_keys, df, sizes, n_rows, backend)
+            if profile is not None:
+                for key, value in values.items():
+                    profile.add_hit(key, value)
+        remaining = {key: sum(parent not in skip for parent in parents) for key, parents in self.parents.items()}
+        tasks = self._get_tasks(skip)
+
+        def done(keys: List[Text], results: dict):
+            values.update(results)
+            for key in keys:
+                if key in cache_keys:
+                    cache.save(cache_keys[key], results[key])
+                self._release(key, values, remaining, keep, dtype)
+                if dtype is not None and key in keep and remaining.get(key, 0) == 0:
+                    values[key] = as_dtype(values[key], dtype)
+            if profile is not None:
+                profile.track(values)
+
+        if n_workers is not None and n_workers > 1:
+            self._compute_threaded(tasks, df, values, sizes, n_rows, backend, n_workers, done, profile)
+        else:
+            for keys in tasks.values():
+                done(keys, self._compute_task(keys, df, values, sizes, n_rows, backend, profile))
+        return [as_dtype(values[output], dtype) if isinstance(output, Text) else output for output in self.outputs]
+
+    def _compute_threaded(self, tasks: dict, df, values: dict, sizes: dict, n_rows: int, backend: Text,
+                          n_workers: int, done, profile: ExpressionProfile = None):
+        """
+        compute `tasks` in a pool of `n_workers` threads
+
+        A task is submitted as soon as all the tasks computing its children are done, so independent branches run
+        concurrently. `values` is only written by the calling thread, through `done`, and every node is computed
+        exactly as in the serial evaluation, so the results do not depend on the order of the tasks.
+        """
+        firsts = {key: first for first, keys in tasks.items() for key in keys}
+        waiting = {}
+        dependents = {}
+        for first, keys in tasks.items():
+            children = {firsts[str(child)] for key in keys for child in get_children(self.nodes[key])
+                        if str(child) in firsts}
+            waiting[first] = len(children)
+            for child in children:
+                dependents.setdefault(child, []).append(first)
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+
+            def submit(first):
+                return executor.submit(self._compute_task, tasks[first], df, values, sizes, n_rows, backend, profile)
+
+            running = {submit(first): first for first, count in waiting.items() if count == 0}
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    first = running.pop(future)
+                    done(tasks[first], future.result())
+                    for parent in dependents.get(first, []):
+                        waiting[parent] -= 1
+                        if waiting[parent] == 0:
+                            running[submit(parent)] = parent
+
+    def _fuse(self, keys: List[Text], values: dict) -> dict:
+        """compute the rolling statistics `keys` of a same series in one pass"""
+        series = values[str(self.nodes[keys[0]].feature)]
+        if isinstance(series, pd.Series):
+            a = series.values
+        elif isinstance(series, np.ndarray) and series.ndim == 1:
+            a = series
+        else:
+            return {}
+        stats = [(self.nodes[key].n, self.nodes[key].func) for key in keys]
+        starts = get_starts(series.index) if isinstance(series, pd.Series) else None
+        results = rolling_stats(a, stats, min_periods=1, starts=starts)
+        if isinstance(series, pd.Series):
+            return {key: pd.Series(results[stat], index=series.index) for key, stat in zip(keys, stats)}
+        return {key: results[stat] for key, stat in zip(keys, stats)}
+
+    def evaluate(self, df, last_n: int = None, backend: Text = "pandas", columns: List[Text] = None,
+                 n_workers: int = None, cache: ExpressionCache = None, dtype=None,
+                 profile: ExpressionProfile = None):
+        """
+        evaluate all nodes of the DAG on `df`
+
+        Intermediate results are released as soon as their last consumer has been computed.
+
+        With `last_n`, only the last rows are computed: the rows needed by the outputs are propagated down the DAG
+        through the window of every operator, and each node is computed on the last rows of its inputs only, so the
+        cost depends on the lookback of the expressions instead of the length of `df`.
+
+        A panel, i.e. a DataFrame indexed by (datetime, instrument) as `processor.fetch_df_by_index` expects, is
+        evaluated in one pass over its rows sorted by instrument: the rolling operators get the first row of the
+        instrument of every row, so no window crosses two instruments. The feature matrix keeps the rows of `df`.
+
+        The numpy backend evaluates the same expressions on plain ndarrays, without building any index or aligning
+        any series, which is much cheaper on the short arrays of a strategy, e.g.
+        `dag.evaluate({"$close": am.close}, last_n=2, backend="numpy")`.
+
+        With `n_workers`, independent branches of the DAG are computed concurrently by a pool of threads, which is
+        cheap as the rolling kernels of numpy and pandas release the GIL, and unlike `evaluate_parallel` nothing is
+        copied between processes. The values and the order of the columns are the same as a serial evaluation.
+
+        With a `cache`, every node is first looked up by its expression, the columns of `df` it depends on and the
+        rows to compute, and only the nodes missing from the cache, with the children they need, are computed, so
+        adding a few fields to a DAG evaluated before only computes the new fields.
+
+        With `dtype`, e.g. np.float32, the float outputs are stored in `dtype`, which halves the memory of a feature
+        matrix fed to LightGBM, while every node is still computed in float64, e.g. the cumulative sums of `Slope`.
+
+        With a `profile`, the time, rows, bytes and cache hits of every node are recorded, see `ExpressionProfile`.
+
+        Parameters
+        ----------
+        df : pd.DataFrame, dict or np.ndarray
+            raw data with `$`-prefixed columns, e.g. `$close`: a DataFrame, a dict of 1-D arrays, or a 2-D block
+            whose column names are given by `columns`
+        last_n : int
+            the number of last rows to compute, all rows by default
+        backend : str
+            `pandas` or `numpy`
+        columns : list
+            the names of the columns of a 2-D block
+        n_workers : int
+            the number of threads, the nodes are computed by the calling thread by default
+        cache : ExpressionCache
+            the on-disk cache of computed nodes
+        dtype : np.dtype
+            the dtype of the float outputs, float64 by default
+        profile : ExpressionProfile
+            the statistics of the nodes, nothing is recorded by default
+
+        Returns
+        -------
+        pd.DataFrame or dict
+            the feature matrix, one column per name, or a dict name -> ndarray for the numpy backend
+        """
+        df = get_data(df, backend, columns)
+        if backend == "pandas" and get_instrument_level(df.index) is not None:
+            return self._evaluate_panel(df, last_n, n_workers, cache, dtype, profile)
+        values = self._compute(df, last_n, backend, n_workers, cache, dtype, profile)
+        if backend == "numpy":
+            return dict(zip(self.names, values))
+        index = df.index if last_n is None else df.index[len(df) - min(last_n, len(df)):]
+        return pd.DataFrame(dict(zip(self.names, values)), index=index)
+
+    def _evaluate_panel(self, df: pd.DataFrame, last_n: int = None, n_workers: int = None,
+                        cache: ExpressionCache = None, dtype=None, profile: ExpressionProfile = None) -> pd.DataFrame:
+        if last_n is not None:
+            raise ValueError("`last_n` is not supported by the evaluation of a panel")
+        order = get_panel_order(df.index)
+        values = self._compute(df if order is None else df.iloc[order], n_workers=n_workers, cache=cache, dtype=dtype,
+                               profile=profile)
+        # the values are already in the order of the rows
+        values = [value.values if isinstance(value, pd.Series) else value for value in values]
+        df_feature = pd.DataFrame(dict(zip(self.names, values)), index=df.index if order is None else df.index[order])
+        if order is None:
+            return df_feature
+        # back to the rows of `df`
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        return df_feature.iloc[inverse]
+
+    def evaluate_parallel(self, df, n_workers: int = None, columns: List[Text] = None,
+                          dtype=np.float64) -> pd.DataFrame:
+        """evaluate the DAG on `df` in a pool of `n_workers` processes, see `parallel.evaluate_parallel`"""
+        from .parallel import evaluate_parallel  # pylint: disable=C0415
+
+        return evaluate_parallel(self, df, n_workers, columns, dtype)
+
+    def stream(self) -> "ExpressionStream":
+        """a streaming evaluator which consumes one bar at a time"""
+        return ExpressionStream(self)
+
+
+class ExpressionPlan(ExpressionDAG):
+    """
+    A compiled expression
+
+    The plan is built once and evaluated any number of times, e.g. on every bar of a strategy: evaluation never
+    writes into the expression tree, so the same plan can also be shared by several instruments.
+    """
+
+    def __init__(self, expression):
+        super(ExpressionPlan, self).__init__([expression], [str(expression)])
+        self.expression = expression
+
+    def __str__(self):
+        return self.names[0]
+
+    def evaluate(self, df, last_n: int = None, backend: Text = "pandas", columns: List[Text] = None,
+                 n_workers: int = None, cache: ExpressionCache = None, dtype=None,
+                 profile: ExpressionProfile = None):
+        """
+        evaluate the expression on `df`, or only its last `last_n` rows, see `ExpressionDAG.evaluate`
+
+        Returns a pd.Series, or an ndarray for the numpy backend.
+        """
+        df = get_data(df, backend, columns)
+        if backend == "pandas" and get_instrument_level(df.index) is not None:
+            return self._evaluate_panel(df, last_n, n_workers, cache, dtype, profile).iloc[:, 0]
+        return self._compute(df, last_n, backend, n_workers, cache, dtype, profile)[0]
+
+    def stream(self) -> "PlanStream":
+        return PlanStream(self)
+
+
+class ExpressionStream:
+    """
+    Streaming evaluation of an `ExpressionDAG`
+
+    Every rolling node keeps its own state (see `rolling.py` and `expanding.py`), and `update` feeds one new bar
+    through the DAG, so the cost of a bar does not depend on the window size for most operators. The values are
+    the same as the last row of a batch evaluation on the whole history.
+
+    Example:
+        stream = compile_fields(fields, names).stream()
+        for bar in bars:
+            features = stream.update(bar)
+    """
+
+    def __init__(self, dag: ExpressionDAG):
+        self.dag = dag
+        self.states = {key: node.stream() for key, node in dag.nodes.items() if hasattr(node, "stream")}
+
+    def _update(self, bar) -> list:
+        values = {}
+        for key, node in self.dag.nodes.items():
+            if isinstance(node, Feature):
+                values[key] = get_bar_value(bar, key)
+            elif key in self.states:
+                inputs = [values[str(x)] if isinstance(x, Expression) else x for x in get_inputs(node)]
+                try:
+                    values[key] = self.states[key].update(*inputs)
+                except ZeroDivisionError:
+                    values[key] = np.nan
+            else:
+                values[key] = node(values)
+        return [values[output] if isinstance(output, Text) else output for output in self.dag.outputs]
+
+    def update(self, bar) -> dict:
+        """
+        consume a new bar and return the latest value of each field
+
+        Parameters
+        ----------
+        bar :
+            a dict or pd.Series with `$`-prefixed keys, or a `BarData` / `TickData`
+
+        Returns
+        -------
+        dict
+            name -> value
+        """
+        return dict(zip(self.dag.names, self._update(bar)))
+
+
+class PlanStream(ExpressionStream):
+    """Streaming evaluation of an `ExpressionPlan`"""
+
+    def update(self, bar) -> float:
+        """consume a new bar and return the latest value of the expression"""
+        return self._update(bar)[0]
+
+
+def compile_fields(fields: List[Union[Text, Expression]], names: List[Text] = None) -> ExpressionDAG:
+    """
+    parse a list of fields into one shared `ExpressionDAG`
+
+    Example:
+        dag = compile_fields(["Mean($close, 20)/$close", "Std($close, 20)/Mean($close, 20)"], ["MA20", "CV20"])
+        df_feature = dag.evaluate(df)
+    """
+    if names is None:
+        names = [str(field) for field in fields]
+    expressions = [field if isinstance(field, Expression) else parser_expression(field) for field in fields]
+    return ExpressionDAG(expressions, names)
+
+
+def compile_field(field: Union[Text, Expression]) -> ExpressionPlan:
+    """
+    parse `field` into a reusable `ExpressionPlan`
+
+    Example:
+        plan = compile_field("Mean($close, 10)")
+        fast = plan.evaluate(df)
+    """
+    return ExpressionPlan(field if isinstance(field, Expression) else parser_expression(field))
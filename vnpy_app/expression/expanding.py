@@ -1,14 +1,27 @@
 import numpy as np
+import pandas as pd
+
+# noinspection PyProtectedMember
+from .rolling import _finite, _rolling_argmax, _rolling_count, rolling_slope, rolling_rsquare, rolling_resi
 
 
 class Expanding:
     """
-    1-D array expanding
+    1-D array expanding, the value of the whole history is returned by every `update`
+
+    Only running sums of the history are kept, so the memory of a state does not grow with the number of updates.
+    The statistics skip the infinite values as nan, as the batch evaluation does.
     """
 
     def __init__(self):
-        self.barv = list()
-        self.na_count = 0
+        self.size = 0
+        self.count = 0
+
+    def _push(self, val: float):
+        """`size` is the number of values so far and `count` the number of them which are not nan"""
+        self.size += 1
+        if not np.isnan(val):
+            self.count += 1
 
     def update(self, val: float) -> float:
         pass
@@ -20,12 +33,84 @@ class Mean(Expanding):
         self.vsum = 0
 
     def update(self, val: float) -> float:
-        self.barv.append(val)
-        if np.isnan(val):
-            self.na_count += 1
-        else:
+        val = _finite(val)
+        self._push(val)
+        if not np.isnan(val):
+            self.vsum += val
+        return self.vsum / self.count if self.count else np.nan
+
+
+class Sum(Expanding):
+    def __init__(self):
+        super(Sum, self).__init__()
+        self.vsum = 0
+
+    def update(self, val: float) -> float:
+        val = _finite(val)
+        self._push(val)
+        if not np.isnan(val):
             self.vsum += val
-        return self.vsum / (len(self.barv) - self.na_count)
+        return self.vsum if self.count else np.nan
+
+
+class Count(Expanding):
+    def update(self, val: float) -> float:
+        self._push(val)
+        return self.count
+
+
+class Var(Expanding):
+    """
+    1-D array expanding variance (ddof=1)
+
+    The power sums are accumulated on `val - shift`, the first not nan value, to limit the cancellation error.
+    """
+
+    def __init__(self):
+        super(Var, self).__init__()
+        self.shift = np.nan
+        self.x_sum = 0
+        self.x2_sum = 0
+
+    def update(self, val: float) -> float:
+        val = _finite(val)
+        self._push(val)
+        if not np.isnan(val):
+            if np.isnan(self.shift):
+                self.shift = val
+            _val = val - self.shift
+            self.x_sum += _val
+            self.x2_sum += _val * _val
+        N = self.count
+        if N < 2:
+            return np.nan
+        return max((self.x2_sum - self.x_sum * self.x_sum / N) / (N - 1), 0)
+
+
+class Std(Var):
+    def update(self, val: float) -> float:
+        return np.sqrt(super(Std, self).update(val))
+
+
+class Max(Expanding):
+    def __init__(self):
+        super(Max, self).__init__()
+        self.value = np.nan
+
+    def _better(self, val: float) -> bool:
+        return val > self.value
+
+    def update(self, val: float) -> float:
+        val = _finite(val)
+        self._push(val)
+        if not np.isnan(val) and (np.isnan(self.value) or self._better(val)):
+            self.value = val
+        return self.value
+
+
+class Min(Max):
+    def _better(self, val: float) -> bool:
+        return val < self.value
 
 
 # noinspection PyPep8Naming
@@ -42,16 +127,17 @@ class Slope(Expanding):
         self.xy_sum = 0
 
     def update(self, val: float) -> float:
-        self.barv.append(val)
-        size = len(self.barv)
-        if np.isnan(val):
-            self.na_count += 1
-        else:
+        val = _finite(val)
+        self._push(val)
+        size = self.size
+        if not np.isnan(val):
             self.x_sum += size
             self.x2_sum += size * size
             self.y_sum += val
             self.xy_sum += size * val
-        N = size - self.na_count
+        N = self.count
+        if N < 2:
+            return np.nan
         return (N * self.xy_sum - self.x_sum * self.y_sum) / (N * self.x2_sum - self.x_sum * self.x_sum)
 
 
@@ -69,16 +155,17 @@ class Resi(Expanding):
         self.xy_sum = 0
 
     def update(self, val: float) -> float:
-        self.barv.append(val)
-        size = len(self.barv)
-        if np.isnan(val):
-            self.na_count += 1
-        else:
+        val = _finite(val)
+        self._push(val)
+        size = self.size
+        if not np.isnan(val):
             self.x_sum += size
             self.x2_sum += size * size
             self.y_sum += val
             self.xy_sum += size * val
-        N = size - self.na_count
+        N = self.count
+        if N < 2:
+            return np.nan
         slope = (N * self.xy_sum - self.x_sum * self.y_sum) / (N * self.x2_sum - self.x_sum * self.x_sum)
         x_mean = self.x_sum / N
         y_mean = self.y_sum / N
@@ -101,17 +188,18 @@ class Rsquare(Expanding):
         self.xy_sum = 0
 
     def update(self, val: float) -> float:
-        self.barv.append(val)
-        size = len(self.barv)
-        if np.isnan(val):
-            self.na_count += 1
-        else:
+        val = _finite(val)
+        self._push(val)
+        size = self.size
+        if not np.isnan(val):
             self.x_sum += size
             self.x2_sum += size * size
             self.y_sum += val
             self.y2_sum += val * val
             self.xy_sum += size * val
-        N = size - self.na_count
+        N = self.count
+        if N < 2:
+            return np.nan
         rvalue = (N * self.xy_sum - self.x_sum * self.y_sum) / np.sqrt(
             (N * self.x2_sum - self.x_sum * self.x_sum) * (N * self.y2_sum - self.y_sum * self.y_sum))
         return rvalue * rvalue
@@ -126,21 +214,194 @@ def expanding(r: Expanding, a: np.array) -> np.array:
     return ret
 
 
-def expanding_mean(a: np.array) -> np.array:
-    r = Mean()
-    return expanding(r, a)
+def expanding_mean(a: np.array, starts: np.array = None) -> np.array:
+    return expanding_stats(a, "mean", starts)
+
+
+# noinspection PyPep8Naming
+def _regression_sums(a: np.array):
+    """
+    the sums of the linear regression of every expanding window, on x = 1, 2, ..., size, with y relative to the
+    first not nan value, which keeps the sums of y small, the infinite values are skipped as nan
+    """
+    a = np.asarray(a, dtype=np.float64)
+    a = np.where(np.isinf(a), np.nan, a)
+    mask = ~np.isnan(a)
+    reference = a[mask.argmax()] if mask.any() else 0
+    x = np.arange(1, len(a) + 1, dtype=np.float64)
+    m = mask.astype(np.float64)
+    y = np.where(mask, a - reference, 0)
+    N = np.cumsum(m)
+    x_sum = np.cumsum(m * x)
+    x2_sum = np.cumsum(m * x * x)
+    y_sum = np.cumsum(y)
+    y2_sum = np.cumsum(y * y)
+    xy_sum = np.cumsum(x * y)
+    return N, x, x_sum, x2_sum, y_sum, y2_sum, xy_sum, a - reference
+
+
+# noinspection PyPep8Naming
+def expanding_slope(a: np.array, starts: np.array = None) -> np.array:
+    """
+    vectorized expanding slope, same as `expanding(Slope(), a)`
+
+    NOTE: the values before the second not nan value are nan
+
+    With `starts`, the first row of the segment of every row (see `rolling._window_left`), every segment is expanded
+    on its own, as a rolling window as long as the array.
+    """
+    if starts is not None:
+        return rolling_slope(a, max(len(a), 1), starts)
+    N, _, x_sum, x2_sum, y_sum, _, xy_sum, _ = _regression_sums(a)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (N * xy_sum - x_sum * y_sum) / (N * x2_sum - x_sum * x_sum)
+    return np.where(N > 1, slope, np.nan)
+
+
+# noinspection PyPep8Naming
+def expanding_rsquare(a: np.array, starts: np.array = None) -> np.array:
+    """
+    vectorized expanding r-square, same as `expanding(Rsquare(), a)`
+    """
+    if starts is not None:
+        return rolling_rsquare(a, max(len(a), 1), starts)
+    N, _, x_sum, x2_sum, y_sum, y2_sum, xy_sum, _ = _regression_sums(a)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rvalue = (N * xy_sum - x_sum * y_sum) / np.sqrt(
+            (N * x2_sum - x_sum * x_sum) * (N * y2_sum - y_sum * y_sum))
+    return np.where(N > 1, rvalue * rvalue, np.nan)
+
+
+# noinspection PyPep8Naming
+def expanding_resi(a: np.array, starts: np.array = None) -> np.array:
+    """
+    vectorized expanding residual, same as `expanding(Resi(), a)`
+    """
+    if starts is not None:
+        return rolling_resi(a, max(len(a), 1), starts)
+    N, x, x_sum, x2_sum, y_sum, _, xy_sum, y = _regression_sums(a)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (N * xy_sum - x_sum * y_sum) / (N * x2_sum - x_sum * x_sum)
+        resi = y - (y_sum + slope * (N * x - x_sum)) / N
+    return np.where(N > 1, resi, np.nan)
+
+
+def expanding_idxmax(a: np.array, starts: np.array = None) -> np.array:
+    """
+    vectorized expanding idxmax, same as `series.expanding(min_periods=1).apply(lambda x: x.argmax() + 1)`
+    """
+    return _rolling_argmax(a, len(a), starts)
+
 
+def expanding_idxmin(a: np.array, starts: np.array = None) -> np.array:
+    """
+    vectorized expanding idxmin, same as `series.expanding(min_periods=1).apply(lambda x: x.argmin() + 1)`
+    """
+    return _rolling_argmax(-np.asarray(a, dtype=np.float64), len(a), starts)
+
+
+def _cumsum(a: np.array, starts: np.array = None) -> np.array:
+    """cumulative sums, restarted at every segment of `starts`"""
+    if starts is None:
+        return np.cumsum(a)
+    return pd.Series(a).groupby(starts, sort=False).cumsum().values
+
+
+def expanding_wma(a: np.array, starts: np.array = None) -> np.array:
+    """
+    vectorized expanding weighted mean, see `rolling_wma`
+    """
+    a = np.asarray(a, dtype=np.float64)
+    a = np.where(np.isinf(a), np.nan, a)
+    mask = ~np.isnan(a)
+    size = np.arange(1, len(a) + 1) if starts is None else np.arange(len(a)) - starts + 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return _cumsum(size * np.where(mask, a, 0), starts) / (size * (size + 1) / 2) / _cumsum(mask, starts)
+
+
+# max number of weights computed at once by `expanding_ema`
+CHUNK_SIZE = 1 << 22
 
-def expanding_slope(a: np.array) -> np.array:
-    r = Slope()
-    return expanding(r, a)
+
+def expanding_ema(a: np.array, starts: np.array = None) -> np.array:
+    """
+    expanding exponential weighted mean, where the decay of the row i is `1 - 2 / (i + 2)`, the one of a span of
+    i + 1, and nan (and infinite) values weigh as 0
+
+    NOTE: the decay changes with every row, so there is no recursion between rows, and every row is a dot product
+    over the whole history (O(n^2)); the weights are computed by blocks of rows as a matrix of powers
+    """
+    a = np.asarray(a, dtype=np.float64)
+    n = len(a)
+    mask = np.isfinite(a)
+    values = np.where(mask, a, 0)
+    ret = np.empty(n)
+    if starts is None:
+        starts = np.zeros(n, dtype=np.int64)
+    step = max(CHUNK_SIZE // max(n, 1), 1)
+    for start in range(0, n, step):
+        end = min(start + step, n)
+        index = np.arange(start, end)
+        # the history of a row starts with its segment
+        first = starts[start]
+        lag = index[:, None] - np.arange(first, end)
+        decay = 1 - 2 / (index - starts[start:end] + 2)
+        with np.errstate(divide="ignore"):
+            weights = np.where((lag >= 0) & (lag <= (index - starts[start:end])[:, None]),
+                               decay[:, None] ** np.maximum(lag, 0), 0)
+        ret[start:end] = weights @ values[first:end] / weights.sum(axis=1)
+    ret[_rolling_count(mask, max(n, 1), starts) == 0] = np.nan
+    return ret
 
 
-def expanding_rsquare(a: np.array) -> np.array:
-    r = Rsquare()
-    return expanding(r, a)
+# the statistics computed by `expanding_stats`
+EXPANDING_STATS = ("count", "sum", "mean", "var", "std", "max", "min")
 
 
-def expanding_resi(a: np.array) -> np.array:
-    r = Resi()
-    return expanding(r, a)
+# noinspection PyPep8Naming
+def expanding_stats(a: np.array, func: str, starts: np.array = None) -> np.array:
+    """
+    vectorized expanding statistic, same as `pd.Series.expanding(min_periods=1).<func>()`
+
+    The sums are cumulative sums of the values relative to the first not nan value, which keeps them small, so every
+    row is O(1) whatever the length of the history. With `starts`, every segment is expanded on its own.
+    """
+    if func not in EXPANDING_STATS:
+        raise ValueError("Unsupported expanding statistic {}, use one of {}".format(func, list(EXPANDING_STATS)))
+    a = np.asarray(a, dtype=np.float64)
+    if starts is not None:
+        ret = np.empty(len(a))
+        bounds = np.r_[0, np.flatnonzero(np.diff(starts)) + 1, len(a)]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            ret[start:end] = expanding_stats(a[start:end], func)
+        return ret
+    # pandas counts the infinite values, but skips them as nan in the other statistics
+    if func == "count":
+        return np.cumsum(~np.isnan(a), dtype=np.float64)
+    mask = np.isfinite(a)
+    ret = np.full(len(a), np.nan)
+    if not mask.any():
+        return ret
+    first = mask.argmax()
+    a, mask = a[first:], mask[first:]
+    if func in ("max", "min"):
+        accumulate = np.maximum.accumulate if func == "max" else np.minimum.accumulate
+        ret[first:] = accumulate(np.where(mask, a, -np.inf if func == "max" else np.inf))
+        return ret
+    reference = a[0]
+    y = np.where(mask, a - reference, 0)
+    N = np.cumsum(mask, dtype=np.float64)
+    y_sum = np.cumsum(y)
+    if func == "sum":
+        ret[first:] = y_sum + N * reference
+    elif func == "mean":
+        ret[first:] = reference + y_sum / N
+    else:
+        y2_sum = np.cumsum(y * y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = np.maximum(y2_sum - y_sum * y_sum / N, 0) / (N - 1)
+        # pandas forces the variance of equal values, i.e. of the rows where every y so far is 0
+        value[np.cumsum(y != 0) == 0] = 0
+        value[N < 2] = np.nan
+        ret[first:] = np.sqrt(value) if func == "std" else value
+    return ret
@@ -1,19 +1,106 @@
 import numpy as np
 import pandas as pd
-from scipy.stats import percentileofscore
 
+from . import cross_section, expanding, rolling
 # noinspection PyProtectedMember
-from .expanding import expanding_slope, expanding_rsquare, expanding_resi
+from .expanding import expanding_slope, expanding_rsquare, expanding_resi, expanding_idxmax, expanding_idxmin, \
+    expanding_wma, expanding_ema, expanding_stats
 # noinspection PyProtectedMember
-from .rolling import rolling_slope, rolling_rsquare, rolling_resi
+from .rolling import rolling_slope, rolling_rsquare, rolling_resi, rolling_idxmax, rolling_idxmin, rolling_mad, \
+    rolling_wma, rolling_rank, rolling_stats, shift, block_apply, _rolling_count, SegmentIndexer
 from .base import Expression, Feature
 
 np.seterr(invalid="ignore")
 
+# the names of the levels of the (datetime, instrument) index of a panel
+DATETIME_LEVEL = "datetime"
+INSTRUMENT_LEVEL = "instrument"
+
+
+def get_instrument_level(index: pd.Index):
+    """the level of the instruments in the index of a panel, `instrument` or else the second one, None if `index`
+    is the index of a single instrument"""
+    if not isinstance(index, pd.MultiIndex):
+        return None
+    if INSTRUMENT_LEVEL in index.names:
+        return index.names.index(INSTRUMENT_LEVEL)
+    return 1
+
+
+def get_groups(index: pd.Index) -> np.ndarray:
+    """
+    the datetime of every row of a panel as an integer code, for the cross-sectional operators; every row is its own
+    datetime for a single instrument
+    """
+    level = get_instrument_level(index)
+    if level is None:
+        return np.arange(len(index))
+    if DATETIME_LEVEL in index.names:
+        level = index.names.index(DATETIME_LEVEL)
+    else:
+        level = 1 if level == 0 else 0
+    codes = np.asarray(index.codes[level], dtype=np.int64)
+    # nan datetimes are a group of their own
+    return np.where(codes < 0, codes.max(initial=-1) + 1, codes)
+
+
+def get_starts(index: pd.Index):
+    """
+    the first row of the instrument of every row of a panel, whose rows are sorted by instrument, None for a single
+    instrument
+
+    The rolling operators take it so that their windows never cross two instruments.
+    """
+    level = get_instrument_level(index)
+    if level is None:
+        return None
+    codes = np.asarray(index.codes[level])
+    new = np.ones(len(codes), dtype=bool)
+    new[1:] = codes[1:] != codes[:-1]
+    if len(np.unique(codes[new])) != new.sum():
+        raise ValueError("The rows of a panel should be sorted by instrument, see `ExpressionDAG.evaluate`")
+    return np.maximum.accumulate(np.where(new, np.arange(len(codes)), 0))
+
 
 # noinspection PyAbstractClass
 class ExpressionOps(Expression):
-    pass
+
+    @staticmethod
+    def _load(df, feature):
+        """fetch the value of `feature` from `df`, which is a DataFrame or a dict of computed values keyed by
+        the canonical expression string; constants and already computed series are returned unchanged"""
+        if isinstance(feature, Expression):
+            key = str(feature)
+            if key in df:
+                return df[key]
+        return feature
+
+    @staticmethod
+    def _values(series) -> np.ndarray:
+        """the ndarray of a pd.Series, or of an ndarray of the numpy backend"""
+        if isinstance(series, pd.Series):
+            return series.values
+        return np.asarray(series)
+
+    @staticmethod
+    def _wrap(values, like):
+        """the result `values` of an operator on `like`: a pd.Series on the index of `like` for the pandas backend,
+        an ndarray for the numpy backend"""
+        if isinstance(values, pd.Series):
+            values = values.values
+        return pd.Series(values, index=like.index) if isinstance(like, pd.Series) else values
+
+    @staticmethod
+    def _starts(series):
+        """the first row of the instrument of every row if `series` is a panel, see `get_starts`"""
+        return get_starts(series.index) if isinstance(series, pd.Series) else None
+
+    @staticmethod
+    def _get_back(feature):
+        """`get_longest_back_rolling` of a sub-expression, constants are 0"""
+        if isinstance(feature, Expression):
+            return feature.get_longest_back_rolling()
+        return 0
 
 
 ########################################################################################################################
@@ -29,6 +116,9 @@ class ElemOperator(ExpressionOps):
     def __str__(self):
         return "{}({})".format(type(self).__name__, self.feature)
 
+    def get_longest_back_rolling(self):
+        return self._get_back(self.feature)
+
     def is_root(self):
         return False
 
@@ -40,7 +130,7 @@ class NpElemOperator(ElemOperator):
         super(NpElemOperator, self).__init__(feature)
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
+        series = self._load(df, self.feature)
         return getattr(np, self.func)(series)
 
     def is_root(self):
@@ -80,6 +170,9 @@ class PairOperator(ExpressionOps):
     def __str__(self):
         return "{}({},{})".format(type(self).__name__, self.feature_left, self.feature_right)
 
+    def get_longest_back_rolling(self):
+        return max(self._get_back(self.feature_left), self._get_back(self.feature_right))
+
 
 class NpPairOperator(PairOperator):
 
@@ -88,10 +181,8 @@ class NpPairOperator(PairOperator):
         super(NpPairOperator, self).__init__(feature_left, feature_right)
 
     def __call__(self, df):
-        series_left = df.loc[:, self.feature_left.__str__()] \
-            if self.feature_left.__str__() in df.columns else self.feature_left
-        series_right = df.loc[:, self.feature_right.__str__()] \
-            if self.feature_right.__str__() in df.columns else self.feature_right
+        series_left = self._load(df, self.feature_left)
+        series_right = self._load(df, self.feature_right)
         return getattr(np, self.func)(series_left, series_right)
 
     def is_root(self):
@@ -205,7 +296,14 @@ class If(ExpressionOps):
         return "If({},{},{})".format(self.condition, self.feature_left, self.feature_right)
 
     def __call__(self, df):
-        return df.loc[:, self.feature_left].where(df.loc[:, self.condition], df.loc[:, self.feature_right])
+        series_left = self._load(df, self.feature_left)
+        series_right = self._load(df, self.feature_right)
+        condition = self._load(df, self.condition)
+        return self._wrap(np.where(condition, series_left, series_right), condition)
+
+    def get_longest_back_rolling(self):
+        return max(self._get_back(self.condition), self._get_back(self.feature_left),
+                   self._get_back(self.feature_right))
 
     def is_root(self):
         condition1 = isinstance(self.feature_left, (Feature, float, int, pd.Series))
@@ -232,9 +330,37 @@ class Rolling(ExpressionOps):
     def __str__(self):
         return "{}({},{})".format(type(self).__name__, self.feature, self.n)
 
+    def _window(self, series, starts=None):
+        """the pandas rolling (expanding if n is 0) window of `series`, by instrument for a panel"""
+        series = pd.Series(self._values(series))
+        if starts is not None:
+            return series.rolling(SegmentIndexer(window_size=self.n or len(series), starts=starts), min_periods=1)
+        return series.expanding(min_periods=1) if self.n == 0 else series.rolling(self.n, min_periods=1)
+
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
-        return getattr(series.rolling(self.n, min_periods=1), self.func)()
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
+        if self.n != 0 and self.func in rolling.FUSED_STATS:
+            values = rolling_stats(self._values(series), [(self.n, self.func)], 1, starts)[(self.n, self.func)]
+            return self._wrap(values, series)
+        if self.n == 0 and self.func in expanding.EXPANDING_STATS:
+            return self._wrap(expanding_stats(self._values(series), self.func, starts), series)
+        return self._wrap(getattr(self._window(series, starts), self.func)(), series)
+
+    def stream(self):
+        """the stateful version of the operator whose `update(val)` returns the latest value, see `rolling.py`"""
+        name = type(self).__name__
+        if self.n == 0 and hasattr(expanding, name):
+            return getattr(expanding, name)()
+        state = getattr(rolling, name, rolling.Rolling)
+        if state is rolling.Rolling:
+            raise NotImplementedError("The operator [{}] does not support streaming evaluation".format(name))
+        return state(self.n)
+
+    def get_longest_back_rolling(self):
+        if self.n == 0:
+            return np.inf
+        return self._get_back(self.feature) + self.n - 1
 
     def is_root(self):
         condition = isinstance(self.feature, (float, int, pd.Series))
@@ -247,8 +373,16 @@ class Ref(Rolling):
         super(Ref, self).__init__(feature, n, "ref")
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
-        return series.shift(self.n)
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
+        values = shift(self._values(series), self.n)
+        if starts is not None:
+            # the value of another instrument
+            values[shift(starts, self.n) != starts] = np.nan
+        return self._wrap(values, series)
+
+    def get_longest_back_rolling(self):
+        return self._get_back(self.feature) + self.n
 
 
 class Mean(Rolling):
@@ -303,12 +437,11 @@ class IdxMax(Rolling):
         super(IdxMax, self).__init__(feature, n, "idxmax")
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
         if self.n == 0:
-            series = series.expanding(min_periods=1).apply(lambda x: x.argmin() + 1, raw=True)
-        else:
-            series = series.rolling(self.n, min_periods=1).apply(lambda x: x.argmin() + 1, raw=True)
-        return series
+            return self._wrap(expanding_idxmax(self._values(series), starts), series)
+        return self._wrap(rolling_idxmax(self._values(series), self.n, starts), series)
 
 
 class Min(Rolling):
@@ -323,12 +456,11 @@ class IdxMin(Rolling):
         super(IdxMin, self).__init__(feature, n, "idxmin")
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
         if self.n == 0:
-            series = series.expanding(min_periods=1).apply(lambda x: x.argmin() + 1, raw=True)
-        else:
-            series = series.rolling(self.n, min_periods=1).apply(lambda x: x.argmin() + 1, raw=True)
-        return series
+            return self._wrap(expanding_idxmin(self._values(series), starts), series)
+        return self._wrap(rolling_idxmin(self._values(series), self.n, starts), series)
 
 
 class Quantile(Rolling):
@@ -340,13 +472,17 @@ class Quantile(Rolling):
     def __str__(self):
         return "{}({},{},{})".format(type(self).__name__, self.feature, self.n, self.qscore)
 
+    def stream(self):
+        return rolling.Quantile(self.n, self.qscore)
+
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
-        if self.n == 0:
-            series = series.expanding(min_periods=1).apply(lambda x: np.quantile(x, self.qscore), raw=True)
-        else:
-            series = series.rolling(self.n, min_periods=1).apply(lambda x: np.quantile(x, self.qscore), raw=True)
-        return series
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
+        values = self._values(series)
+        quantile = self._window(series, starts).quantile(self.qscore).values
+        # the quantile of a window with any nan is nan, as `np.quantile`, pandas takes the infinite values as nan
+        has_nan = _rolling_count(~np.isfinite(values), self.n or len(values), starts) > 0
+        return self._wrap(np.where(has_nan, np.nan, quantile), series)
 
 
 class Med(Rolling):
@@ -361,17 +497,16 @@ class Mad(Rolling):
         super(Mad, self).__init__(feature, n, "mad")
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
+        series = self._load(df, self.feature)
 
         def mad(x):
             x1 = x[~np.isnan(x)]
             return np.mean(np.abs(x1 - x1.mean()))
 
+        starts = self._starts(series)
         if self.n == 0:
-            series = series.expanding(min_periods=1).apply(mad, raw=True)
-        else:
-            series = series.rolling(self.n, min_periods=1).apply(mad, raw=True)
-        return series
+            return self._wrap(self._window(series, starts).apply(mad, raw=True), series)
+        return self._wrap(rolling_mad(self._values(series), self.n, starts), series)
 
 
 class Rank(Rolling):
@@ -380,20 +515,13 @@ class Rank(Rolling):
         super(Rank, self).__init__(feature, n, "rank")
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
-        rolling_or_expending = series.expanding(min_periods=1) if self.n == 0 else series.rolling(self.n, min_periods=1)
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
+        rolling_or_expending = self._window(series, starts)
+        # NOTE: both the rolling rank of pandas (a skiplist) and `rolling_rank` (a `SortedWindow`) are O(log w)
         if hasattr(rolling_or_expending, "rank"):
-            return rolling_or_expending.rank(pct=True)
-
-        def rank(x):
-            if np.isnan(x[-1]):
-                return np.nan
-            x1 = x[~np.isnan(x)]
-            if x1.shape[0] == 0:
-                return np.nan
-            return percentileofscore(x1, x1[-1]) / 100
-
-        return rolling_or_expending.apply(rank, raw=True)
+            return self._wrap(rolling_or_expending.rank(pct=True), series)
+        return self._wrap(rolling_rank(self._values(series), self.n, starts), series)
 
 
 class Count(Rolling):
@@ -408,12 +536,21 @@ class Delta(Rolling):
         super(Delta, self).__init__(feature, n, "delta")
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
+        values = self._values(series)
         if self.n == 0:
-            series = series - series.iloc[0]
-        else:
-            series = series - series.shift(self.n)
-        return series
+            # the first value of the instrument
+            return self._wrap(values - (values[0] if starts is None else values[starts]), series)
+        previous = shift(values, self.n)
+        if starts is not None:
+            previous[shift(starts, self.n) != starts] = np.nan
+        return self._wrap(values - previous, series)
+
+    def get_longest_back_rolling(self):
+        if self.n == 0:
+            return np.inf
+        return self._get_back(self.feature) + self.n
 
 
 # support pair-wise rolling like `Slope(A, B, N)`
@@ -423,12 +560,11 @@ class Slope(Rolling):
         super(Slope, self).__init__(feature, n, "slope")
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
         if self.n == 0:
-            series = pd.Series(expanding_slope(series.values), index=series.index)
-        else:
-            series = pd.Series(rolling_slope(series.values, self.n), index=series.index)
-        return series
+            return self._wrap(expanding_slope(self._values(series), starts), series)
+        return self._wrap(rolling_slope(self._values(series), self.n, starts), series)
 
 
 class Rsquare(Rolling):
@@ -437,13 +573,14 @@ class Rsquare(Rolling):
         super(Rsquare, self).__init__(feature, n, "rsquare")
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
         if self.n == 0:
-            series = pd.Series(expanding_rsquare(series.values), index=series.index)
-        else:
-            series = pd.Series(rolling_rsquare(series.values, self.n), index=series.index)
-            series.loc[np.isclose(series.rolling(self.n, min_periods=1).std(), 0, atol=2e-05)] = np.nan
-        return series
+            return self._wrap(expanding_rsquare(self._values(series), starts), series)
+        values = rolling_rsquare(self._values(series), self.n, starts)
+        std = rolling_stats(values, [(self.n, "std")], 1, starts)[(self.n, "std")]
+        values[np.isclose(std, 0, atol=2e-05)] = np.nan
+        return self._wrap(values, series)
 
 
 class Resi(Rolling):
@@ -452,12 +589,11 @@ class Resi(Rolling):
         super(Resi, self).__init__(feature, n, "resi")
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
         if self.n == 0:
-            series = pd.Series(expanding_resi(series.values), index=series.index)
-        else:
-            series = pd.Series(rolling_resi(series.values, self.n), index=series.index)
-        return series
+            return self._wrap(expanding_resi(self._values(series), starts), series)
+        return self._wrap(rolling_resi(self._values(series), self.n, starts), series)
 
 
 class WMA(Rolling):
@@ -466,18 +602,11 @@ class WMA(Rolling):
         super(WMA, self).__init__(feature, n, "wma")
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
-
-        def weighted_mean(x):
-            w = np.arange(len(x)) + 1
-            w = w / w.sum()
-            return np.nanmean(w * x)
-
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
         if self.n == 0:
-            series = series.expanding(min_periods=1).apply(weighted_mean, raw=True)
-        else:
-            series = series.rolling(self.n, min_periods=1).apply(weighted_mean, raw=True)
-        return series
+            return self._wrap(expanding_wma(self._values(series), starts), series)
+        return self._wrap(rolling_wma(self._values(series), self.n, starts), series)
 
 
 class EMA(Rolling):
@@ -486,21 +615,20 @@ class EMA(Rolling):
         super(EMA, self).__init__(feature, n, "ema")
 
     def __call__(self, df):
-        series = df.loc[:, self.feature.__str__()] if self.feature.__str__() in df.columns else self.feature
-
-        def exp_weighted_mean(x):
-            a = 1 - 2 / (1 + len(x))
-            w = a ** np.arange(len(x))[::-1]
-            w /= w.sum()
-            return np.nansum(w * x)
-
+        series = self._load(df, self.feature)
+        starts = self._starts(series)
         if self.n == 0:
-            series = series.expanding(min_periods=1).apply(exp_weighted_mean, raw=True)
-        elif 0 < self.n < 1:
-            series = series.ewm(alpha=self.n, min_periods=1).mean()
-        else:
-            series = series.ewm(span=self.n, min_periods=1).mean()
-        return series
+            return self._wrap(expanding_ema(self._values(series), starts), series)
+        _series = pd.Series(self._values(series))
+        if starts is not None:
+            _series = _series.groupby(starts, sort=False)
+        if 0 < self.n < 1:
+            return self._wrap(_series.ewm(alpha=self.n, min_periods=1).mean(), series)
+        return self._wrap(_series.ewm(span=self.n, min_periods=1).mean(), series)
+
+    def get_longest_back_rolling(self):
+        # the weights of `ewm` never reach 0, every value depends on the whole history
+        return np.inf
 
 
 ########################################################################################################################
@@ -519,16 +647,32 @@ class PairRolling(ExpressionOps):
         return "{}({},{},{})".format(type(self).__name__, self.feature_left, self.feature_right, self.n)
 
     def __call__(self, df):
-        series_left = df.loc[:, self.feature_left.__str__()] \
-            if self.feature_left.__str__() in df.columns else self.feature_left
-        series_right = df.loc[:, self.feature_right.__str__()] \
-            if self.feature_right.__str__() in df.columns else self.feature_right
+        series_left = self._load(df, self.feature_left)
+        series_right = self._load(df, self.feature_right)
+        starts = self._starts(series_left)
+        _series_left = pd.Series(self._values(series_left))
+        _series_right = pd.Series(self._values(series_right))
+
+        if starts is not None:
+            indexer = SegmentIndexer(window_size=self.n or len(_series_left), starts=starts)
+            series = getattr(_series_left.rolling(indexer, min_periods=1), self.func)(_series_right)
+        elif self.n == 0:
+            series = getattr(_series_left.expanding(min_periods=1), self.func)(_series_right)
+        else:
+            def func(left, right):
+                return getattr(pd.Series(left).rolling(self.n, min_periods=1), self.func)(pd.Series(right)).values
+
+            series = block_apply(func, self.n, _series_left.values, _series_right.values)
+        return self._wrap(series, series_left)
+
+    def stream(self):
+        """the stateful version of the operator whose `update(val_left, val_right)` returns the latest value"""
+        return getattr(rolling, type(self).__name__)(self.n)
 
+    def get_longest_back_rolling(self):
         if self.n == 0:
-            series = getattr(series_left.expanding(min_periods=1), self.func)(series_right)
-        else:
-            series = getattr(series_left.rolling(self.n, min_periods=1), self.func)(series_right)
-        return series
+            return np.inf
+        return max(self._get_back(self.feature_left), self._get_back(self.feature_right)) + self.n - 1
 
     def is_root(self):
         condition1 = isinstance(self.feature_left, (Feature, float, int, pd.Series))
@@ -548,6 +692,66 @@ class Cov(PairRolling):
         super(Cov, self).__init__(feature_left, feature_right, n, "cov")
 
 
+########################################################################################################################
+# Cross-Sectional Operator #
+########################################################################################################################
+
+class CSOperator(ElemOperator):
+    """
+    Cross-sectional operator, over all instruments of every datetime of a panel
+
+    The rows are sorted by datetime and value with one `np.lexsort`, and every datetime is a segment of the sorted
+    rows (see `cross_section.py`), so there is no call per datetime.
+    """
+
+    def __init__(self, feature, func):
+        self.func = func
+        super(CSOperator, self).__init__(feature)
+
+    def _cross_section(self, values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+        return getattr(cross_section, self.func)(values, groups)
+
+    def __call__(self, df):
+        series = self._load(df, self.feature)
+        values = self._values(series)
+        if values.ndim == 0:
+            # a constant, or the bar of a stream, is a cross-section of one instrument
+            return self._cross_section(values[None].astype(np.float64), np.zeros(1, dtype=np.int64))[0]
+        groups = get_groups(series.index) if isinstance(series, pd.Series) else np.arange(len(values))
+        return self._wrap(self._cross_section(values, groups), series)
+
+
+class CSRank(CSOperator):
+
+    def __init__(self, feature):
+        super(CSRank, self).__init__(feature, "cs_rank")
+
+
+class CSZScore(CSOperator):
+
+    def __init__(self, feature):
+        super(CSZScore, self).__init__(feature, "cs_zscore")
+
+
+class CSDemean(CSOperator):
+
+    def __init__(self, feature):
+        super(CSDemean, self).__init__(feature, "cs_demean")
+
+
+class CSQuantile(CSOperator):
+
+    def __init__(self, feature, qscore):
+        super(CSQuantile, self).__init__(feature, "cs_quantile")
+        self.qscore = qscore
+
+    def __str__(self):
+        return "{}({},{})".format(type(self).__name__, self.feature, self.qscore)
+
+    def _cross_section(self, values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+        return cross_section.cs_quantile(values, groups, self.qscore)
+
+
 OpsList = [
     Rolling,
     Ref,
@@ -593,6 +797,10 @@ OpsList = [
     IdxMax,
     IdxMin,
     If,
+    CSRank,
+    CSZScore,
+    CSDemean,
+    CSQuantile,
 ]
 
 
@@ -0,0 +1,115 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Text
+
+import numpy as np
+import pandas as pd
+
+from .base import Feature
+from .dag import ExpressionDAG, as_dtype, get_data, get_length
+
+
+def _attach(name: Text, shape: tuple, dtype=np.float64):
+    """attach the shared memory `name` as an array of `shape`"""
+    memory = shared_memory.SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def _evaluate_partition(expressions: list, rows: List[int], columns: List[Text], n_rows: int, input_name: Text,
+                        output_name: Text, n_outputs: int, dtype=np.float64):
+    """
+    evaluate `expressions` on the shared input block and write them into `rows` of the shared output matrix, and
+    return the dtypes of the outputs
+    """
+    input_memory, block = _attach(input_name, (len(columns), n_rows))
+    output_memory, matrix = _attach(output_name, (n_outputs, n_rows), dtype)
+    try:
+        dag = ExpressionDAG(expressions, [str(expression) for expression in expressions])
+        values = dag._compute(dict(zip(columns, block)), backend="numpy")
+        for row, value in zip(rows, values):
+            matrix[row] = value
+        return [np.asarray(value).dtype for value in values]
+    finally:
+        del block, matrix
+        input_memory.close()
+        output_memory.close()
+
+
+def evaluate_parallel(dag: ExpressionDAG, df, n_workers: int = None, columns: List[Text] = None,
+                      dtype=np.float64) -> pd.DataFrame:
+    """
+    evaluate `dag` on `df` in a pool of processes
+
+    The features used by the DAG are copied once into a shared memory block, the outputs are split into
+    independent sub-DAGs by `ExpressionDAG.partition`, and every worker evaluates its sub-DAG with the numpy backend
+    and writes its outputs into a preallocated shared output matrix, so neither the inputs nor the results are
+    pickled. It pays off for hundreds of fields on long series, e.g. a factor library on a quarter of ticks.
+
+    Parameters
+    ----------
+    dag : ExpressionDAG
+        the compiled fields
+    df : pd.DataFrame, dict or np.ndarray
+        raw data of one instrument, see `ExpressionDAG.evaluate`, a panel is not supported
+    n_workers : int
+        the number of processes, `os.cpu_count()` by default
+    columns : list
+        the names of the columns of a 2-D block
+    dtype : np.dtype
+        the dtype of the output matrix, e.g. np.float32, the nodes are computed in float64 anyway
+
+    Returns
+    -------
+    pd.DataFrame
+        the feature matrix, one column per name, on the index of `df` if it is a DataFrame; the float outputs are
+        stored as `dtype`, and the others, e.g. the booleans of a comparison, are cast back to their own dtype as
+        in `ExpressionDAG.evaluate`
+    """
+    index = df.index if isinstance(df, pd.DataFrame) else None
+    data = get_data(df, "numpy", columns)
+    n_workers = n_workers or os.cpu_count() or 1
+    parts = dag.partition(n_workers)
+    if len(parts) <= 1:
+        values = dag._compute(data, backend="numpy")
+        df_feature = pd.DataFrame({i: np.broadcast_to(as_dtype(np.asarray(value), dtype), get_length(data))
+                                   for i, value in enumerate(values)}, index=index)
+        df_feature.columns = dag.names
+        return df_feature
+
+    features = [key for key, node in dag.nodes.items() if isinstance(node, Feature)]
+    n_rows = get_length(data)
+    n_outputs = len(dag.outputs)
+    input_memory = shared_memory.SharedMemory(create=True, size=max(len(features) * n_rows * 8, 1))
+    output_memory = shared_memory.SharedMemory(create=True, size=max(n_outputs * n_rows * np.dtype(dtype).itemsize, 1))
+    block = matrix = None
+    try:
+        block = np.ndarray((len(features), n_rows), dtype=np.float64, buffer=input_memory.buf)
+        for i, feature in enumerate(features):
+            block[i] = np.asarray(data[feature], dtype=np.float64)
+        matrix = np.ndarray((n_outputs, n_rows), dtype=dtype, buffer=output_memory.buf)
+        dtypes = {}
+        for i, output in enumerate(dag.outputs):
+            if not isinstance(output, Text):
+                matrix[i] = output
+                dtypes[i] = np.asarray(output).dtype
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(parts))) as executor:
+            futures = [executor.submit(_evaluate_partition, [dag.nodes[dag.outputs[i]] for i in rows], rows,
+                                       features, n_rows, input_memory.name, output_memory.name, n_outputs, dtype)
+                       for rows in parts]
+            for rows, future in zip(parts, futures):
+                dtypes.update(zip(rows, future.result()))
+        # one copy out of the shared memory, which is released below
+        df_feature = pd.DataFrame(matrix.T.copy(), index=index)
+        others = {i: value for i, value in dtypes.items() if value.kind != "f"}
+        if others:
+            df_feature = df_feature.astype(others)
+        df_feature.columns = dag.names
+    finally:
+        # the views should be released before the memory is closed
+        block = matrix = None
+        input_memory.close()
+        input_memory.unlink()
+        output_memory.close()
+        output_memory.unlink()
+    return df_feature
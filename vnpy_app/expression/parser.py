@@ -1,40 +1,234 @@
+import operator
 import re
+from functools import lru_cache
 
 # noinspection PyUnresolvedReferences
 from .base import Feature
 # noinspection PyUnresolvedReferences
-from .ops import Operators
+from .ops import Operators, ElemOperator, PairOperator, If
 from .base import Expression
 
+# the number of distinct fields whose parsed expression is kept by `parser_expression`
+PARSE_CACHE_SIZE = 4096
 
-def parse_field(field):
-    # Following patterns will be matched:
-    # - $close -> Feature("close")
-    # - $close5 -> Feature("close5")
-    # - $open+$close -> Feature("open")+Feature("close")
-    if not isinstance(field, str):
-        field = str(field)
-    return re.sub(r"\$(\w+)", r'Feature("\1")', re.sub(r"(\w+\s*)\(", r"Operators.\1(", field))
+TOKEN_PATTERN = re.compile(
+    r"\s*(?:"
+    r"(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"
+    r"|(?P<feature>\$\w+)"
+    r"|(?P<name>[A-Za-z_]\w*)"
+    r"|(?P<op>\*\*|>=|<=|==|!=|[-+*/<>&|(),])"
+    r")"
+)
 
+# operator -> (name of the operator in `Operators`, python operator of the constant folding)
+BINARY_OPERATORS = {
+    "|": ("Or", operator.or_),
+    "&": ("And", operator.and_),
+    "+": ("Add", operator.add),
+    "-": ("Sub", operator.sub),
+    "*": ("Mul", operator.mul),
+    "/": ("Div", operator.truediv),
+    "**": ("Power", operator.pow),
+    ">": ("Gt", operator.gt),
+    ">=": ("Ge", operator.ge),
+    "<": ("Lt", operator.lt),
+    "<=": ("Le", operator.le),
+    "==": ("Eq", operator.eq),
+    "!=": ("Ne", operator.ne),
+}
 
-def parser_expression(field):
-    expression = eval(parse_field(field))
+# the operands of these operators are sorted, so `$close*2` and `2*$close` are the same expression
+COMMUTATIVE_OPERATORS = {"Add", "Mul", "Eq", "Ne", "And", "Or", "Greater", "Less"}
+
+
+def tokenize(field: str) -> list:
+    """split a field into (kind, text) tokens, kind is one of number / feature / name / op"""
+    tokens = []
+    pos = 0
+    field = field.rstrip()
+    while pos < len(field):
+        match = TOKEN_PATTERN.match(field, pos)
+        if match is None or match.end() == pos:
+            raise ValueError("Invalid character at {} of field {}".format(pos, field))
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+def _sort_key(operand):
+    # sub-expressions first, then constants
+    if isinstance(operand, Expression):
+        return 0, str(operand)
+    return 1, repr(operand)
+
+
+def make_expression(name: str, *args):
+    """
+    build the operator `name` on `args`, the operands of a commutative operator are put in canonical order, and an
+    element-wise operator on constants is folded into a constant
+    """
+    if name in COMMUTATIVE_OPERATORS:
+        args = sorted(args, key=_sort_key)
+    expression = getattr(Operators, name)(*args)
+    if isinstance(expression, (ElemOperator, PairOperator, If)) and not any(
+            isinstance(arg, Expression) for arg in args):
+        value = expression({})
+        return value.item() if hasattr(value, "item") else value
     return expression
 
 
+class Parser:
+    """
+    Recursive descent parser of a field, with the precedence of python operators
+
+        comparison := bit_or [(">" | ">=" | "<" | "<=" | "==" | "!=") bit_or]
+        bit_or := bit_and ("|" bit_and)*
+        bit_and := arith ("&" arith)*
+        arith := term (("+" | "-") term)*
+        term := factor (("*" | "/") factor)*
+        factor := ("-" | "+") factor | power
+        power := atom ["**" factor]
+        atom := number | feature | name "(" [comparison ("," comparison)*] ")" | "(" comparison ")"
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self.tokens = tokenize(field)
+        # the text of each operator token, "" for other tokens and at the end
+        self.ops = [text if kind == "op" else "" for kind, text in self.tokens] + [""]
+        self.pos = 0
+
+    def parse(self):
+        expression = self.comparison()
+        if self.pos != len(self.tokens):
+            self.error("Unexpected token {}".format(self.tokens[self.pos][1]))
+        return expression
+
+    def error(self, message: str):
+        raise ValueError("{} in field {}".format(message, self.field))
+
+    def peek(self) -> str:
+        return self.ops[self.pos]
+
+    def expect(self, text: str):
+        if self.peek() != text:
+            self.error("Expected {}".format(text))
+        self.pos += 1
+
+    def binary(self, op: str, left, right):
+        name, func = BINARY_OPERATORS[op]
+        if not isinstance(left, Expression) and not isinstance(right, Expression):
+            return func(left, right)
+        return make_expression(name, left, right)
+
+    def comparison(self):
+        left = self.bit_or()
+        op = self.peek()
+        if op in (">", ">=", "<", "<=", "==", "!="):
+            self.pos += 1
+            left = self.binary(op, left, self.bit_or())
+            if self.peek() in (">", ">=", "<", "<=", "==", "!="):
+                self.error("Chained comparison")
+        return left
+
+    def bit_or(self):
+        left = self.bit_and()
+        while self.peek() == "|":
+            self.pos += 1
+            left = self.binary("|", left, self.bit_and())
+        return left
+
+    def bit_and(self):
+        left = self.arith()
+        while self.peek() == "&":
+            self.pos += 1
+            left = self.binary("&", left, self.arith())
+        return left
+
+    def arith(self):
+        left = self.term()
+        while self.peek() in ("+", "-"):
+            op = self.peek()
+            self.pos += 1
+            left = self.binary(op, left, self.term())
+        return left
+
+    def term(self):
+        left = self.factor()
+        while self.peek() in ("*", "/"):
+            op = self.peek()
+            self.pos += 1
+            left = self.binary(op, left, self.factor())
+        return left
+
+    def factor(self):
+        op = self.peek()
+        if op in ("-", "+"):
+            self.pos += 1
+            operand = self.factor()
+            if op == "+":
+                return operand
+            return make_expression("Mul", operand, -1) if isinstance(operand, Expression) else -operand
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() == "**":
+            self.pos += 1
+            return self.binary("**", base, self.factor())
+        return base
+
+    def atom(self):
+        if self.pos >= len(self.tokens):
+            self.error("Unexpected end")
+        kind, text = self.tokens[self.pos]
+        self.pos += 1
+        if kind == "number":
+            return float(text) if any(c in text for c in ".eE") else int(text)
+        if kind == "feature":
+            return Feature(text[1:])
+        if kind == "name":
+            self.expect("(")
+            args = []
+            if self.peek() != ")":
+                args.append(self.comparison())
+                while self.peek() == ",":
+                    self.pos += 1
+                    args.append(self.comparison())
+            self.expect(")")
+            return make_expression(text, *args)
+        if text == "(":
+            expression = self.comparison()
+            self.expect(")")
+            return expression
+        self.error("Unexpected token {}".format(text))
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse(field: str):
+    return Parser(field).parse()
+
+
+def parser_expression(field):
+    """
+    parse a field like `Mean($close, 5)/$close` into an `Expression`
+
+    Parsed expressions are cached, the same object is returned for the same field, which is safe as evaluations
+    never modify an expression.
+    """
+    if not isinstance(field, str):
+        field = str(field)
+    return _parse(field)
+
+
 def calculate_expression(df, expression):
+    # NOTE: `expression` is left untouched, so it could be evaluated again on new data
+    from .dag import ExpressionPlan  # pylint: disable=C0415
+
     if not isinstance(expression, Expression):
         return expression
-    elif expression.is_root():
-        return expression(df)
-    else:
-        if hasattr(expression, 'feature'):
-            expression.feature = calculate_expression(df, expression.feature)
-        if hasattr(expression, 'feature_left'):
-            expression.feature_left = calculate_expression(df, expression.feature_left)
-        if hasattr(expression, 'feature_right'):
-            expression.feature_right = calculate_expression(df, expression.feature_right)
-        return expression(df)
+    return ExpressionPlan(expression).evaluate(df)
 
 
 def calculate_field(df, field):
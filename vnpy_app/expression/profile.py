@@ -0,0 +1,126 @@
+import threading
+from typing import List, Text
+
+import numpy as np
+import pandas as pd
+
+PROFILE_COLUMNS = ["calls", "seconds", "rows", "bytes", "cache_hits"]
+
+
+def get_nbytes(value) -> int:
+    """the memory of a computed value, 0 for constants"""
+    if isinstance(value, pd.Series):
+        return value.values.nbytes
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return 0
+
+
+def get_rows(value) -> int:
+    """the number of rows of a computed value, 0 for constants"""
+    if isinstance(value, (pd.Series, np.ndarray)) and np.ndim(value) > 0:
+        return len(value)
+    return 0
+
+
+class ExpressionProfile:
+    """
+    Per node statistics of the evaluations of an `ExpressionDAG`
+
+    Each node records its number of computations, wall time, rows and bytes of its output, and cache hits. The
+    shared pass of a group of fused rolling statistics is split evenly between the nodes of the group. The peak
+    memory of the values held at once during an evaluation is recorded as well.
+
+    The profile is filled by `evaluate(..., profile=profile)` and accumulates over evaluations. Without a profile,
+    the evaluation does not time anything.
+
+    Example:
+        profile = ExpressionProfile()
+        df_feature = dag.evaluate(df, profile=profile)
+        print(profile.to_frame().head(20))
+        profile.to_folded(dag, "profile.folded")  # for flamegraph.pl or speedscope
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.peak_bytes = 0
+        self.lock = threading.Lock()
+
+    def _get(self, key: Text) -> dict:
+        if key not in self.stats:
+            self.stats[key] = dict.fromkeys(PROFILE_COLUMNS, 0)
+        return self.stats[key]
+
+    def add(self, keys: List[Text], seconds: float, results: dict):
+        """record the computation of the nodes `keys` in `seconds`"""
+        with self.lock:
+            for key in keys:
+                stats = self._get(key)
+                stats["calls"] += 1
+                stats["seconds"] += seconds / len(keys)
+                stats["rows"] += get_rows(results[key])
+                stats["bytes"] += get_nbytes(results[key])
+
+    def add_hit(self, key: Text, value):
+        """record the value of the node `key` loaded from a cache"""
+        with self.lock:
+            stats = self._get(key)
+            stats["cache_hits"] += 1
+            stats["rows"] += get_rows(value)
+
+    def track(self, values: dict):
+        """record the memory of the values held at once"""
+        nbytes = sum(get_nbytes(value) for value in values.values())
+        with self.lock:
+            self.peak_bytes = max(self.peak_bytes, nbytes)
+
+    def to_frame(self) -> pd.DataFrame:
+        """the statistics of every node, the slowest first"""
+        df = pd.DataFrame.from_dict(self.stats, orient="index", columns=PROFILE_COLUMNS)
+        df.index.name = "node"
+        return df.sort_values("seconds", ascending=False)
+
+    def to_folded(self, dag, path: Text = None) -> List[Text]:
+        """
+        the profile as folded stacks, `field;child;...;node microseconds` per line, which `flamegraph.pl` or
+        speedscope render as a flame graph
+
+        The stack of a node goes from the first field using it down to the node, so a node shared by several fields
+        is counted once and the total is the time of the evaluations.
+
+        Parameters
+        ----------
+        dag : ExpressionDAG
+            the profiled DAG
+        path : str
+            the file the lines are written to, if given
+        """
+        from .dag import get_children  # pylint: disable=C0415
+
+        stacks = {}
+        for name, output in zip(dag.names, dag.outputs):
+            if not isinstance(output, Text):
+                continue
+            # depth first from the field, the first stack reaching a node is kept
+            todo = [(output, [name] if name == output else [name, output])]
+            while todo:
+                key, stack = todo.pop()
+                if key in stacks:
+                    continue
+                stacks[key] = stack
+                for child in reversed(get_children(dag.nodes[key])):
+                    todo.append((str(child), stack + [str(child)]))
+        lines = []
+        for key, stack in stacks.items():
+            if key in self.stats and self.stats[key]["seconds"] > 0:
+                # `;` separates the frames of a stack
+                frames = [frame.replace(";", ",") for frame in stack]
+                lines.append("{} {}".format(";".join(frames), int(round(self.stats[key]["seconds"] * 1e6))))
+        if path is not None:
+            with open(path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+        return lines
+
+    def reset(self):
+        self.stats = {}
+        self.peak_bytes = 0
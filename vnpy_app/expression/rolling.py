@@ -1,13 +1,48 @@
+import bisect
+from collections import deque
+
 import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from pandas.api.indexers import BaseIndexer
+
+
+def _finite(val: float) -> float:
+    """`val`, or nan if it is infinite, which pandas skips as nan in the rolling statistics"""
+    return val if np.isfinite(val) else np.nan
 
 
 class Rolling:
+    """
+    1-D array rolling, the value of the latest window is returned by every `update`
+
+    NOTE: window == 0 means an expanding window, and the statistics skip the infinite values as nan (see `_finite`),
+    as the batch evaluation does
+    """
+
     def __init__(self, window: int):
         self.window = window
-        self.na_count = window
-        self.barv = list()
-        for i in range(window):
-            self.barv.append(np.nan)
+        self.barv = deque([np.nan] * window)
+        self.size = 0
+        self.count = 0
+
+    def _push(self, val: float) -> float:
+        """
+        append `val` to the window and return the value dropped out of it (nan for an expanding window)
+
+        `size` is the number of values in the window and `count` the number of them which are not nan
+        """
+        self.barv.append(val)
+        if not np.isnan(val):
+            self.count += 1
+        if self.window == 0:
+            self.size += 1
+            return np.nan
+        self.size = min(self.size + 1, self.window)
+        _val = self.barv.popleft()
+        if not np.isnan(_val):
+            self.count -= 1
+        return _val
 
     def update(self, val: float) -> float:
         pass
@@ -23,23 +58,19 @@ class Mean(Rolling):
         self.vsum = 0
 
     def update(self, val: float) -> float:
-        self.barv.append(val)
-        if not np.isnan(self.barv[0]):
-            self.vsum -= self.barv[0]
-        else:
-            self.na_count -= 1
-        self.barv = self.barv[1:]
-        if np.isnan(val):
-            self.na_count += 1
-        else:
+        val = _finite(val)
+        _val = self._push(val)
+        if not np.isnan(_val):
+            self.vsum -= _val
+        if not np.isnan(val):
             self.vsum += val
-        return self.vsum / (self.window - self.na_count)
+        return self.vsum / self.count
 
 
 # noinspection PyPep8Naming
 class Slope(Rolling):
     """
-
+    1-D array rolling slope of the linear regression on x = 1, 2, ..., window
     """
 
     def __init__(self, window: int):
@@ -48,68 +79,43 @@ class Slope(Rolling):
         self.x_sum = 0
         self.x2_sum = 0
         self.y_sum = 0
+        self.y2_sum = 0
         self.xy_sum = 0
 
-    def update(self, val: float) -> float:
-        self.barv.append(val)
+    def _regress(self, val: float):
+        val = _finite(val)
+        # every value moves one step backward, the one leaving the window is at x = 0
         self.xy_sum = self.xy_sum - self.y_sum
         self.x2_sum = self.x2_sum + self.i_sum - 2 * self.x_sum
         self.x_sum = self.x_sum - self.i_sum
-        _val = self.barv[0]
+        _val = self._push(val)
         if not np.isnan(_val):
             self.i_sum -= 1
             self.y_sum -= _val
-        else:
-            self.na_count -= 1
-        self.barv = self.barv[1:]
-        if np.isnan(val):
-            self.na_count += 1
-        else:
+            self.y2_sum -= _val * _val
+        if not np.isnan(val):
             self.i_sum += 1
             self.x_sum += self.window
             self.x2_sum += self.window * self.window
             self.y_sum += val
+            self.y2_sum += val * val
             self.xy_sum += self.window * val
-        N = self.window - self.na_count
+        return self.count
+
+    def update(self, val: float) -> float:
+        N = self._regress(val)
         return (N * self.xy_sum - self.x_sum * self.y_sum) / (N * self.x2_sum - self.x_sum * self.x_sum)
 
 
 # noinspection PyPep8Naming
-class Resi(Rolling):
+class Resi(Slope):
     """
-
+    1-D array rolling residual of the latest value
     """
 
-    def __init__(self, window: int):
-        super(Resi, self).__init__(window)
-        self.i_sum = 0
-        self.x_sum = 0
-        self.x2_sum = 0
-        self.y_sum = 0
-        self.xy_sum = 0
-
     def update(self, val: float) -> float:
-        self.barv.append(val)
-        self.xy_sum = self.xy_sum - self.y_sum
-        self.x2_sum = self.x2_sum + self.i_sum - 2 * self.x_sum
-        self.x_sum = self.x_sum - self.i_sum
-        _val = self.barv[0]
-        if not np.isnan(_val):
-            self.i_sum -= 1
-            self.y_sum -= _val
-        else:
-            self.na_count -= 1
-        self.barv = self.barv[1:]
-        if np.isnan(val):
-            self.na_count += 1
-            # return NAN
-        else:
-            self.i_sum += 1
-            self.x_sum += self.window
-            self.x2_sum += self.window * self.window
-            self.y_sum += val
-            self.xy_sum += self.window * val
-        N = self.window - self.na_count
+        val = _finite(val)
+        N = self._regress(val)
         slope = (N * self.xy_sum - self.x_sum * self.y_sum) / (N * self.x2_sum - self.x_sum * self.x_sum)
         x_mean = self.x_sum / N
         y_mean = self.y_sum / N
@@ -118,47 +124,560 @@ class Resi(Rolling):
 
 
 # noinspection PyPep8Naming
-class Rsquare(Rolling):
+class Rsquare(Slope):
+    """
+    1-D array rolling r-square
     """
 
+    def update(self, val: float) -> float:
+        N = self._regress(val)
+        rvalue = (N * self.xy_sum - self.x_sum * self.y_sum) / np.sqrt(
+            (N * self.x2_sum - self.x_sum * self.x_sum) * (N * self.y2_sum - self.y_sum * self.y_sum))
+        return rvalue * rvalue
+
+
+class Sum(Rolling):
+    """
+    1-D array rolling sum
     """
 
     def __init__(self, window: int):
-        super(Rsquare, self).__init__(window)
-        self.i_sum = 0
+        super(Sum, self).__init__(window)
+        self.vsum = 0
+
+    def update(self, val: float) -> float:
+        val = _finite(val)
+        _val = self._push(val)
+        if not np.isnan(_val):
+            self.vsum -= _val
+        if not np.isnan(val):
+            self.vsum += val
+        return self.vsum if self.count else np.nan
+
+
+class Count(Rolling):
+    """
+    1-D array rolling count of not nan values, the infinite values are counted as pandas does
+    """
+
+    def update(self, val: float) -> float:
+        self._push(val)
+        return self.count
+
+
+class Var(Rolling):
+    """
+    1-D array rolling variance (ddof=1)
+
+    The power sums are accumulated on `val - shift` to limit the cancellation error.
+    """
+
+    def __init__(self, window: int):
+        super(Var, self).__init__(window)
+        self.shift = np.nan
         self.x_sum = 0
         self.x2_sum = 0
-        self.y_sum = 0
-        self.y2_sum = 0
-        self.xy_sum = 0
+
+    def _accumulate(self, val: float, sign: int):
+        if not np.isnan(val):
+            _val = val - self.shift
+            self.x_sum += sign * _val
+            self.x2_sum += sign * _val * _val
 
     def update(self, val: float) -> float:
-        self.barv.append(val)
-        self.xy_sum = self.xy_sum - self.y_sum
-        self.x2_sum = self.x2_sum + self.i_sum - 2 * self.x_sum
-        self.x_sum = self.x_sum - self.i_sum
-        _val = self.barv[0]
-        if not np.isnan(_val):
-            self.i_sum -= 1
-            self.y_sum -= _val
-            self.y2_sum -= _val * _val
-        else:
-            self.na_count -= 1
-        self.barv = self.barv[1:]
+        val = _finite(val)
+        if np.isnan(self.shift):
+            self.shift = val
+        self._accumulate(self._push(val), -1)
+        self._accumulate(val, 1)
+        N = self.count
+        if N < 2:
+            return np.nan
+        return max((self.x2_sum - self.x_sum * self.x_sum / N) / (N - 1), 0)
+
+
+class Std(Var):
+    """
+    1-D array rolling standard deviation (ddof=1)
+    """
+
+    def update(self, val: float) -> float:
+        return np.sqrt(super(Std, self).update(val))
+
+
+# noinspection PyPep8Naming
+class Skew(Rolling):
+    """
+    1-D array rolling skewness, same as `pd.Series.rolling(window).skew`
+    """
+
+    def __init__(self, window: int):
+        super(Skew, self).__init__(window)
+        self.shift = np.nan
+        self.x_sum = 0
+        self.x2_sum = 0
+        self.x3_sum = 0
+        self.x4_sum = 0
+        self.last = np.nan
+        self.same_count = 0
+
+    def _accumulate(self, val: float, sign: int):
+        if not np.isnan(val):
+            _val = val - self.shift
+            _val2 = _val * _val
+            self.x_sum += sign * _val
+            self.x2_sum += sign * _val2
+            self.x3_sum += sign * _val2 * _val
+            self.x4_sum += sign * _val2 * _val2
+
+    def _moments(self, val: float):
+        val = _finite(val)
+        if np.isnan(self.shift):
+            self.shift = val
+        self._accumulate(self._push(val), -1)
+        self._accumulate(val, 1)
+        if not np.isnan(val):
+            self.same_count = self.same_count + 1 if val == self.last else 1
+            self.last = val
+        N = self.count
+        A = self.x_sum / N if N else np.nan
+        B = self.x2_sum / N - A * A if N else np.nan
+        C = self.x3_sum / N - A * A * A - 3 * A * B if N else np.nan
+        D = self.x4_sum / N - A * A * A * A - 6 * B * A * A - 4 * C * A if N else np.nan
+        return N, B, C, D
+
+    def update(self, val: float) -> float:
+        N, B, C, _ = self._moments(val)
+        if N < 3:
+            return np.nan
+        if self.same_count >= N:
+            return 0.
+        if B <= 1e-14:
+            return np.nan
+        R = np.sqrt(B)
+        return np.sqrt(N * (N - 1.)) * C / ((N - 2) * R * R * R)
+
+
+# noinspection PyPep8Naming
+class Kurt(Skew):
+    """
+    1-D array rolling kurtosis, same as `pd.Series.rolling(window).kurt`
+    """
+
+    def update(self, val: float) -> float:
+        N, B, _, D = self._moments(val)
+        if N < 4:
+            return np.nan
+        if self.same_count >= N:
+            return -3.
+        if B <= 1e-14:
+            return np.nan
+        K = (N * N - 1.) * D / (B * B) - 3 * ((N - 1.) ** 2)
+        return K / ((N - 2.) * (N - 3.))
+
+
+class Max(Rolling):
+    """
+    1-D array rolling max, with a monotonic queue of (step, value)
+    """
+
+    def __init__(self, window: int):
+        super(Max, self).__init__(window)
+        self.step = 0
+        self.queue = deque()
+
+    def _evict(self):
+        self.step += 1
+        if self.window and self.queue and self.queue[0][0] <= self.step - self.window:
+            self.queue.popleft()
+
+    def _dominated(self, _val: float, val: float) -> bool:
+        return _val <= val
+
+    def update(self, val: float) -> float:
+        val = _finite(val)
+        self._push(val)
+        self._evict()
+        if not np.isnan(val):
+            while self.queue and self._dominated(self.queue[-1][1], val):
+                self.queue.pop()
+            self.queue.append((self.step, val))
+        return self.queue[0][1] if self.queue else np.nan
+
+
+class Min(Max):
+    """
+    1-D array rolling min
+    """
+
+    def _dominated(self, _val: float, val: float) -> bool:
+        return _val >= val
+
+
+class IdxMax(Max):
+    """
+    1-D array rolling argmax (1-based position in the window), same as `np.argmax(window) + 1`
+
+    The first position wins on ties, and a nan in the window is returned before any value as numpy does.
+    """
+
+    def __init__(self, window: int):
+        super(IdxMax, self).__init__(window)
+        self.na_queue = deque()
+
+    def _dominated(self, _val: float, val: float) -> bool:
+        return _val < val
+
+    def update(self, val: float) -> float:
+        val = _finite(val)
+        super(IdxMax, self).update(val)
+        if self.window and self.na_queue and self.na_queue[0] <= self.step - self.window:
+            self.na_queue.popleft()
         if np.isnan(val):
-            self.na_count += 1
-            # return NAN
+            self.na_queue.append(self.step)
+        if not self.count:
+            return np.nan
+        step = self.na_queue[0] if self.na_queue else self.queue[0][0]
+        return step - (self.step - self.size)
+
+
+class IdxMin(IdxMax):
+    """
+    1-D array rolling argmin (1-based position in the window)
+    """
+
+    def _dominated(self, _val: float, val: float) -> bool:
+        return _val > val
+
+
+class Ref(Rolling):
+    """
+    value of `window` steps ago
+    """
+
+    def __init__(self, window: int):
+        if window < 0:
+            raise ValueError("Ref with a negative window refers to the future, which could not be streamed")
+        super(Ref, self).__init__(window + 1)
+
+    def update(self, val: float) -> float:
+        self._push(val)
+        return self.barv[0]
+
+
+class Delta(Ref):
+    """
+    difference between the latest value and the one of `window` steps ago, or the first one if window == 0
+    """
+
+    def __init__(self, window: int):
+        super(Delta, self).__init__(window)
+        self.first = None
+
+    def update(self, val: float) -> float:
+        if self.first is None:
+            self.first = val
+        if self.window == 1:
+            return val - self.first
+        return val - super(Delta, self).update(val)
+
+
+class SortedWindow:
+    """
+    The values of a window kept sorted, for order statistics (rank, median, quantile)
+
+    The values are split into sorted buckets of at most `2 * load` values, like `sortedcontainers.SortedList`, so an
+    insertion or an eviction bisects the maxima of the buckets and only moves the values of one bucket, which keeps
+    long and expanding windows cheap. The sum of every bucket is kept for the partial sums of the sorted values.
+    """
+
+    def __init__(self, load: int = 1000):
+        self.load = load
+        self.buckets = []
+        self.maxes = []
+        self.sums = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, k: int) -> float:
+        """the k-th smallest value"""
+        for bucket in self.buckets:
+            if k < len(bucket):
+                return bucket[k]
+            k -= len(bucket)
+        raise IndexError("SortedWindow index out of range")
+
+    def add(self, val: float):
+        self.count += 1
+        if not self.buckets:
+            self.buckets.append([val])
+            self.maxes.append(val)
+            self.sums.append(val)
+            return
+        i = bisect.bisect_left(self.maxes, val)
+        if i == len(self.maxes):
+            i -= 1
+            self.buckets[i].append(val)
+            self.maxes[i] = val
         else:
-            self.i_sum += 1
-            self.x_sum += self.window
-            self.x2_sum += self.window * self.window
-            self.y_sum += val
-            self.y2_sum += val * val
-            self.xy_sum += self.window * val
-        N = self.window - self.na_count
-        rvalue = (N * self.xy_sum - self.x_sum * self.y_sum) / np.sqrt(
-            (N * self.x2_sum - self.x_sum * self.x_sum) * (N * self.y2_sum - self.y_sum * self.y_sum))
-        return rvalue * rvalue
+            bisect.insort(self.buckets[i], val)
+        bucket = self.buckets[i]
+        if len(bucket) > 2 * self.load:
+            self.buckets[i:i + 1] = [bucket[:self.load], bucket[self.load:]]
+            self.maxes[i:i + 1] = [bucket[self.load - 1], bucket[-1]]
+            self.sums[i:i + 1] = [sum(bucket[:self.load]), sum(bucket[self.load:])]
+        else:
+            # summed again rather than updated, so the sums do not drift
+            self.sums[i] = sum(bucket)
+
+    def remove(self, val: float):
+        """remove a value of the window"""
+        i = bisect.bisect_left(self.maxes, val)
+        bucket = self.buckets[i]
+        del bucket[bisect.bisect_left(bucket, val)]
+        self.count -= 1
+        if bucket:
+            self.maxes[i] = bucket[-1]
+            self.sums[i] = sum(bucket)
+        else:
+            del self.buckets[i]
+            del self.maxes[i]
+            del self.sums[i]
+
+    def rank(self, val: float) -> tuple:
+        """the number of values < `val` and <= `val`"""
+        i = bisect.bisect_left(self.maxes, val)
+        lower = sum(len(bucket) for bucket in self.buckets[:i])
+        if i < len(self.buckets):
+            lower += bisect.bisect_left(self.buckets[i], val)
+        j = bisect.bisect_right(self.maxes, val)
+        upper = sum(len(bucket) for bucket in self.buckets[:j])
+        if j < len(self.buckets):
+            upper += bisect.bisect_right(self.buckets[j], val)
+        return lower, upper
+
+    def lower_sum(self, val: float) -> tuple:
+        """the number and the sum of the values < `val`"""
+        i = bisect.bisect_left(self.maxes, val)
+        count = sum(len(bucket) for bucket in self.buckets[:i])
+        total = sum(self.sums[:i])
+        if i < len(self.buckets):
+            k = bisect.bisect_left(self.buckets[i], val)
+            count += k
+            total += sum(self.buckets[i][:k])
+        return count, total
+
+    def sum(self) -> float:
+        return sum(self.sums)
+
+    def quantile(self, qscore: float) -> float:
+        """same as `np.quantile(values, qscore)` with linear interpolation"""
+        if not self.count:
+            return np.nan
+        index = qscore * (self.count - 1)
+        lower = int(index)
+        lower_val = self[lower]
+        upper_val = self[lower + 1] if lower + 1 < self.count else lower_val
+        return lower_val + (upper_val - lower_val) * (index - lower)
+
+
+class Med(Rolling):
+    """
+    1-D array rolling median of the not nan values, which are kept in a `SortedWindow`
+    """
+
+    def __init__(self, window: int):
+        super(Med, self).__init__(window)
+        self.sorted_barv = SortedWindow()
+
+    def _sort(self, val: float):
+        val = _finite(val)
+        _val = self._push(val)
+        if not np.isnan(_val):
+            self.sorted_barv.remove(_val)
+        if not np.isnan(val):
+            self.sorted_barv.add(val)
+
+    def update(self, val: float) -> float:
+        self._sort(val)
+        return self.sorted_barv.quantile(0.5)
+
+
+class Quantile(Med):
+    """
+    1-D array rolling quantile, same as `np.quantile(window, qscore)`, which is nan if any value is nan
+    """
+
+    def __init__(self, window: int, qscore: float):
+        super(Quantile, self).__init__(window)
+        self.qscore = qscore
+
+    def update(self, val: float) -> float:
+        self._sort(val)
+        if self.count < self.size:
+            return np.nan
+        return self.sorted_barv.quantile(self.qscore)
+
+
+class Rank(Med):
+    """
+    1-D array rolling percentile rank of the latest value, same as `pd.Series.rolling(window).rank(pct=True)`
+    """
+
+    def update(self, val: float) -> float:
+        val = _finite(val)
+        self._sort(val)
+        if np.isnan(val):
+            return np.nan
+        lower, upper = self.sorted_barv.rank(val)
+        return (lower + upper + 1) / 2 / self.count
+
+
+class Mad(Med):
+    """
+    1-D array rolling mean absolute deviation of the not nan values
+
+    The values are kept in a `SortedWindow`: the values below the mean and above it are split at the rank of the mean,
+    so the deviation is `(mean * n_lower - lower_sum) + (upper_sum - mean * n_upper)`, from the partial sums of the
+    buckets, at the cost of an insertion rather than O(window).
+    """
+
+    def update(self, val: float) -> float:
+        self._sort(val)
+        n = len(self.sorted_barv)
+        if not n:
+            return np.nan
+        total = self.sorted_barv.sum()
+        mean = total / n
+        lower_count, lower_sum = self.sorted_barv.lower_sum(mean)
+        return (mean * (2 * lower_count - n) + total - 2 * lower_sum) / n
+
+
+class WMA(Rolling):
+    """
+    1-D array rolling linear weighted mean, same as `np.nanmean(w * window)` with w = (1, 2, ..., n) / sum(w)
+    """
+
+    def __init__(self, window: int):
+        super(WMA, self).__init__(window)
+        self.vsum = 0
+        self.wsum = 0
+
+    def update(self, val: float) -> float:
+        val = _finite(val)
+        full = self.window and self.size == self.window
+        _val = self._push(val)
+        if full:
+            self.wsum -= self.vsum
+            if not np.isnan(_val):
+                self.vsum -= _val
+        if not np.isnan(val):
+            self.vsum += val
+            self.wsum += self.size * val
+        if not self.count:
+            return np.nan
+        return self.wsum / (self.size * (self.size + 1) / 2) / self.count
+
+
+class EMA(Rolling):
+    """
+    exponential moving average, same as `pd.Series.ewm(span=window).mean()`, `alpha=window` if 0 < window < 1
+
+    window == 0 means the decay is decided by the length of the whole history, so there is no recursion between
+    updates: the history is kept in a growing array, and every update weights it again (O(n), as `expanding_ema`).
+    """
+
+    def __init__(self, window: float):
+        super(EMA, self).__init__(0)
+        self.alpha = window if 0 < window < 1 else 2 / (1 + window) if window else None
+        self.vsum = 0
+        self.wsum = 0
+        # the history of window == 0, nan values as 0
+        self.history = np.empty(0)
+
+    def update(self, val: float) -> float:
+        val = _finite(val)
+        if self.alpha is None:
+            if self.size == len(self.history):
+                self.history = np.concatenate([self.history, np.empty(max(self.size, 16))])
+            self.history[self.size] = 0 if np.isnan(val) else val
+            self.size += 1
+            if not np.isnan(val):
+                self.count += 1
+            if not self.count:
+                return np.nan
+            a = 1 - 2 / (1 + self.size)
+            w = a ** np.arange(self.size - 1, -1, -1, dtype=np.float64)
+            return w @ self.history[:self.size] / w.sum()
+        self.vsum *= 1 - self.alpha
+        self.wsum *= 1 - self.alpha
+        if not np.isnan(val):
+            self.vsum += val
+            self.wsum += 1
+        return self.vsum / self.wsum if self.wsum else np.nan
+
+
+# noinspection PyPep8Naming
+class Cov(Rolling):
+    """
+    1-D array rolling covariance (ddof=1) of pairs, a pair with any nan is ignored like pandas does
+    """
+
+    def __init__(self, window: int):
+        super(Cov, self).__init__(window)
+        self.barv_y = deque(self.barv)
+        self.shift_x = np.nan
+        self.shift_y = np.nan
+        self.x_sum = 0
+        self.y_sum = 0
+        self.x2_sum = 0
+        self.y2_sum = 0
+        self.xy_sum = 0
+
+    def _accumulate(self, x: float, y: float, sign: int):
+        if not np.isnan(x):
+            x = x - self.shift_x
+            y = y - self.shift_y
+            self.x_sum += sign * x
+            self.y_sum += sign * y
+            self.x2_sum += sign * x * x
+            self.y2_sum += sign * y * y
+            self.xy_sum += sign * x * y
+
+    def _moments(self, x: float, y: float):
+        x, y = _finite(x), _finite(y)
+        if np.isnan(x) or np.isnan(y):
+            x = y = np.nan
+        elif np.isnan(self.shift_x):
+            self.shift_x, self.shift_y = x, y
+        self.barv_y.append(y)
+        _y = self.barv_y.popleft() if self.window else np.nan
+        self._accumulate(self._push(x), _y, -1)
+        self._accumulate(x, y, 1)
+        N = self.count
+        return (N, N * self.xy_sum - self.x_sum * self.y_sum,
+                N * self.x2_sum - self.x_sum * self.x_sum, N * self.y2_sum - self.y_sum * self.y_sum)
+
+    def update(self, x: float, y: float) -> float:
+        N, xy, _, _ = self._moments(x, y)
+        if N < 2:
+            return np.nan
+        return xy / (N * (N - 1))
+
+
+# noinspection PyPep8Naming
+class Corr(Cov):
+    """
+    1-D array rolling correlation of pairs
+    """
+
+    def update(self, x: float, y: float) -> float:
+        N, xy, xx, yy = self._moments(x, y)
+        if N < 2 or xx <= 0 or yy <= 0:
+            return np.nan
+        return xy / np.sqrt(xx * yy)
 
 
 # noinspection PyPep8Naming
@@ -178,16 +697,499 @@ def rolling_mean(a: np.array, window: int) -> np.array:
     return rolling(r, a)
 
 
-def rolling_slope(a: np.array, window: int) -> np.array:
-    r = Slope(window)
-    return rolling(r, a)
+def rolling_rank(a: np.array, window: int, starts: np.array = None) -> np.array:
+    """rolling percentile rank of every value, window == 0 means an expanding window, within the segments of `starts`"""
+    if starts is None:
+        return rolling(Rank(window), a)
+    bounds = np.r_[np.flatnonzero(starts == np.arange(len(a))), len(a)]
+    ret = np.empty(len(a))
+    for beg, end in zip(bounds[:-1], bounds[1:]):
+        ret[beg:end] = rolling(Rank(window), a[beg:end])
+    return ret
 
 
-def rolling_rsquare(a: np.array, window: int) -> np.array:
-    r = Rsquare(window)
-    return rolling(r, a)
+########################################################################################################################
+# Vectorized #
+########################################################################################################################
 
+def shift(a: np.array, n: int) -> np.array:
+    """`pd.Series.shift` of an array: the value `n` rows before, nan outside of the array"""
+    a = np.asarray(a)
+    result = np.full(len(a), np.nan, dtype=a.dtype if a.dtype.kind == "f" else np.float64)
+    if n == 0:
+        result[:] = a
+    elif abs(n) < len(a):
+        if n > 0:
+            result[n:] = a[:-n]
+        else:
+            result[:n] = a[-n:]
+    return result
 
-def rolling_resi(a: np.array, window: int) -> np.array:
-    r = Resi(window)
-    return rolling(r, a)
+
+# The cumulative sums restart every block, so their rounding error is bounded by the block instead of growing with
+# the length of the array (e.g. 10M ticks), and the x coordinates and y values are taken relative to their block as
+# well. A block is the smallest power of 2 not shorter than the window, so the blocks of two windows are aligned:
+# the longer block is a multiple of the shorter one.
+BLOCK_SIZE = 4096
+
+
+def _block_size(window: int) -> int:
+    return 1 << max(window - 1, 1).bit_length()
+
+
+def _window_left(n: int, window: int, starts: np.array = None) -> np.array:
+    """
+    the first row of the rolling window of every row
+
+    `starts` is the first row of the segment of every row, e.g. of its instrument in a panel sorted by instrument,
+    and the windows never cross the start of their segment, so every segment is computed as if it were alone.
+    """
+    left = np.arange(n) - window + 1
+    return np.maximum(left, 0 if starts is None else starts)
+
+
+class SegmentIndexer(BaseIndexer):
+    """
+    the windows of `_window_left` for the rolling methods of pandas, e.g.
+    `series.rolling(SegmentIndexer(window_size=5, starts=starts), min_periods=1).quantile(0.8)`
+    """
+
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        # noinspection PyUnresolvedReferences
+        starts = self.starts
+        end = np.arange(1, num_values + 1, dtype=np.int64)
+        return _window_left(num_values, self.window_size, starts).astype(np.int64), end
+
+
+def _align_segments(a: np.array, window: int, starts: np.array):
+    """
+    move every segment of `a` to the start of a block of `window` rows, the rows in between are nan
+
+    Returns the moved array, its `starts`, and the new row of every row of `a`.
+    """
+    n = len(a)
+    index = np.arange(n)
+    first = index[starts == index]
+    size = -(-np.diff(np.append(first, n)) // window) * window
+    offset = np.cumsum(size) - size
+    rows = offset[np.cumsum(starts == index) - 1] + index - starts
+    aligned = np.full(size.sum(), np.nan)
+    aligned[rows] = a
+    aligned_starts = np.repeat(offset, size)
+    return aligned, aligned_starts, rows
+
+
+def _block_reference(a: np.array, mask: np.array, block: int) -> np.array:
+    """
+    the first not nan value of each block, broadcast to the rows of the block, a block without any not nan value takes
+    the reference of the previous block (of the next block at the start), so the shifts between blocks stay small
+    """
+    n_block = -(-len(a) // block)
+    padded_a = np.zeros(n_block * block)
+    padded_a[:len(a)] = np.where(mask, a, 0)
+    padded_mask = np.zeros(n_block * block, dtype=bool)
+    padded_mask[:len(a)] = mask
+    padded_mask = padded_mask.reshape(n_block, block)
+    first = padded_mask.argmax(axis=1)
+    reference = padded_a.reshape(n_block, block)[np.arange(n_block), first]
+    filled = padded_mask.any(axis=1)
+    if filled.any() and not filled.all():
+        source = np.maximum.accumulate(np.where(filled, np.arange(n_block), -1))
+        reference = reference[np.where(source < 0, filled.argmax(), source)]
+    return np.repeat(reference, block)[:len(a)]
+
+
+def _block_cumsum(a: np.array, block: int) -> np.array:
+    """inclusive cumulative sums of `a` restarted every block, padded to a whole number of blocks"""
+    n_block = -(-len(a) // block)
+    padded = np.zeros(n_block * block)
+    padded[:len(a)] = a
+    return np.cumsum(padded.reshape(n_block, block), axis=1).reshape(-1)
+
+
+def _window_sums(inclusive: np.array, left: np.array, block: int):
+    """
+    sums over the windows [left[i], i] from the cumulative sums of `_block_cumsum`, split into the part in the block
+    of row i and the part in the previous block, the window should not be longer than a block
+    """
+    n = len(left)
+    # sum of the block of `left` before `left`
+    before = np.where(left % block == 0, 0, inclusive[left - 1])
+    index = np.arange(n)
+    start = index - index % block
+    same = left >= start
+    current = inclusive[:n] - np.where(same, before, 0)
+    previous = np.where(same, 0, inclusive[start - 1] - before)
+    return current, previous
+
+
+def _block_sums(a: np.array, left: np.array, block: int):
+    """see `_window_sums`"""
+    return _window_sums(_block_cumsum(a, block), left, block)
+
+
+def block_apply(func, window: int, *arrays) -> np.array:
+    """
+    apply a rolling function of pandas block by block, e.g. `corr`, whose running sums otherwise depend on every
+    row before the window: each block of `BLOCK_SIZE` rows at least is computed from its rows and the `window - 1`
+    rows before it, so as for the kernels above, a value only depends on its block and the previous one
+    """
+    n = len(arrays[0])
+    block = max(_block_size(window), BLOCK_SIZE)
+    if n <= block:
+        return func(*arrays)
+    ret = np.empty(n)
+    for start in range(0, n, block):
+        left = max(start - window + 1, 0)
+        ret[start:start + block] = func(*[a[left:start + block] for a in arrays])[start - left:]
+    return ret
+
+
+# noinspection PyPep8Naming
+def _regression_sums(a: np.array, window: int, starts: np.array = None):
+    """
+    the sums of the linear regression of every rolling window, with x relative to the latest row of the window
+    and y relative to the reference of its block, which is also returned
+    """
+    # the infinite values are skipped as nan, as the streaming states do, so they never become a block reference
+    a = np.asarray(a, dtype=np.float64)
+    a = np.where(np.isinf(a), np.nan, a)
+    n = len(a)
+    block = _block_size(window)
+    index = np.arange(n)
+    left = _window_left(n, window, starts)
+    mask = ~np.isnan(a)
+    reference = _block_reference(a, mask, block)
+    u = (index % block).astype(np.float64)
+    m = mask.astype(np.float64)
+    y = np.where(mask, a - reference, 0)
+    m0, m0_prev = _block_sums(m, left, block)
+    m1, m1_prev = _block_sums(m * u, left, block)
+    m2, m2_prev = _block_sums(m * u * u, left, block)
+    y1, y1_prev = _block_sums(y, left, block)
+    y2, y2_prev = _block_sums(y * y, left, block)
+    uy, uy_prev = _block_sums(u * y, left, block)
+    # x of the previous block is shifted by `block`, and y by the difference of the references
+    u_prev = u + block
+    shift = reference[np.maximum(index - index % block - 1, 0)] - reference
+    N = m0 + m0_prev
+    x_sum = m1 - u * m0 + m1_prev - u_prev * m0_prev
+    x2_sum = m2 - 2 * u * m1 + u * u * m0 + m2_prev - 2 * u_prev * m1_prev + u_prev * u_prev * m0_prev
+    y_sum = y1 + y1_prev + shift * m0_prev
+    y2_sum = y2 + y2_prev + 2 * shift * y1_prev + shift * shift * m0_prev
+    xy_sum = uy - u * y1 + uy_prev - u_prev * y1_prev + shift * (m1_prev - u_prev * m0_prev)
+    return N, x_sum, x2_sum, y_sum, y2_sum, xy_sum, a - reference
+
+
+# noinspection PyPep8Naming
+def rolling_slope(a: np.array, window: int, starts: np.array = None) -> np.array:
+    """
+    vectorized rolling slope, same as `rolling(Slope(window), a)`
+
+    NOTE: a window with less than 2 values is nan, instead of the carried forward or +-inf value of the loop
+    """
+    N, x_sum, x2_sum, y_sum, _, xy_sum, _ = _regression_sums(a, window, starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (N * xy_sum - x_sum * y_sum) / (N * x2_sum - x_sum * x_sum)
+    return np.where(N > 1, slope, np.nan)
+
+
+# noinspection PyPep8Naming
+def rolling_rsquare(a: np.array, window: int, starts: np.array = None) -> np.array:
+    """
+    vectorized rolling r-square, same as `rolling(Rsquare(window), a)`
+    """
+    N, x_sum, x2_sum, y_sum, y2_sum, xy_sum, _ = _regression_sums(a, window, starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rvalue = (N * xy_sum - x_sum * y_sum) / np.sqrt(
+            (N * x2_sum - x_sum * x_sum) * (N * y2_sum - y_sum * y_sum))
+    return np.where(N > 1, rvalue * rvalue, np.nan)
+
+
+# noinspection PyPep8Naming
+def rolling_resi(a: np.array, window: int, starts: np.array = None) -> np.array:
+    """
+    vectorized rolling residual, same as `rolling(Resi(window), a)`
+    """
+    N, x_sum, x2_sum, y_sum, _, xy_sum, y = _regression_sums(a, window, starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (N * xy_sum - x_sum * y_sum) / (N * x2_sum - x_sum * x_sum)
+        # x of the latest value is 0
+        resi = y - (y_sum - slope * x_sum) / N
+    return np.where(N > 1, resi, np.nan)
+
+
+# max number of elements of the windows processed at once by `sliding_window_view`
+CHUNK_SIZE = 1 << 22
+
+
+def _window_chunks(a: np.array, window: int, fill: float):
+    """
+    iterate over the rolling windows of `a` by chunks of rows, yield (start row, 2-D array of windows)
+
+    The head of `a` is padded with `fill`, so every row has a full window.
+    """
+    padded = np.concatenate([np.full(window - 1, fill), a])
+    windows = sliding_window_view(padded, window)
+    step = max(CHUNK_SIZE // window, 1)
+    for start in range(0, len(a), step):
+        yield start, windows[start:start + step]
+
+
+def _rolling_count(mask: np.array, window: int, starts: np.array = None) -> np.array:
+    """number of True of every rolling window"""
+    count = np.cumsum(mask)
+    if starts is not None:
+        left = _window_left(len(mask), window, starts)
+        return count - np.where(left > 0, count[left - 1], 0)
+    count[window:] -= count[:-window].copy()
+    return count
+
+
+def _rolling_argmax(a: np.array, window: int, starts: np.array = None) -> np.array:
+    """
+    1-based position of the maximum in every rolling window, the first one if tied, same as
+    `np.argmax(window) + 1`, so the position of the first nan if there is any, and nan if all are nan
+
+    The maximum of a window is merged from the prefix maximum of the block of its last row, and the suffix maximum
+    of the block of its first row, where the blocks are `window` long (van Herk/Gil-Werman), which is O(n) for any
+    window and equivalent to a monotonic deque. The segments of `starts` are moved to the start of a block first,
+    so a window is still made of a suffix and a prefix of two blocks. The infinite values are taken as nan, as pandas
+    does before `apply`.
+    """
+    a = np.asarray(a, dtype=np.float64)
+    a = np.where(np.isinf(a), np.nan, a)
+    rows = None
+    if starts is not None and len(a):
+        window = min(window, (np.arange(len(a)) - starts).max() + 1)
+        a, starts, rows = _align_segments(a, window, starts)
+    n = len(a)
+    window = max(min(window, n), 1)
+    index = np.arange(n)
+    left = _window_left(n, window, starts)
+    isnan = np.isnan(a)
+    n_block = -(-n // window)
+    blocks = np.full(n_block * window, -np.inf)
+    blocks[:n] = np.where(isnan, -np.inf, a)
+    blocks = blocks.reshape(n_block, window)
+    pos = np.arange(window)
+    offset = (np.arange(n_block) * window)[:, None]
+    # the maximum of [block start, j] and its first position
+    prefix_max = np.maximum.accumulate(blocks, axis=1)
+    new = np.ones(blocks.shape, dtype=bool)
+    new[:, 1:] = prefix_max[:, 1:] > prefix_max[:, :-1]
+    prefix_pos = np.maximum.accumulate(np.where(new, pos, 0), axis=1) + offset
+    # the maximum of [j, block end] and its first position
+    suffix_max = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1]
+    suffix_pos = np.minimum.accumulate(np.where(blocks == suffix_max, pos, window)[:, ::-1], axis=1)[:, ::-1] + offset
+    prefix_max, prefix_pos = prefix_max.reshape(-1)[:n], prefix_pos.reshape(-1)[:n]
+    suffix_max, suffix_pos = suffix_max.reshape(-1)[:n], suffix_pos.reshape(-1)[:n]
+    # a window starting at the beginning of a block is inside the block
+    use_suffix = (left % window != 0) & (suffix_max[left] >= prefix_max)
+    argmax = np.where(use_suffix, suffix_pos[left], prefix_pos)
+    next_nan = np.minimum.accumulate(np.where(isnan, index, n)[::-1])[::-1][left]
+    argmax = np.where(next_nan <= index, next_nan, argmax)
+    ret = (argmax - left + 1).astype(np.float64)
+    ret[_rolling_count(~isnan, window, starts) == 0] = np.nan
+    return ret if rows is None else ret[rows]
+
+
+def rolling_idxmax(a: np.array, window: int, starts: np.array = None) -> np.array:
+    """
+    vectorized rolling idxmax, same as `series.rolling(window, min_periods=1).apply(lambda x: x.argmax() + 1)`
+    """
+    return _rolling_argmax(a, window, starts)
+
+
+def rolling_idxmin(a: np.array, window: int, starts: np.array = None) -> np.array:
+    """
+    vectorized rolling idxmin, same as `series.rolling(window, min_periods=1).apply(lambda x: x.argmin() + 1)`
+    """
+    return _rolling_argmax(-np.asarray(a, dtype=np.float64), window, starts)
+
+
+def rolling_mad(a: np.array, window: int, starts: np.array = None) -> np.array:
+    """
+    vectorized rolling mean absolute deviation of the not nan values, the infinite values are taken as nan
+    """
+    a = np.asarray(a, dtype=np.float64)
+    a = np.where(np.isinf(a), np.nan, a)
+    ret = np.empty(len(a))
+    left = _window_left(len(a), window, starts)
+    for start, x in _window_chunks(a, window, np.nan):
+        if starts is not None:
+            rows = np.arange(start, start + len(x))
+            x = np.where(np.arange(window) >= (left[rows] - rows + window - 1)[:, None], x, np.nan)
+        mask = ~np.isnan(x)
+        count = mask.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(mask, x, 0).sum(axis=1) / count
+            ret[start:start + len(x)] = np.where(mask, np.abs(x - mean[:, None]), 0).sum(axis=1) / count
+    return ret
+
+
+def rolling_wma(a: np.array, window: int, starts: np.array = None) -> np.array:
+    """
+    vectorized rolling weighted mean, the weights are 1, 2, ..., window normalized to a sum of 1, and the weighted
+    values are averaged over the not nan values, same as `np.nanmean(w * x)`, the infinite values are taken as nan
+    """
+    a = np.asarray(a, dtype=np.float64)
+    a = np.where(np.isinf(a), np.nan, a)
+    n = len(a)
+    mask = ~np.isnan(a)
+    values = np.where(mask, a, 0)
+    weighted = np.empty(n)
+    weights = np.arange(1, window + 1) / (window * (window + 1) / 2)
+    left = _window_left(n, window, starts)
+    for start, x in _window_chunks(values, window, 0):
+        if starts is None:
+            weighted[start:start + len(x)] = x @ weights
+            continue
+        # the windows at the start of a segment are shorter, the weight of a value is its position in the window
+        rows = np.arange(start, start + len(x))
+        first = left[rows] - rows + window - 1
+        x = np.where(np.arange(window) >= first[:, None], x, 0)
+        size = window - first
+        weighted[start:start + len(x)] = (x @ np.arange(1., window + 1) - first * x.sum(axis=1)) / (
+                size * (size + 1) / 2)
+    if starts is None:
+        # the first windows are shorter, and so are their weights
+        head = min(window - 1, n)
+        size = np.arange(1, head + 1)
+        weighted[:head] = np.cumsum(size * values[:head]) / (size * (size + 1) / 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return weighted / _rolling_count(mask, window, starts)
+
+
+def _rolling_max(a: np.array, window: int, starts: np.array = None) -> np.array:
+    """
+    rolling maximum of the not nan values (van Herk/Gil-Werman, see `_rolling_argmax`), nan if all are nan
+    """
+    rows = None
+    if starts is not None and len(a):
+        window = min(window, (np.arange(len(a)) - starts).max() + 1)
+        a, starts, rows = _align_segments(a, window, starts)
+    n = len(a)
+    window = max(min(window, n), 1)
+    left = _window_left(n, window, starts)
+    isnan = np.isnan(a)
+    n_block = -(-n // window)
+    blocks = np.full(n_block * window, -np.inf)
+    blocks[:n] = np.where(isnan, -np.inf, a)
+    blocks = blocks.reshape(n_block, window)
+    prefix_max = np.maximum.accumulate(blocks, axis=1).reshape(-1)[:n]
+    suffix_max = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(-1)[:n]
+    ret = np.where(left % window != 0, np.maximum(suffix_max[left], prefix_max), prefix_max)
+    ret[_rolling_count(~isnan, window, starts) == 0] = np.nan
+    return ret if rows is None else ret[rows]
+
+
+# the statistics of `rolling_stats`, and the power sums they need
+FUSED_STATS = {
+    "count": 0, "sum": 1, "mean": 1, "var": 2, "std": 2, "skew": 3, "kurt": 4, "max": 0, "min": 0, "median": 0,
+}
+
+
+# noinspection PyPep8Naming
+def rolling_stats(a: np.array, stats: list, min_periods: int = None, starts: np.array = None) -> dict:
+    """
+    many rolling statistics of one array at once, same as `pd.Series.rolling(window, min_periods).<func>()`
+
+    The power sums of the values (up to the 4th for `kurt`) are accumulated once, by blocks as `rolling_slope`,
+    and shared by all windows, each of them then costs a few lookups; max/min are O(n) per window, and median
+    falls back to pandas.
+
+    Parameters
+    ----------
+    a : np.array
+        1-D values
+    stats : list
+        (window, func) pairs, where window > 0 and func is in `FUSED_STATS`, e.g. [(5, "mean"), (20, "std")]
+    min_periods : int
+        minimum number of not nan values of a window, the window size by default (as pandas)
+    starts : np.array
+        the first row of the segment of every row, e.g. of its instrument in a panel, see `_window_left`
+
+    Returns
+    -------
+    dict
+        (window, func) -> np.array
+    """
+    a = np.asarray(a, dtype=np.float64)
+    n = len(a)
+    # pandas counts the infinite values, but skips them as nan in the other statistics
+    count_mask = ~np.isnan(a)
+    a = np.where(np.isinf(a), np.nan, a)
+    funcs = {}
+    for window, func in stats:
+        if func not in FUSED_STATS:
+            raise ValueError("Unsupported rolling statistic {}, use one of {}".format(func, list(FUSED_STATS)))
+        funcs.setdefault(window, []).append(func)
+    power = max(FUSED_STATS[func] for _, func in stats)
+    block = _block_size(max(funcs))
+    mask = ~np.isnan(a)
+    reference = _block_reference(a, mask, block)
+    y = np.where(mask, a - reference, 0)
+    inclusive = [_block_cumsum(mask.astype(np.float64), block)]
+    for p in range(1, power + 1):
+        inclusive.append(_block_cumsum(y ** p, block))
+    index = np.arange(n)
+    # the values of the previous block relative to the reference of the current block
+    shift = reference[np.maximum(index - index % block - 1, 0)] - reference
+    binomial = [[1], [1, 1], [1, 2, 1], [1, 3, 3, 1], [1, 4, 6, 4, 1]]
+    ret = {}
+    for window, window_funcs in funcs.items():
+        minp = window if min_periods is None else min_periods
+        left = _window_left(n, window, starts)
+        window_power = max(FUSED_STATS[func] for func in window_funcs)
+        current, previous = zip(*[_window_sums(inclusive[p], left, block) for p in range(window_power + 1)])
+        # sum(y ** p) of the current block and sum((y + shift) ** p) of the previous block
+        sums = [current[p] + sum(binomial[p][k] * shift ** (p - k) * previous[k] for k in range(p + 1))
+                for p in range(window_power + 1)]
+        N = sums[0]
+        valid = N >= max(minp, 1)
+        if any(func in ("max", "min", "var", "std", "skew", "kurt") for func in window_funcs):
+            rolling_max, rolling_min = _rolling_max(a, window, starts), -_rolling_max(-a, window, starts)
+            # pandas forces the statistics of a window of equal values
+            constant = rolling_max == rolling_min
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if window_power >= 1:
+                A = sums[1] / N
+            if window_power >= 2:
+                B = sums[2] / N - A * A
+            if window_power >= 3:
+                C = sums[3] / N - A * A * A - 3 * A * B
+            if window_power >= 4:
+                D = sums[4] / N - A * A * A * A - 6 * B * A * A - 4 * C * A
+            for func in window_funcs:
+                if func == "count":
+                    # pandas counts the rows of the window for the min periods of `count`
+                    value = np.where(index - left + 1 >= minp, _rolling_count(count_mask, window, starts), np.nan)
+                elif func == "sum":
+                    value = sums[1] + N * reference
+                elif func == "mean":
+                    value = reference + A
+                elif func in ("var", "std"):
+                    value = np.where(constant, 0, np.maximum(B, 0) * N / (N - 1))
+                    value = np.where(N > 1, value, np.nan)
+                    if func == "std":
+                        value = np.sqrt(value)
+                elif func == "skew":
+                    value = np.sqrt(N * (N - 1.)) * C / ((N - 2) * B * np.sqrt(B))
+                    value = np.where(B <= 1e-14, np.nan, value)
+                    value = np.where(constant, 0., value)
+                    value = np.where(N < 3, np.nan, value)
+                elif func == "kurt":
+                    value = ((N * N - 1.) * D / (B * B) - 3 * ((N - 1.) ** 2)) / ((N - 2.) * (N - 3.))
+                    value = np.where(B <= 1e-14, np.nan, value)
+                    value = np.where(constant, -3., value)
+                    value = np.where(N < 4, np.nan, value)
+                elif func == "max":
+                    value = rolling_max
+                elif func == "min":
+                    value = rolling_min
+                else:
+                    indexer = window if starts is None else SegmentIndexer(window_size=window, starts=starts)
+                    value = pd.Series(a).rolling(indexer, min_periods=minp).median().values
+                ret[(window, func)] = value if func == "count" else np.where(valid, value, np.nan)
+    return ret
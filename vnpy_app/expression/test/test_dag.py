@@ -0,0 +1,387 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from vnpy_app.expression.base import Feature
+from vnpy_app.expression.cache import ExpressionCache
+from vnpy_app.expression.chunked import evaluate_chunks, evaluate_to_parquet, get_alignment
+from vnpy_app.expression.dag import compile_field, compile_fields
+from vnpy_app.expression.profile import ExpressionProfile
+from vnpy_app.expression.test.test_parser import parse_config_to_fields
+
+
+def make_bars(size=120, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(size=size))
+    data = {
+        '$close': close,
+        '$open': close + rng.normal(size=size),
+        '$high': close + rng.uniform(0, 2, size=size),
+        '$low': close - rng.uniform(0, 2, size=size),
+        '$volume': rng.integers(1, 1000, size=size).astype(float),
+        '$vwap': close + rng.normal(scale=0.1, size=size),
+    }
+    return pd.DataFrame(data, index=pd.date_range('2019-01-01', periods=size))
+
+
+def reference_features(df):
+    """the features of `parse_config_to_fields` in plain pandas, as in the Alpha158 handler of qlib"""
+    close, open_, high, low, volume = df["$close"], df["$open"], df["$high"], df["$low"], df["$volume"]
+    length = high - low + 1e-12
+    features = {
+        "KMID": (close - open_) / open_,
+        "KLEN": (high - low) / open_,
+        "KMID2": (close - open_) / length,
+        "KUP": (high - np.maximum(open_, close)) / open_,
+        "KUP2": (high - np.maximum(open_, close)) / length,
+        "KLOW": (np.minimum(open_, close) - low) / open_,
+        "KLOW2": (np.minimum(open_, close) - low) / length,
+        "KSFT": (2 * close - high - low) / open_,
+        "KSFT2": (2 * close - high - low) / length,
+    }
+    for name in ["open", "high", "low", "close", "vwap"]:
+        for d in [0, 1, 2]:
+            features[name.upper() + str(d)] = df["$" + name].shift(d) / close
+    for d in range(5):
+        features["VOLUME" + str(d)] = volume.shift(d) / volume
+
+    def regression(x):
+        # slope, r2 and the residual of the last value of the least squares line on 1, 2, ..., len(x)
+        t = np.arange(1, len(x) + 1)
+        if len(x) < 2:
+            return np.nan, np.nan, np.nan
+        slope, intercept = np.polyfit(t, x, 1)
+        fitted = slope * t + intercept
+        ss = np.sum((x - x.mean()) ** 2)
+        return slope, 1 - np.sum((x - fitted) ** 2) / ss, x[-1] - fitted[-1]
+
+    delta = close - close.shift(1)
+    vdelta = volume - volume.shift(1)
+    for d in [5, 10, 20, 30, 60]:
+        r = close.rolling(d, min_periods=1)
+        features["ROC%d" % d] = close.shift(d) / close
+        features["MA%d" % d] = r.mean() / close
+        features["STD%d" % d] = r.std() / close
+        regressions = np.array([regression(close.values[max(0, i + 1 - d):i + 1]) for i in range(len(close))])
+        features["BETA%d" % d] = regressions[:, 0] / close
+        features["RSQR%d" % d] = pd.Series(regressions[:, 1], index=close.index)
+        features["RESI%d" % d] = regressions[:, 2] / close
+        features["MAX%d" % d] = high.rolling(d, min_periods=1).max() / close
+        features["MIN%d" % d] = low.rolling(d, min_periods=1).min() / close
+        features["QTLU%d" % d] = r.quantile(0.8) / close
+        features["QTLD%d" % d] = r.quantile(0.2) / close
+        features["RANK%d" % d] = r.rank(pct=True)
+        hh, ll = high.rolling(d, min_periods=1).max(), low.rolling(d, min_periods=1).min()
+        features["RSV%d" % d] = (close - ll) / (hh - ll + 1e-12)
+        imax = high.rolling(d, min_periods=1).apply(lambda x: x.argmax() + 1, raw=True)
+        imin = low.rolling(d, min_periods=1).apply(lambda x: x.argmin() + 1, raw=True)
+        features["IMAX%d" % d] = imax / d
+        features["IMIN%d" % d] = imin / d
+        features["IMXD%d" % d] = (imax - imin) / d
+        features["CORR%d" % d] = close.rolling(d, min_periods=1).corr(np.log(volume + 1))
+        features["CORD%d" % d] = (close / close.shift(1)).rolling(d, min_periods=1).corr(
+            np.log(volume / volume.shift(1) + 1))
+        up = (close > close.shift(1)).astype(float).rolling(d, min_periods=1).mean()
+        down = (close < close.shift(1)).astype(float).rolling(d, min_periods=1).mean()
+        features["CNTP%d" % d] = up
+        features["CNTN%d" % d] = down
+        features["CNTD%d" % d] = up - down
+        for prefix, diff in [("", delta), ("V", vdelta)]:
+            total = diff.abs().rolling(d, min_periods=1).sum() + 1e-12
+            pos = diff.clip(lower=0).rolling(d, min_periods=1).sum()
+            neg = (-diff).clip(lower=0).rolling(d, min_periods=1).sum()
+            features[prefix + "SUMP%d" % d] = pos / total
+            features[prefix + "SUMN%d" % d] = neg / total
+            features[prefix + "SUMD%d" % d] = (pos - neg) / total
+        features["VMA%d" % d] = volume.rolling(d, min_periods=1).mean() / (volume + 1e-12)
+        features["VSTD%d" % d] = volume.rolling(d, min_periods=1).std() / (volume + 1e-12)
+        wv = (close / close.shift(1) - 1).abs() * volume
+        features["WVMA%d" % d] = wv.rolling(d, min_periods=1).std() / (wv.rolling(d, min_periods=1).mean() + 1e-12)
+    return features
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        config = {
+            "kbar": {},
+            "price": {"windows": [0, 1, 2]},
+            "volume": {},
+            "rolling": {},
+        }
+        self.fields, self.names = parse_config_to_fields(config)
+        self.df = make_bars()
+
+    def test_compile_fields(self):
+        dag = compile_fields(self.fields, self.names)
+        # `Mean($close,5)`, `Ref($close,1)`, ... are shared by many fields
+        self.assertLess(len(dag), sum(len(compile_fields([field])) for field in self.fields))
+        df_feature = dag.evaluate(self.df)
+        self.assertListEqual(df_feature.columns.tolist(), self.names)
+        # an independent reference, `calculate_field` evaluates the same plan
+        expected = reference_features(self.df)
+        for name in self.names:
+            np.testing.assert_allclose(df_feature[name].values, np.asarray(expected[name], dtype=float), rtol=1e-8,
+                                       atol=1e-10, err_msg=name)
+
+    def test_compile_field(self):
+        field = "Corr($close/Ref($close,1), Log($volume/Ref($volume, 1)+1), 10)"
+        plan = compile_field(field)
+        text = str(plan.expression)
+        for seed in range(3):
+            df = make_bars(seed=seed)
+            returns = df["$close"] / df["$close"].shift(1)
+            volume = np.log(df["$volume"] / df["$volume"].shift(1) + 1)
+            np.testing.assert_allclose(plan.evaluate(df).values,
+                                       returns.rolling(10, min_periods=1).corr(volume).values, rtol=1e-8)
+        # the compiled expression is never rewritten by an evaluation
+        self.assertEqual(str(plan.expression), text)
+
+    def test_fused(self):
+        fields = ["Mean($close,5)", "Std($close,20)", "Max($close,5)", "Med($close,10)", "Mean($volume,5)"]
+        dag = compile_fields(fields)
+        # one group per series
+        self.assertEqual(sorted(map(len, dag.fused.values())), [1, 4])
+        df_feature = dag.evaluate(self.df)
+        for field, (column, n, func) in zip(fields, [("$close", 5, "mean"), ("$close", 20, "std"),
+                                                     ("$close", 5, "max"), ("$close", 10, "median"),
+                                                     ("$volume", 5, "mean")]):
+            expected = getattr(self.df[column].rolling(n, min_periods=1), func)()
+            np.testing.assert_allclose(df_feature[field].values, expected.values, rtol=1e-8, err_msg=field)
+
+    def test_lookback(self):
+        self.assertEqual(compile_field("Mean(Ref($close,5),20)").get_lookback(), 25)
+        self.assertEqual(compile_field("$close/Ref($close,1)").get_lookback(), 2)
+        self.assertEqual(compile_field("Corr($close, Log($volume+1), 10)").get_lookback(), 10)
+        self.assertEqual(compile_field("If($close>Ref($close,3),Std($high,5),$low)").get_lookback(), 5)
+        self.assertEqual(compile_field("EMA($close, 10)").get_lookback(), np.inf)
+        self.assertEqual(compile_field("Mean($close, 0)").get_lookback(), np.inf)
+        self.assertEqual(compile_fields(self.fields, self.names).get_lookback(), 61)
+        # the last value only depends on the last `lookback` rows
+        for field in self.fields:
+            plan = compile_field(field)
+            lookback = plan.get_lookback()
+            np.testing.assert_allclose(plan.evaluate(self.df.iloc[-lookback:]).iloc[-1],
+                                       plan.evaluate(self.df).iloc[-1], rtol=1e-8, err_msg=field)
+
+    def test_last_n(self):
+        dag = compile_fields(self.fields + ["Mean(EMA($close,5),3)", "Ref($close,-1)"],
+                             self.names + ["EMA", "FUTURE"])
+        df = self.df.copy()
+        df.iloc[[100, 110], :] = np.nan
+        expected = dag.evaluate(df)
+        for last_n in [1, 2, 7, len(df) + 1]:
+            df_feature = dag.evaluate(df, last_n=last_n)
+            self.assertListEqual(df_feature.index.tolist(), df.index[-last_n:].tolist())
+            np.testing.assert_allclose(df_feature.values, expected.values[-last_n:], rtol=1e-9, atol=1e-12)
+
+    def test_numpy_backend(self):
+        fields = self.fields + ["Rank($close,5)", "Quantile($close,0,0.3)", "Cov($close,$volume,10)", "EMA($close,5)",
+                                "Delta($close,0)", "If($close>$open,$high,$low)"]
+        dag = compile_fields(fields)
+        df = self.df.copy()
+        df.iloc[[3, 40, 41], :] = np.nan
+        expected = dag.evaluate(df)
+        block = df.values
+        for last_n in [None, 3]:
+            for data, columns in [({column: df[column].values for column in df}, None), (block, df.columns.tolist())]:
+                values = dag.evaluate(data, last_n=last_n, backend="numpy", columns=columns)
+                for field in fields:
+                    self.assertIsInstance(values[field], np.ndarray)
+                    np.testing.assert_allclose(values[field].astype(float), expected[field].values[-(last_n or 0):],
+                                               rtol=1e-10, atol=1e-12, err_msg=field)
+        plan = compile_field("Mean($close,10)")
+        np.testing.assert_allclose(plan.evaluate({"$close": df["$close"].values}, backend="numpy"),
+                                   plan.evaluate(df).values)
+        with self.assertRaises(ValueError):
+            dag.evaluate(block, backend="numpy")
+
+    def test_parallel(self):
+        fields = self.fields + ["EMA($close,5)", "$close>$open", "2"]
+        dag = compile_fields(fields)
+        parts = dag.partition(3)
+        self.assertEqual(len(parts), 3)
+        self.assertListEqual(sorted(sum(parts, [])), list(range(len(fields) - 1)))
+        df = self.df.copy()
+        df.iloc[[3, 40], :] = np.nan
+        expected = dag.evaluate(df)
+        for n_workers in [1, 3]:
+            df_feature = dag.evaluate_parallel(df, n_workers=n_workers)
+            self.assertTrue(df_feature.index.equals(df.index))
+            self.assertListEqual(df_feature.columns.tolist(), fields)
+            # the comparison stays boolean, as in `evaluate`
+            pd.testing.assert_series_equal(df_feature.dtypes, expected.dtypes)
+            np.testing.assert_allclose(df_feature.values.astype(float), expected.values.astype(float), rtol=1e-10,
+                                       atol=1e-12)
+
+    def test_threads(self):
+        fields = self.fields + ["Mean(EMA($close,5),3)", "If($close>$open,$high,$low)", "2"]
+        dag = compile_fields(fields)
+        df = self.df.copy()
+        df.iloc[[3, 40], :] = np.nan
+        for last_n, backend in [(None, "pandas"), (5, "pandas"), (None, "numpy")]:
+            expected = dag.evaluate(df, last_n=last_n, backend=backend)
+            values = dag.evaluate(df, last_n=last_n, backend=backend, n_workers=4)
+            if backend == "pandas":
+                pd.testing.assert_frame_equal(values, expected)
+            else:
+                self.assertListEqual(list(values), list(expected))
+                for field in fields:
+                    np.testing.assert_array_equal(values[field], expected[field], err_msg=field)
+
+    def test_cache(self):
+        dag = compile_fields(self.fields, self.names)
+        expected = dag.evaluate(self.df)
+        with tempfile.TemporaryDirectory() as path:
+            cache = ExpressionCache(path)
+            pd.testing.assert_frame_equal(dag.evaluate(self.df, cache=cache), expected)
+            files = set(os.listdir(path))
+            for n_workers in [None, 2]:
+                pd.testing.assert_frame_equal(dag.evaluate(self.df, cache=cache, n_workers=n_workers), expected)
+            self.assertSetEqual(set(os.listdir(path)), files)
+            np.testing.assert_allclose(dag.evaluate(self.df, last_n=3, backend="numpy", cache=cache)["MA5"],
+                                       expected["MA5"].values[-3:], rtol=1e-10)
+            # a hit is writable as a computed value, and the file is left untouched
+            values = dag.evaluate(self.df, backend="numpy", cache=cache)["MA5"]
+            values[0] = -1
+            np.testing.assert_allclose(dag.evaluate(self.df, backend="numpy", cache=cache)["MA5"],
+                                       expected["MA5"].values, rtol=1e-10)
+            # only the new nodes are computed and stored
+            size = len(os.listdir(path))
+            plan = compile_field("Mean($close,5)/Std($close,7)")
+            np.testing.assert_allclose(plan.evaluate(self.df, cache=cache).values,
+                                       plan.evaluate(self.df).values, rtol=1e-10)
+            self.assertEqual(len(os.listdir(path)), size + 2)
+            # a changed column only misses the nodes on it
+            df = self.df.copy()
+            df["$volume"] += 1
+            dag.evaluate(df, cache=cache)
+            self.assertEqual(len(os.listdir(path)), size + 2 + sum(
+                "$volume" in key for key, node in dag.nodes.items() if not isinstance(node, Feature)))
+            cache.max_size = 0
+            cache.evict()
+            self.assertListEqual(os.listdir(path), [])
+
+    def test_chunks(self):
+        ratio = "$volume/Ref($volume,1)"
+        dag = compile_fields(self.fields + ["Cov($close,$volume,10)", "Mean($close,5000)", "$close>$open"]
+                             + ["{}({},10)".format(func, ratio) for func in ["Slope", "Rsquare", "Resi"]])
+        df = make_bars(20000).reset_index(drop=True)
+        df.iloc[[5, 4095, 8192], :] = np.nan
+        # the ratio of the next rows is infinite
+        df.loc[[6000, 12287], "$volume"] = 0
+        expected = dag.evaluate(df)
+        blocks = [df.iloc[start:start + 3000] for start in range(0, len(df), 3000)]
+        df_feature = pd.concat(evaluate_chunks(dag, blocks, chunk_size=5000))
+        # bit-identical
+        pd.testing.assert_frame_equal(df_feature, expected, check_exact=True)
+        with tempfile.TemporaryDirectory() as path:
+            file = os.path.join(path, "features.parquet")
+            self.assertEqual(evaluate_to_parquet(dag, blocks, file, chunk_size=5000), len(df))
+            pd.testing.assert_frame_equal(pd.read_parquet(file), dag.evaluate(df, dtype=np.float32), check_exact=True)
+        # the batches of a Parquet file are numbered from 0, the output is numbered by the global row
+        batches = [block.reset_index(drop=True) for block in blocks]
+        pd.testing.assert_frame_equal(pd.concat(evaluate_chunks(dag, batches, chunk_size=5000)), expected,
+                                      check_exact=True)
+        for field in ["EMA($close,5)", "Ref($close,-1)"]:
+            with self.assertRaises(ValueError):
+                list(evaluate_chunks(compile_fields([field]), blocks))
+        # the alignment does not grow with the number of windows
+        windows = [5000, 10000, 15000, 20000, 25000, 30000]
+        self.assertEqual(get_alignment(compile_fields(["Mean($close,{})".format(n) for n in windows])), 32768)
+
+    def test_dtype(self):
+        fields = self.fields + ["$close>$open", "Slope($close,20)"]
+        dag = compile_fields(fields)
+        expected = dag.evaluate(self.df)
+        df_feature = dag.evaluate(self.df, dtype=np.float32)
+        self.assertEqual(df_feature["$close>$open"].dtype, bool)
+        self.assertTrue((df_feature.drop(columns="$close>$open").dtypes == np.float32).all())
+        # computed in float64, then rounded
+        np.testing.assert_array_equal(df_feature.values.astype(float),
+                                      expected.astype(float).values.astype(np.float32).astype(float))
+        values = dag.evaluate(self.df, last_n=5, backend="numpy", dtype=np.float32)
+        self.assertEqual(values["Slope($close,20)"].dtype, np.float32)
+        pd.testing.assert_series_equal(dag.evaluate_parallel(self.df, n_workers=2, dtype=np.float32).dtypes,
+                                       df_feature.dtypes)
+
+    def test_profile(self):
+        dag = compile_fields(self.fields, self.names)
+        profile = ExpressionProfile()
+        for n_workers in [None, 2]:
+            pd.testing.assert_frame_equal(dag.evaluate(self.df, n_workers=n_workers, profile=profile),
+                                          dag.evaluate(self.df))
+        df_profile = profile.to_frame()
+        self.assertSetEqual(set(df_profile.index), set(dag.nodes))
+        self.assertTrue((df_profile["calls"] == 2).all())
+        self.assertTrue((df_profile["rows"] == 2 * len(self.df)).all())
+        self.assertEqual(df_profile.loc["Mean($close,5)", "bytes"], 2 * len(self.df) * 8)
+        self.assertGreater(profile.peak_bytes, 0)
+        # every node once in the flame graph
+        lines = profile.to_folded(dag)
+        self.assertEqual(len(lines), len(dag))
+        stacks = [line.rsplit(" ", 1)[0] for line in lines]
+        self.assertIn("KMID;Div(Sub($close,$open),$open);Sub($close,$open)", stacks)
+        with tempfile.TemporaryDirectory() as path:
+            cache = ExpressionCache(path)
+            dag.evaluate(self.df, cache=cache)
+            profile.reset()
+            dag.evaluate(self.df, cache=cache, profile=profile)
+            self.assertSetEqual(set(profile.to_frame().query("cache_hits == 1").index), set(dag.outputs))
+
+    def test_panel(self):
+        fields = self.fields + ["IdxMax($high,0)", "WMA($close,0)", "Resi($close,0)", "Quantile($close,0,0.3)",
+                                "Corr($close,$volume,0)", "Med($close,0)", "Ref($close,-2)", "Delta($close,0)",
+                                "EMA($close,0.3)", "Rank($close,0)", "Mad($close,5)", "Max($high,0)"]
+        dag = compile_fields(fields)
+        frames = []
+        for k, size in enumerate([120, 70, 3]):
+            df = make_bars(size, seed=k)
+            df.iloc[[1, size // 2], :] = np.nan
+            df.index = pd.MultiIndex.from_arrays([df.index, ["I{}".format(k)] * size], names=["datetime", "instrument"])
+            frames.append(df)
+        # the layout of `fetch_df_by_index`, the instruments are interleaved
+        panel = pd.concat(frames).sort_index()
+        df_feature = dag.evaluate(panel)
+        self.assertTrue(df_feature.index.equals(panel.index))
+        for df in frames:
+            expected = dag.evaluate(df.droplevel("instrument"))
+            values = df_feature.loc[df.index]
+            for field in fields:
+                np.testing.assert_allclose(values[field].values.astype(float), expected[field].values.astype(float),
+                                           rtol=1e-8, atol=1e-10, err_msg=field)
+        np.testing.assert_allclose(compile_field("Ref($close,-2)").evaluate(panel).values,
+                                   df_feature["Ref($close,-2)"].values)
+        with self.assertRaises(ValueError):
+            dag.evaluate(panel, last_n=1)
+
+    def test_cross_section(self):
+        frames = []
+        for k in range(5):
+            df = make_bars(50, seed=k)
+            df.iloc[[k, 20], :] = np.nan
+            df.index = pd.MultiIndex.from_arrays([df.index, ["I{}".format(k)] * 50], names=["datetime", "instrument"])
+            frames.append(df)
+        panel = pd.concat(frames).sort_index()
+        fields = ["CSRank($close/Ref($close,1))", "CSZScore(Mean($volume,5))", "CSDemean($close)",
+                  "CSQuantile($close,0.8)", "Mean(CSRank($close),5)"]
+        df_feature = compile_fields(fields).evaluate(panel)
+        returns = (panel["$close"] / panel.groupby("instrument")["$close"].shift(1)).groupby("datetime")
+        volume = panel.groupby("instrument")["$volume"].transform(lambda x: x.rolling(5, min_periods=1).mean())
+        close = panel["$close"].groupby("datetime")
+        rank = close.rank(pct=True).groupby("instrument").transform(lambda x: x.rolling(5, min_periods=1).mean())
+        for field, expected in zip(fields, [
+            returns.rank(pct=True),
+            volume.groupby("datetime").transform(lambda x: (x - x.mean()) / x.std()),
+            panel["$close"] - close.transform("mean"),
+            close.transform(lambda x: x.quantile(0.8)),
+            rank,
+        ]):
+            np.testing.assert_allclose(df_feature[field].values, expected.loc[panel.index].values, rtol=1e-10,
+                                       err_msg=field)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@ import unittest
 
 import pandas as pd
 
-from vnpy_app.expression.parser import calculate_field
+from vnpy_app.expression.parser import calculate_field, parser_expression
 
 
 def parse_config_to_fields(config=None):
@@ -199,6 +199,27 @@ class MyTestCase(unittest.TestCase):
             print(field)
             print(self.calculate_field(df, field))
 
+    def test_parser(self):
+        # precedence and associativity of python
+        self.assertEqual(str(parser_expression("$a-$b*$c**2")), "Sub($a,Mul($b,Power($c,2)))")
+        self.assertEqual(str(parser_expression("$a-$b-$c")), "Sub(Sub($a,$b),$c)")
+        self.assertEqual(str(parser_expression("($a>$b)&($c<$d)")), "And(Gt($a,$b),Lt($c,$d))")
+        # constant folding
+        self.assertEqual(parser_expression("1+2*3"), 7)
+        self.assertEqual(parser_expression("Abs(-2)"), 2)
+        self.assertEqual(str(parser_expression("Ref($close, -1)")), "Ref($close,-1)")
+        self.assertEqual(str(parser_expression("$close/(1+1e-12)")), "Div($close,{})".format(1 + 1e-12))
+        # canonical form of commutative operators
+        self.assertEqual(str(parser_expression("2*$close")), str(parser_expression("$close*2")))
+        self.assertEqual(str(parser_expression("1e-12+($high-$low)")), str(parser_expression("$high-$low+1e-12")))
+        self.assertEqual(str(parser_expression("Greater($open, $close)")),
+                         str(parser_expression("Greater($close,$open)")))
+        # parsed fields are cached
+        self.assertIs(parser_expression("Mean($close, 5)"), parser_expression("Mean($close, 5)"))
+        for field in ["Mean($close, 5", "$close $open", "$close # 2", "1 < $close < 2", "Mean($close,)"]:
+            with self.assertRaises(ValueError, msg=field):
+                parser_expression(field)
+
 
 if __name__ == '__main__':
     unittest.main()
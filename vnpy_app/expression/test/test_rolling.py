@@ -0,0 +1,222 @@
+import bisect
+import unittest
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from vnpy_app.expression import expanding, rolling
+from vnpy_app.expression.parser import calculate_field
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        size = 10000
+        self.a = 100 + np.cumsum(rng.normal(size=size))
+        self.a[rng.random(size) < 0.1] = np.nan
+        # a gap longer than the window
+        self.a[500:530] = np.nan
+
+    def test_rolling_regression(self):
+        # infinite values, skipped as nan, one of them at the start of a block
+        a = self.a.copy()
+        a[[9, 2048, 7000]] = [np.inf, -np.inf, np.inf]
+        # windows shorter than a block, as long as a block, and spanning more than one block
+        for window in [5, 20, rolling.BLOCK_SIZE, rolling.BLOCK_SIZE + 100]:
+            for func, cls in [(rolling.rolling_slope, rolling.Slope), (rolling.rolling_rsquare, rolling.Rsquare),
+                              (rolling.rolling_resi, rolling.Resi)]:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    expected = rolling.rolling(cls(window), a)
+                # a window with less than 2 values has no slope, the loop gets 0/0 or +-x/0 from the rounding error
+                expected[pd.Series(a).rolling(window, min_periods=1).count().values < 2] = np.nan
+                np.testing.assert_allclose(func(a, window), expected, rtol=1e-6, atol=1e-8,
+                                           err_msg="{}({})".format(cls.__name__, window))
+
+    def test_expanding_regression(self):
+        a = self.a.copy()
+        a[[9, 7000]] = [np.inf, -np.inf]
+        for func, cls in [(expanding.expanding_slope, expanding.Slope),
+                          (expanding.expanding_rsquare, expanding.Rsquare),
+                          (expanding.expanding_resi, expanding.Resi)]:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                expected = expanding.expanding(cls(), a)
+            expected[pd.Series(a).expanding().count().values < 2] = np.nan
+            np.testing.assert_allclose(func(a), expected, rtol=1e-6, atol=1e-8, err_msg=cls.__name__)
+
+    def test_apply_kernels(self):
+        def mad(x):
+            x1 = x[~np.isnan(x)]
+            return np.mean(np.abs(x1 - x1.mean()))
+
+        def weighted_mean(x):
+            w = np.arange(len(x)) + 1
+            w = w / w.sum()
+            return np.nanmean(w * x)
+
+        def exp_weighted_mean(x):
+            a = 1 - 2 / (1 + len(x))
+            w = a ** np.arange(len(x))[::-1]
+            w /= w.sum()
+            return np.nansum(w * x)
+
+        series = pd.Series(self.a[:1000])
+        series[:3] = np.nan
+        # ties
+        series[100:110] = 100
+        # most windows have a nan, so also test the series without nan, and with infinite values which pandas takes
+        # as nan before `apply`
+        clean = series.interpolate().bfill()
+        infinite = clean.copy()
+        infinite[[200, 300]] = [np.inf, -np.inf]
+        for series in [series, clean, infinite]:
+            a = series.values
+            with np.errstate(invalid="ignore"), warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                for window in [1, 5, 40, 2000]:
+                    r = series.rolling(window, min_periods=1)
+                    for func, expected in [
+                        (rolling.rolling_idxmax, r.apply(lambda x: x.argmax() + 1, raw=True)),
+                        (rolling.rolling_idxmin, r.apply(lambda x: x.argmin() + 1, raw=True)),
+                        (rolling.rolling_mad, r.apply(mad, raw=True)),
+                        (rolling.rolling_wma, r.apply(weighted_mean, raw=True)),
+                    ]:
+                        np.testing.assert_allclose(func(a, window), expected.values, rtol=1e-10, atol=1e-12,
+                                                   err_msg="{}({})".format(func.__name__, window))
+                    np.testing.assert_allclose(rolling.rolling(rolling.Mad(window), a), r.apply(mad, raw=True).values,
+                                               rtol=1e-8, atol=1e-10, err_msg="Mad({})".format(window))
+                r = series.expanding(min_periods=1)
+                for func, expected in [
+                    (expanding.expanding_idxmax, r.apply(lambda x: x.argmax() + 1, raw=True)),
+                    (expanding.expanding_idxmin, r.apply(lambda x: x.argmin() + 1, raw=True)),
+                    (expanding.expanding_wma, r.apply(weighted_mean, raw=True)),
+                    (expanding.expanding_ema, r.apply(exp_weighted_mean, raw=True)),
+                ]:
+                    np.testing.assert_allclose(func(a), expected.values, rtol=1e-10, atol=1e-12,
+                                               err_msg=func.__name__)
+
+    def test_quantile(self):
+        df = pd.DataFrame({"$close": self.a[:1000]})
+        df.loc[[200, 300], "$close"] = [np.inf, -np.inf]
+        for n in [0, 5, 40]:
+            series = df["$close"]
+            r = series.expanding(min_periods=1) if n == 0 else series.rolling(n, min_periods=1)
+            expected = r.apply(lambda x: np.quantile(x, 0.8), raw=True)
+            np.testing.assert_allclose(calculate_field(df, "Quantile($close,{},0.8)".format(n)).values,
+                                       expected.values, rtol=1e-10)
+
+    def test_zero_volume(self):
+        # a zero volume makes the ratio of the next row infinite, which is taken as nan, so it never leaks into the
+        # other rows, before it in particular
+        df = pd.DataFrame({"$volume": [5., 0, 3, 4, 2, 6, 1, 7, 3, 2]})
+        ratio = df["$volume"] / df["$volume"].shift(1)
+        self.assertTrue(np.isinf(ratio).any())
+        expected_df = pd.DataFrame({"$ratio": ratio.replace(np.inf, np.nan)})
+        for field in ["EMA({},0)", "WMA({},3)", "WMA({},0)", "Mad({},3)", "IdxMax({},3)", "IdxMin({},0)",
+                      "Quantile({},3,0.5)", "Mean({},3)", "Slope({},3)", "Resi({},0)"]:
+            np.testing.assert_allclose(calculate_field(df, field.format("$volume/Ref($volume,1)")).values,
+                                       calculate_field(expected_df, field.format("$ratio")).values, rtol=1e-12,
+                                       err_msg=field)
+        self.assertEqual(calculate_field(df, "EMA($volume/Ref($volume,1),0)").iloc[1], 0.)
+
+    def test_sorted_window(self):
+        rng = np.random.default_rng(0)
+        # a small load to split and empty the buckets
+        window = rolling.SortedWindow(load=4)
+        values = []
+        for val in rng.integers(0, 20, size=2000).astype(float):
+            if values and rng.random() < 0.45:
+                _val = values.pop(rng.integers(len(values)))
+                window.remove(_val)
+            else:
+                values.append(val)
+                window.add(val)
+            expected = sorted(values)
+            self.assertEqual(len(window), len(expected))
+            self.assertEqual([window[k] for k in range(len(window))], expected)
+            self.assertEqual(window.rank(val), (bisect.bisect_left(expected, val), bisect.bisect_right(expected, val)))
+            lower = expected[:bisect.bisect_left(expected, val + 0.5)]
+            self.assertEqual(window.lower_sum(val + 0.5), (len(lower), sum(lower)))
+            self.assertEqual(window.sum(), sum(expected))
+            if expected:
+                self.assertAlmostEqual(window.quantile(0.3), np.quantile(expected, 0.3))
+
+    def test_rolling_rank(self):
+        series = pd.Series(np.round(self.a[:3000]))
+        for window in [5, 1000, 0]:
+            r = series.expanding(min_periods=1) if window == 0 else series.rolling(window, min_periods=1)
+            np.testing.assert_allclose(rolling.rolling_rank(series.values, window), r.rank(pct=True).values,
+                                       rtol=1e-12, err_msg=str(window))
+            # every segment on its own, as the instruments of a panel
+            starts = np.repeat([0, 1000, 1010], [1000, 10, 1990])
+            groups = series.groupby(starts)
+            r = groups.expanding(min_periods=1) if window == 0 else groups.rolling(window, min_periods=1)
+            np.testing.assert_allclose(rolling.rolling_rank(series.values, window, starts), r.rank(pct=True).values,
+                                       rtol=1e-12, err_msg=str(window))
+
+    def test_rolling_stats(self):
+        series = pd.Series(self.a[:3000])
+        # a flat stretch, an infinite value and a gap
+        series[1000:1020] = 5.
+        series[1500] = np.inf
+        series[2000:2100] = np.nan
+        stats = [(window, func) for window in [5, 10, 50] for func in rolling.FUSED_STATS]
+        for min_periods in [None, 1]:
+            results = rolling.rolling_stats(series.values, stats, min_periods)
+            for window, func in stats:
+                expected = getattr(series.rolling(window, min_periods=min_periods), func)()
+                # the power sums of pandas are updated in place and drift, mostly on the higher moments
+                rtol = 1e-3 if func in ("skew", "kurt") else 1e-8
+                np.testing.assert_allclose(results[(window, func)], expected.values, rtol=rtol, atol=1e-6,
+                                           err_msg="{}({})".format(func, window))
+
+    def test_rolling_stats_far_from_zero(self):
+        # small moves around a high price level, with a gap longer than the blocks of the windows
+        rng = np.random.default_rng(1)
+        series = pd.Series(5000 + 0.01 * rng.normal(size=1000))
+        windows = [20, 64]
+        gap = max(rolling._block_size(window) for window in windows) * 2
+        series[128:128 + gap] = np.nan
+        stats = [(window, func) for window in windows for func in rolling.FUSED_STATS]
+        results = rolling.rolling_stats(series.values, stats)
+        for window, func in stats:
+            expected = getattr(series.rolling(window), func)()
+            rtol = 1e-3 if func in ("skew", "kurt") else 1e-8
+            np.testing.assert_allclose(results[(window, func)], expected.values, rtol=rtol, atol=1e-6,
+                                       err_msg="{}({})".format(func, window))
+
+    def test_expanding_stats(self):
+        series = pd.Series(self.a[:3000])
+        # leading nan, a flat segment and an infinite value
+        series[:3] = np.nan
+        series[1000:1200] = 5.
+        series[2500] = np.inf
+        starts = np.repeat([0, 1000, 1200], [1000, 200, 1800])
+        for func in expanding.EXPANDING_STATS:
+            expected = getattr(series.expanding(min_periods=1), func)()
+            np.testing.assert_allclose(expanding.expanding_stats(series.values, func), expected.values, rtol=1e-8,
+                                       atol=1e-6, err_msg=func)
+            # every segment on its own, as the instruments of a panel
+            expected = getattr(series.groupby(starts).expanding(min_periods=1), func)()
+            np.testing.assert_allclose(expanding.expanding_stats(series.values, func, starts), expected.values,
+                                       rtol=1e-8, atol=1e-6, err_msg=func)
+            # the streaming state keeps no history
+            state = getattr(expanding, func.capitalize())()
+            with np.errstate(divide="ignore", invalid="ignore"):
+                streamed = expanding.expanding(state, series.values[:2500])
+            self.assertFalse(hasattr(state, "barv"))
+            np.testing.assert_allclose(streamed, expanding.expanding_stats(series.values[:2500], func), rtol=1e-8,
+                                       atol=1e-6, err_msg=func)
+
+    def test_leading_nan(self):
+        a = self.a.copy()
+        a[:3] = np.nan
+        self.assertTrue(np.isnan(rolling.rolling_slope(a, 5)[:3]).all())
+        self.assertTrue(np.isnan(expanding.expanding_resi(a)[:3]).all())
+        # a single value has no regression line
+        for cls in [expanding.Slope, expanding.Resi, expanding.Rsquare]:
+            self.assertTrue(np.isnan(cls().update(1.)))
+
+
+if __name__ == '__main__':
+    unittest.main()
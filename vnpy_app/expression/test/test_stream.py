@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from vnpy_app.expression.dag import compile_fields
+from vnpy_app.expression.test.test_dag import make_bars
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.df = make_bars(size=80)
+        # missing bars, as after a halt
+        self.df.iloc[[3, 20, 21, 22, 50], :] = np.nan
+        self.fields = [
+            "Mean($close, 5)", "Sum($close, 5)", "Std($close, 5)", "Var($close, 5)", "Skew($close, 5)",
+            "Kurt($close, 6)", "Max($high, 5)", "Min($low, 5)", "IdxMax($high, 5)", "IdxMin($low, 5)",
+            "Quantile($close, 5, 0.8)", "Med($close, 5)", "Mad($close, 5)", "Rank($close, 5)", "Count($close, 5)",
+            "Ref($close, 2)", "Delta($close, 3)", "Delta($close, 0)", "Slope($close, 5)", "Rsquare($close, 5)",
+            "Resi($close, 5)", "WMA($close, 5)", "EMA($close, 5)", "EMA($close, 0.3)", "EMA($close, 0)",
+            "Corr($close, Log($volume+1), 5)", "Cov($close, $volume, 5)",
+            "Mean($close, 0)", "Std($close, 0)", "Max($high, 0)", "Slope($close, 0)", "Rank($close, 0)",
+            "Mean($close>Ref($close, 1), 5)-Mean($close<Ref($close, 1), 5)",
+            "Sum(Greater($close-Ref($close, 1), 0), 5)/(Sum(Abs($close-Ref($close, 1)), 5)+1e-12)",
+            "If($close>$open, $high, $low)",
+        ]
+
+    def test_stream(self):
+        dag = compile_fields(self.fields, self.fields)
+        expected = dag.evaluate(self.df)
+        stream = dag.stream()
+        for i in range(len(self.df)):
+            values = stream.update(self.df.iloc[i])
+            for field in self.fields:
+                np.testing.assert_allclose(values[field], expected[field].iloc[i], rtol=1e-7, atol=1e-9,
+                                           err_msg="{} at row {}".format(field, i))
+
+    def test_stream_inf(self):
+        # a zero volume makes the ratio of the next bar infinite, and two in a row make it nan
+        df = self.df.copy()
+        df.iloc[[10, 30, 31, 60], df.columns.get_loc("$volume")] = 0
+        ratio = "$volume/Ref($volume, 1)"
+        fields = [field.format(ratio) for field in [
+            "Mean({}, 3)", "Sum({}, 5)", "Std({}, 5)", "Var({}, 5)", "Skew({}, 5)", "Kurt({}, 6)", "Max({}, 5)",
+            "Min({}, 5)", "Med({}, 5)", "Rank({}, 5)", "Count({}, 5)", "Ref({}, 2)", "EMA({}, 5)", "EMA({}, 0.3)",
+            "Corr({}, $close, 5)", "Cov({}, $close, 5)", "Mean({}, 0)", "Std({}, 0)", "Max({}, 0)",
+            "Slope({}, 5)", "Rsquare({}, 5)", "Resi({}, 5)", "Slope({}, 0)",
+            "IdxMax({}, 5)", "IdxMin({}, 5)", "Quantile({}, 5, 0.8)", "Mad({}, 5)", "WMA({}, 5)", "EMA({}, 0)",
+            "IdxMax({}, 0)", "Mad({}, 0)", "WMA({}, 0)",
+        ]]
+        dag = compile_fields(fields, fields)
+        expected = dag.evaluate(df)
+        self.assertTrue(np.isinf(df["$volume"] / df["$volume"].shift(1)).any())
+        stream = dag.stream()
+        for i in range(len(df)):
+            values = stream.update(df.iloc[i])
+            for field in fields:
+                np.testing.assert_allclose(values[field], expected[field].iloc[i], rtol=1e-7, atol=1e-9,
+                                           err_msg="{} at row {}".format(field, i))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1 +1,3 @@
-from .processor import *
\ No newline at end of file
+from .processor import *
+from .pipeline import *
+from .transform import *
@@ -0,0 +1,128 @@
+from typing import Dict, List, Text, Tuple, Union
+
+import pandas as pd
+
+from .processor import Processor
+from .transform import ArrayTransform
+from .utils import fetch_df_by_index, get_level_index
+
+# the data for inference, and for learning
+DK_I = "infer"
+DK_L = "learn"
+# the learn processors are applied on the raw data, or on the output of the infer processors
+PTYPE_I = "independent"
+PTYPE_A = "append"
+
+
+def split_segments(df: pd.DataFrame, segments: Dict[Text, Tuple], level: Union[Text, int] = "datetime") -> dict:
+    """
+    split `df` into segments of datetime, e.g. {"train": ("2022-07-05", "2022-08-01"), ...}
+
+    When the index is sorted by datetime (its first level), the rows of a segment are selected as a slice,
+    `df.loc[beg:end]`, so every segment is a view of `df` rather than a copy; copy a segment before modifying it.
+    """
+    if get_level_index(df, level) == 0 and df.index.get_level_values(0).is_monotonic_increasing:
+        return {name: df.loc[beg:end] for name, (beg, end) in segments.items()}
+    return {name: fetch_df_by_index(df, slice(beg, end), level=level) for name, (beg, end) in segments.items()}
+
+
+class ProcessorPipeline:
+    """
+    Fit processors and apply them to a dataset, as the data handler of qlib
+
+    `infer_processors` give the data for inference (e.g. normalizations), and `learn_processors` the data for
+    learning, which may drop samples (e.g. `DropnaLabel`). With `process_type` PTYPE_A, the learn processors are
+    applied on the output of the infer processors, and with PTYPE_I on the raw data.
+
+    The processors modify their input in place unless they are `readonly()`. A frame which is shared, i.e. the input
+    of the caller or the raw data kept for the learn processors, is copied once before the first processor which is
+    not readonly, and never otherwise; `inplace=True` hands the input over to the processors.
+
+    Example:
+        pipeline = ProcessorPipeline(
+            infer_processors=[RobustZScoreNorm(beg, end, fields_group="feature"), Fillna(fields_group="feature")],
+            learn_processors=[DropnaLabel()],
+        )
+        c = split_segments(pipeline.fit_process(df), segments)
+        ...
+        df_infer = pipeline.process(df_new)
+        pipeline.to_transform().save("transform.npz")  # for live inference
+    """
+
+    def __init__(self, infer_processors: List[Processor] = (), learn_processors: List[Processor] = (),
+                 process_type: Text = PTYPE_A, fit_start_time=None, fit_end_time=None):
+        if process_type not in (PTYPE_I, PTYPE_A):
+            raise ValueError("Unsupported process_type {}, use one of {}".format(process_type, [PTYPE_I, PTYPE_A]))
+        self.infer_processors = list(infer_processors)
+        self.learn_processors = list(learn_processors)
+        self.process_type = process_type
+        for proc in self.infer_processors + self.learn_processors:
+            if fit_start_time is not None:
+                proc.config(fit_start_time=fit_start_time)
+            if fit_end_time is not None:
+                proc.config(fit_end_time=fit_end_time)
+
+    @staticmethod
+    def _run(processors: List[Processor], df: pd.DataFrame, shared: bool, with_fit: bool):
+        """
+        apply `processors` to `df`, fitting each of them on the output of the previous one if `with_fit`
+
+        Returns the processed frame, and whether it is still shared, i.e. no processor copied it: the output of a
+        readonly processor may be a view of its input.
+        """
+        for proc in processors:
+            if shared and not proc.readonly():
+                df = df.copy()
+                shared = False
+            if with_fit:
+                proc.fit(df)
+            df = proc(df)
+        return df, shared
+
+    def fit_process(self, df: pd.DataFrame, data_key: Text = DK_L, inplace: bool = False) -> pd.DataFrame:
+        """
+        fit the processors on `df` and return its data for learning (DK_L) or for inference (DK_I)
+
+        The infer processors are fitted in both cases, so `process` gives the data for inference afterwards.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            the raw data, the processors select their fit window themselves (see `fit_start_time`)
+        data_key : str
+            DK_L or DK_I
+        inplace : bool
+            whether the processors may modify `df`, e.g. when the caller does not use it anymore
+        """
+        if self.process_type == PTYPE_A or data_key == DK_I:
+            df_infer, shared = self._run(self.infer_processors, df, not inplace, with_fit=True)
+            if data_key == DK_I:
+                return df_infer
+            return self._run(self.learn_processors, df_infer, shared, with_fit=True)[0]
+        # the raw data is kept for the learn processors
+        self._run(self.infer_processors, df, True, with_fit=True)
+        return self._run(self.learn_processors, df, not inplace, with_fit=True)[0]
+
+    def process(self, df: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
+        """apply the fitted infer processors to `df`, e.g. new data for prediction"""
+        for proc in self.infer_processors:
+            if not proc.is_for_infer():
+                raise TypeError("Only processors usable for inference can be used in `infer_processors`")
+        return self._run(self.infer_processors, df, not inplace, with_fit=False)[0]
+
+    def to_transform(self) -> ArrayTransform:
+        """the fitted infer processors as one `ArrayTransform`, e.g. to be saved with the model"""
+        transform = ArrayTransform()
+        for proc in self.infer_processors:
+            transform = transform.then(proc.to_transform())
+        return transform
+
+
+__all__ = [
+    "DK_I",
+    "DK_L",
+    "PTYPE_I",
+    "PTYPE_A",
+    "split_segments",
+    "ProcessorPipeline",
+]
@@ -5,7 +5,10 @@ from typing import Union, Text
 import numpy as np
 import pandas as pd
 
-from .utils import fetch_df_by_index
+from .sketch import TDigest
+from .transform import ArrayTransform
+from .utils import fetch_df_by_index, get_datetime_segments
+from ..expression.cross_section import cs_rank
 
 EPS = 1e-12
 
@@ -27,6 +30,59 @@ def get_group_columns(df: pd.DataFrame, group: Union[Text, None]):
         return df.columns[df.columns.get_loc(group)]
 
 
+def get_column_names(cols: pd.Index) -> list:
+    """the names of the columns `cols`, without the group level of multi-index columns"""
+    return list(cols.get_level_values(-1)) if isinstance(cols, pd.MultiIndex) else list(cols)
+
+
+def get_float_dtype(*dtypes) -> np.dtype:
+    """
+    the dtype which the processed values of columns of `dtypes` are stored in
+
+    Float features keep their dtype, e.g. a float32 feature matrix stays float32 for LightGBM, while the fitted
+    statistics are computed in float64. Other columns are processed in float64.
+    """
+    dtype = np.result_type(*dtypes)
+    return dtype if dtype.kind == "f" else np.dtype(np.float64)
+
+
+def get_feature_block(df: pd.DataFrame, cols) -> np.ndarray:
+    """
+    the values of the columns `cols` of `df` as one 2-D float array, in the dtype of `get_float_dtype`, which the
+    processors modify in place in one vectorized pass before `set_feature_block`
+    """
+    if len(cols) == 0:
+        return np.empty((len(df), 0))
+    block = df[cols]
+    x = block.to_numpy(dtype=get_float_dtype(*block.dtypes))
+    # `block` is already a copy of the columns, unless pandas shares its values
+    return x if x.flags.writeable else x.copy()
+
+
+def get_float_groups(df: pd.DataFrame, cols) -> list:
+    """the float columns of `cols` grouped by dtype, so every group is one block which keeps its dtype"""
+    dtypes = df.dtypes[cols]
+    return [cols[(dtypes == dtype).values] for dtype in dtypes.unique() if dtype.kind == "f"]
+
+
+def set_feature_block(df: pd.DataFrame, cols, x: np.ndarray, changed: np.ndarray = None) -> pd.DataFrame:
+    """
+    write the block `x` of `get_feature_block` back to the columns `cols` of `df`, only the `changed` ones (a mask of
+    the columns) if given
+
+    The columns which already have the dtype of the block are set in place, without creating new columns.
+    """
+    if changed is not None:
+        cols, x = cols[changed], x[:, changed]
+    if len(cols) == 0:
+        return df
+    if (df.dtypes[cols] == x.dtype).all():
+        df.iloc[:, df.columns.get_indexer(cols)] = x
+    else:
+        df[cols] = x
+    return df
+
+
 class Processor(ABC):
     def fit(self, df: pd.DataFrame):
         """
@@ -86,6 +142,14 @@ class Processor(ABC):
             if attr in kwargs:
                 kwargs.pop(attr)
 
+    def to_transform(self) -> ArrayTransform:
+        """
+        the fitted processor as numpy operations on a feature array, see `ArrayTransform`, for low latency inference
+
+        Only the processors which transform every row on its own can be exported.
+        """
+        raise NotImplementedError("{} could not be exported as an ArrayTransform".format(type(self).__name__))
+
 
 class DropnaProcessor(Processor):
     def __init__(self, fields_group=None):
@@ -161,12 +225,16 @@ class ProcessInf(Processor):
     """Process infinity"""
 
     def __call__(self, df):
-        def process_inf(dataframe):
-            for col in dataframe.columns:
-                dataframe[col] = dataframe[col].replace([np.inf, -np.inf], np.nan)
-            return dataframe
+        # only float columns hold infinite values
+        for cols in get_float_groups(df, df.columns):
+            x = get_feature_block(df, cols)
+            mask = np.isinf(x)
+            np.copyto(x, np.nan, where=mask)
+            set_feature_block(df, cols, x, mask.any(axis=0))
+        return df
 
-        return process_inf(df)
+    def to_transform(self):
+        return ArrayTransform(steps=[("inf", {})])
 
 
 class Fillna(Processor):
@@ -178,13 +246,21 @@ class Fillna(Processor):
         super().__init__()
 
     def __call__(self, df):
-        if self.fields_group is None:
-            df.fillna(self.fill_value, inplace=True)
-        else:
-            cols = get_group_columns(df, self.fields_group)
-            df.fillna({col: self.fill_value for col in cols}, inplace=True)
+        cols = get_group_columns(df, self.fields_group)
+        others = cols[[dtype.kind != "f" for dtype in df.dtypes[cols]]]
+        if len(others):
+            # e.g. object columns
+            df[others] = df[others].fillna(self.fill_value)
+        for cols in get_float_groups(df, cols):
+            x = get_feature_block(df, cols)
+            mask = np.isnan(x)
+            np.copyto(x, self.fill_value, where=mask)
+            set_feature_block(df, cols, x, mask.any(axis=0))
         return df
 
+    def to_transform(self):
+        return ArrayTransform(steps=[("fillna", {"value": self.fill_value})])
+
 
 class MinMaxNorm(Processor):
     def __init__(self, fit_start_time, fit_end_time, fields_group=None):
@@ -199,23 +275,42 @@ class MinMaxNorm(Processor):
 
     def fit(self, df):
         df = fetch_df_by_index(df, slice(self.fit_start_time, self.fit_end_time), level="datetime")
+        self.min_val = None
+        self.max_val = None
+        self.partial_fit(df)
+
+    def partial_fit(self, df):
+        """
+        update the min and max with a chunk of the data, e.g. of a dataset which does not fit in memory, or of a new
+        day without refitting the history
+
+        NOTE: the whole chunk is used, the chunks are not limited to the fit window of `fit`
+        """
         cols = get_group_columns(df, self.fields_group)
-        self.min_val = np.nanmin(df[cols].values, axis=0)
-        self.max_val = np.nanmax(df[cols].values, axis=0)
+        x = df[cols].values
+        if len(x):
+            # `fmin` and `fmax` skip nan values
+            min_val, max_val = np.fmin.reduce(x, axis=0), np.fmax.reduce(x, axis=0)
+        else:
+            # as a column without any value
+            min_val, max_val = np.full(len(cols), np.nan), np.full(len(cols), np.nan)
+        if self.min_val is not None:
+            min_val, max_val = np.fmin(self.min_val, min_val), np.fmax(self.max_val, max_val)
+        self.min_val, self.max_val = min_val, max_val
         self.ignore = self.min_val == self.max_val
         self.cols = cols
 
     def __call__(self, df):
-        def normalize(x, min_val=self.min_val, max_val=self.max_val, ignore=self.ignore):
-            if (~ignore).all():
-                return (x - min_val) / (max_val - min_val)
-            for i in range(ignore.size):
-                if not ignore[i]:
-                    x[i] = (x[i] - min_val) / (max_val - min_val)
-            return x
-
-        df.loc(axis=1)[self.cols] = normalize(df[self.cols].values)
-        return df
+        # broadcast over the block, the ignored columns have a shift of 0 and a scale of 1
+        x = get_feature_block(df, self.cols)
+        self.to_transform()(x)
+        return set_feature_block(df, self.cols, x)
+
+    def to_transform(self):
+        # the ignored columns are kept as they are
+        shift = np.where(self.ignore, 0, self.min_val)
+        scale = np.where(self.ignore, 1, self.max_val - self.min_val)
+        return ArrayTransform(get_column_names(self.cols), [("affine", {"shift": shift, "scale": scale})])
 
 
 class ZScoreNorm(Processor):
@@ -229,27 +324,56 @@ class ZScoreNorm(Processor):
         self.std_train = None
         self.ignore = None
         self.cols = None
+        # the number of not nan values and the sum of their squared deviations, see `partial_fit`
+        self.count_train = None
+        self.m2_train = None
         super().__init__()
 
     def fit(self, df):
         df = fetch_df_by_index(df, slice(self.fit_start_time, self.fit_end_time), level="datetime")
+        self.count_train = None
+        self.partial_fit(df)
+
+    def partial_fit(self, df):
+        """
+        update the mean and std with a chunk of the data, e.g. of a dataset which does not fit in memory, or of a new
+        day without refitting the history
+
+        The moments of the chunks are merged as Welford (Chan et al.), so fitting by chunks gives the statistics of
+        `fit` on the whole data, up to the rounding.
+
+        NOTE: the whole chunk is used, the chunks are not limited to the fit window of `fit`
+        """
         cols = get_group_columns(df, self.fields_group)
-        self.mean_train = np.nanmean(df[cols].values, axis=0)
-        self.std_train = np.nanstd(df[cols].values, axis=0)
+        x = df[cols].values
+        mask = ~np.isnan(x)
+        count = mask.sum(axis=0).astype(np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(mask, x, 0).sum(axis=0, dtype=np.float64) / count
+            m2 = np.where(mask, (x - mean) ** 2, 0).sum(axis=0, dtype=np.float64)
+            if self.count_train is not None:
+                total = self.count_train + count
+                delta = np.where(count > 0, mean - self.mean_train, 0)
+                mean = np.where(self.count_train > 0, self.mean_train + delta * count / total, mean)
+                m2 = np.where(self.count_train > 0, self.m2_train + m2 + delta ** 2 * self.count_train * count / total,
+                              m2)
+                count = total
+            self.std_train = np.sqrt(m2 / count)
+        self.count_train, self.mean_train, self.m2_train = count, mean, m2
         self.ignore = self.std_train == 0
         self.cols = cols
 
     def __call__(self, df):
-        def normalize(x, mean_train=self.mean_train, std_train=self.std_train, ignore=self.ignore):
-            if (~ignore).all():
-                return (x - mean_train) / std_train
-            for i in range(ignore.size):
-                if not ignore[i]:
-                    x[i] = (x[i] - mean_train) / std_train
-            return x
-
-        df.loc(axis=1)[self.cols] = normalize(df[self.cols].values)
-        return df
+        # broadcast over the block, the ignored columns have a shift of 0 and a scale of 1
+        x = get_feature_block(df, self.cols)
+        self.to_transform()(x)
+        return set_feature_block(df, self.cols, x)
+
+    def to_transform(self):
+        # the ignored columns are kept as they are
+        shift = np.where(self.ignore, 0, self.mean_train)
+        scale = np.where(self.ignore, 1, self.std_train)
+        return ArrayTransform(get_column_names(self.cols), [("affine", {"shift": shift, "scale": scale})])
 
 
 class RobustZScoreNorm(Processor):
@@ -261,36 +385,115 @@ class RobustZScoreNorm(Processor):
 
     Reference:
         https://en.wikipedia.org/wiki/Median_absolute_deviation.
+
+    With `incremental`, `fit` also summarizes the fitted data by the sketches of `partial_fit`, so new data (e.g. a
+    new day) can be added to a fitted processor.
     """
 
-    def __init__(self, fit_start_time, fit_end_time, fields_group=None, clip_outlier=True):
+    def __init__(self, fit_start_time, fit_end_time, fields_group=None, clip_outlier=True, incremental=False):
         self.fit_start_time = fit_start_time
         self.fit_end_time = fit_end_time
         self.fields_group = fields_group
         self.clip_outlier = clip_outlier
+        self.incremental = incremental
         self.cols = None
         self.mean_train = None
         self.std_train = None
+        # a quantile sketch of every column, see `partial_fit`
+        self.digests = None
         super().__init__()
 
     def fit(self, df):
         df = fetch_df_by_index(df, slice(self.fit_start_time, self.fit_end_time), level="datetime")
         self.cols = get_group_columns(df, self.fields_group)
+        self.mean_train = np.empty(len(self.cols))
+        self.std_train = np.empty(len(self.cols))
+        # the statistics are exact, the sketches only keep the fitted data for `partial_fit`
+        self.digests = [TDigest() for _ in range(len(self.cols))] if self.incremental else None
+        # a float64 copy of a few columns at a time, e.g. of float32 features, whose deviations are computed in place
+        for start in range(0, len(self.cols), 64):
+            x = df[self.cols[start:start + 64]].to_numpy(dtype=np.float64, copy=True)
+            if self.incremental:
+                for i, digest in enumerate(self.digests[start:start + 64]):
+                    digest.update(x[:, i])
+            mean = self.mean_train[start:start + 64] = np.nanmedian(x, axis=0)
+            x -= mean
+            np.abs(x, out=x)
+            self.std_train[start:start + 64] = np.nanmedian(x, axis=0, overwrite_input=True)
+        self.std_train += EPS
+        self.std_train *= 1.4826
+
+    def partial_fit(self, df, compression: float = 1000):
+        """
+        update the median and MAD with a chunk of the data, e.g. of a dataset which does not fit in memory, or of a
+        new day without refitting the history
+
+        The values of every column are summarized by a mergeable quantile sketch (`TDigest`), so the memory does not
+        grow with the data. The statistics are the ones of `fit` while a column has at most `compression / 2`
+        distinct values (e.g. rounded values), and estimates otherwise (within about 1%). The chunks are added to the
+        data of `fit`, which needs `incremental`.
+
+        NOTE: the whole chunk is used, the chunks are not limited to the fit window of `fit`
+        """
+        if self.digests is None and self.mean_train is not None:
+            raise ValueError("RobustZScoreNorm was fitted without incremental=True, its fitted data is not kept for "
+                             "partial_fit")
+        self.cols = get_group_columns(df, self.fields_group)
         x = df[self.cols].values
-        self.mean_train = np.nanmedian(x, axis=0)
-        self.std_train = np.nanmedian(np.abs(x - self.mean_train), axis=0)
+        if self.digests is None:
+            self.digests = [TDigest(compression) for _ in range(x.shape[1])]
+        for i, digest in enumerate(self.digests):
+            digest.update(x[:, i])
+        self.mean_train = np.array([digest.quantile(0.5) for digest in self.digests])
+        self.std_train = np.array([digest.mad(center) for digest, center in zip(self.digests, self.mean_train)])
         self.std_train += EPS
         self.std_train *= 1.4826
 
     def __call__(self, df):
-        x = df[self.cols]
-        x -= self.mean_train
-        x /= self.std_train
-        df[self.cols] = x
+        x = get_feature_block(df, self.cols)
+        self.to_transform()(x)
+        set_feature_block(df, self.cols, x)
         if self.clip_outlier:
-            df.clip(-3, 3, inplace=True)
+            # as `df.clip`, the other columns are clipped as well
+            others = df.columns.difference(self.cols, sort=False)
+            if len(others):
+                df[others] = df[others].clip(-3, 3)
         return df
 
+    def to_transform(self):
+        steps = [("affine", {"shift": self.mean_train, "scale": self.std_train})]
+        if self.clip_outlier:
+            steps.append(("clip", {"low": -3, "high": 3}))
+        return ArrayTransform(get_column_names(self.cols), steps)
+
+
+def _cs_apply(df: pd.DataFrame, cols, func) -> pd.DataFrame:
+    """
+    apply `func(x, bounds, lengths)` in place to the values of `cols`, as one block whose rows are sorted by datetime
+    (see `get_datetime_segments`), and write the block back to `df`
+
+    The reductions of every datetime are `np.add.reduceat` over the block, so there is no call per datetime.
+    """
+    if len(df) == 0:
+        return df
+    order, bounds, lengths = get_datetime_segments(df)
+    x = get_feature_block(df, cols)
+    if order is not None:
+        x = x[order]
+    func(x, bounds, lengths)
+    if order is not None:
+        x[order] = x.copy()
+    return set_feature_block(df, cols, x)
+
+
+def _cs_mean(x: np.ndarray, bounds: np.ndarray):
+    """the mean of the not nan values of every datetime and column in float64, their number, and the mask of the not
+    nan values"""
+    mask = ~np.isnan(x)
+    count = np.add.reduceat(mask, bounds, axis=0, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.add.reduceat(np.where(mask, x, 0), bounds, axis=0, dtype=np.float64) / count, count, mask
+
 
 class CSZScoreNorm(Processor):
     """Cross Sectional ZScore Normalization"""
@@ -300,11 +503,15 @@ class CSZScoreNorm(Processor):
         super().__init__()
 
     def __call__(self, df):
-        # try not modify original dataframe
-        cols = get_group_columns(df, self.fields_group)
+        def zscore(x, bounds, lengths):
+            mean, count, mask = _cs_mean(x, bounds)
+            x -= np.repeat(mean.astype(x.dtype), lengths, axis=0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # the sample std (ddof=1) as pandas
+                std = np.sqrt(np.add.reduceat(np.where(mask, x * x, 0), bounds, axis=0, dtype=np.float64) / (count - 1))
+                x /= np.repeat(std.astype(x.dtype), lengths, axis=0)
 
-        df[cols] = df[cols].groupby("datetime", sort=False).apply(lambda x: (x - x.mean()).div(x.std())).values
-        return df
+        return _cs_apply(df, get_group_columns(df, self.fields_group), zscore)
 
 
 class CSRankNorm(Processor):
@@ -315,13 +522,14 @@ class CSRankNorm(Processor):
         super().__init__()
 
     def __call__(self, df):
-        # try not modify original dataframe
-        cols = get_group_columns(df, self.fields_group)
-        t = df[cols].groupby("datetime").rank(pct=True)
-        t -= 0.5
-        t *= 3.46  # NOTE: towards unit std
-        df[cols] = t
-        return df
+        def rank(x, bounds, lengths):
+            groups = np.repeat(np.arange(len(bounds)), lengths)
+            for i in range(x.shape[1]):
+                x[:, i] = cs_rank(x[:, i], groups)
+            x -= 0.5
+            x *= 3.46  # NOTE: towards unit std
+
+        return _cs_apply(df, get_group_columns(df, self.fields_group), rank)
 
 
 class CSZFillna(Processor):
@@ -332,9 +540,13 @@ class CSZFillna(Processor):
         super().__init__()
 
     def __call__(self, df):
-        cols = get_group_columns(df, self.fields_group)
-        df[cols] = df[cols].groupby("datetime").apply(lambda x: x.fillna(x.mean()))
-        return df
+        def fillna(x, bounds, lengths):
+            mean, _, mask = _cs_mean(x, bounds)
+            # only the nan values are looked up
+            rows, columns = np.nonzero(~mask)
+            x[rows, columns] = mean[np.repeat(np.arange(len(bounds)), lengths)[rows], columns]
+
+        return _cs_apply(df, get_group_columns(df, self.fields_group), fillna)
 
 
 __all__ = [
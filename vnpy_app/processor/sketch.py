@@ -0,0 +1,134 @@
+import numpy as np
+
+
+class TDigest:
+    """
+    Mergeable quantile sketch of a stream of values, the merging t-digest of Dunning
+
+    The values are summarized by at most about `compression / 2` centroids (mean, weight), smaller towards the tails
+    (the k1 scale of the paper), so the memory does not grow with the stream, and the quantiles are interpolated
+    between the centroids. Digests of chunks of data can be merged, e.g. one per day.
+
+    While there are at most `compression / 2` distinct values, every centroid is one of them with its number of
+    occurrences, so the quantiles and the MAD are exact, ties included (e.g. of rounded values), which an
+    interpolation between the centroids would smooth out.
+
+    NOTE: nan and infinite values are skipped
+
+    Example:
+        digest = TDigest()
+        for chunk in chunks:
+            digest.update(chunk)
+        median, mad = digest.quantile(0.5), digest.mad()
+    """
+
+    def __init__(self, compression: float = 1000):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+        # every centroid is one distinct value, see `_merge`
+        self.exact = True
+
+    @property
+    def count(self) -> float:
+        return self.weights.sum()
+
+    def update(self, values: np.array):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        if len(values):
+            self.min = min(self.min, values.min())
+            self.max = max(self.max, values.max())
+            self._merge(values, np.ones(len(values)))
+        return self
+
+    def merge(self, other: "TDigest"):
+        if len(other.means):
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self.exact = self.exact and other.exact
+            self._merge(other.means, other.weights)
+        return self
+
+    def _merge(self, means: np.array, weights: np.array):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        if self.exact:
+            # the equal values are one centroid, as long as the distinct values fit in the centroids
+            first = np.r_[True, means[1:] != means[:-1]]
+            if first.sum() <= self.compression / 2:
+                self.means = means[first]
+                self.weights = np.add.reduceat(weights, np.flatnonzero(first))
+                return
+            self.exact = False
+        # every centroid spans at most one unit of the scale k of the quantile of its center
+        q = (np.cumsum(weights) - weights / 2) / weights.sum()
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        groups = np.floor(k - k[0]).astype(np.int64)
+        self.weights = np.bincount(groups, weights)
+        self.means = np.bincount(groups, weights * means)
+        mask = self.weights > 0
+        self.weights = self.weights[mask]
+        self.means = self.means[mask] / self.weights
+
+    def _points(self):
+        """the values and cumulative weights the quantiles are interpolated between"""
+        centers = np.cumsum(self.weights) - self.weights / 2
+        return np.r_[self.min, self.means, self.max], np.r_[0, centers, self.count]
+
+    @staticmethod
+    def _order_statistics(values: np.array, weights: np.array, q):
+        """
+        the `q` quantile(s) of sorted `values` which occur `weights` times, interpolated between the order statistics
+        as `np.quantile`
+        """
+        position = np.asarray(q) * (weights.sum() - 1)
+        counts = np.cumsum(weights)
+        lower = values[np.searchsorted(counts, np.floor(position), side="right")]
+        upper = values[np.searchsorted(counts, np.ceil(position), side="right")]
+        return lower + (upper - lower) * (position - np.floor(position))
+
+    def quantile(self, q):
+        """the `q` quantile(s) of the values, nan if there is no value"""
+        if not len(self.means):
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        if self.exact:
+            return self._order_statistics(self.means, self.weights, q)
+        values, ranks = self._points()
+        return np.interp(np.asarray(q) * self.count, ranks, values)
+
+    def cdf(self, x):
+        """the fraction of the values lower than `x`"""
+        if not len(self.means):
+            return np.full(np.shape(x), np.nan) if np.ndim(x) else np.nan
+        if self.exact:
+            return np.r_[0, np.cumsum(self.weights)][np.searchsorted(self.means, x)] / self.count
+        values, ranks = self._points()
+        return np.interp(x, values, ranks) / self.count
+
+    def mad(self, center: float = None, n_iter: int = 60) -> float:
+        """
+        the median absolute deviation from `center`, the median by default, i.e. the distance d where
+        `cdf(center + d) - cdf(center - d)` reaches 0.5, by bisection, or the median of the deviations of the distinct
+        values if they are exact
+        """
+        if not len(self.means):
+            return np.nan
+        if center is None:
+            center = self.quantile(0.5)
+        if self.exact:
+            deviations = np.abs(self.means - center)
+            order = np.argsort(deviations, kind="stable")
+            return self._order_statistics(deviations[order], self.weights[order], 0.5)
+        low, high = 0., max(self.max - center, center - self.min)
+        for _ in range(n_iter):
+            d = (low + high) / 2
+            if self.cdf(center + d) - self.cdf(center - d) < 0.5:
+                low = d
+            else:
+                high = d
+        return high
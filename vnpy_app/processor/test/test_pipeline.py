@@ -0,0 +1,90 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from vnpy_app.processor import (DK_I, PTYPE_A, PTYPE_I, CSZScoreNorm, DropnaLabel, Fillna, ProcessInf,
+                                ProcessorPipeline, RobustZScoreNorm, ZScoreNorm, split_segments)
+from vnpy_app.processor.test.test_processor import make_panel
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.df = make_panel()
+        self.fit_start_time, self.fit_end_time = "2022-07-01", "2022-07-20"
+
+    def make_pipeline(self, process_type=PTYPE_A):
+        return ProcessorPipeline(
+            infer_processors=[RobustZScoreNorm(self.fit_start_time, self.fit_end_time, fields_group="feature"),
+                              Fillna(fields_group="feature")],
+            learn_processors=[DropnaLabel()],
+            process_type=process_type,
+        )
+
+    def test_chain(self):
+        # the processors applied one by one, as the data handler of qlib
+        norm = RobustZScoreNorm(self.fit_start_time, self.fit_end_time, fields_group="feature")
+        fillna = Fillna(fields_group="feature")
+        df = self.df.copy()
+        norm.fit(df)
+        df_infer = fillna(norm(df))
+        df_learn = DropnaLabel()(df_infer.copy())
+
+        pipeline = self.make_pipeline()
+        pd.testing.assert_frame_equal(pipeline.fit_process(self.df), df_learn)
+        pd.testing.assert_frame_equal(pipeline.process(self.df), df_infer)
+        pd.testing.assert_frame_equal(self.make_pipeline().fit_process(self.df, data_key=DK_I), df_infer)
+        # the learn processors read the raw data
+        pipeline = self.make_pipeline(PTYPE_I)
+        pd.testing.assert_frame_equal(pipeline.fit_process(self.df), DropnaLabel()(self.df))
+        pd.testing.assert_frame_equal(pipeline.process(self.df), df_infer)
+
+    def test_not_inplace(self):
+        expected = self.df.copy()
+        for process_type in [PTYPE_A, PTYPE_I]:
+            pipeline = self.make_pipeline(process_type)
+            for data_key in ["learn", DK_I]:
+                pipeline.fit_process(self.df, data_key=data_key)
+                pd.testing.assert_frame_equal(self.df, expected)
+            pipeline.process(self.df)
+            pd.testing.assert_frame_equal(self.df, expected)
+        # the input is handed over to the processors
+        df = self.df.copy()
+        self.make_pipeline().fit_process(df, inplace=True)
+        self.assertFalse(df.equals(expected))
+
+    def test_split_segments(self):
+        df = self.df
+        segments = {"train": ("2022-07-01", "2022-07-20"), "valid": ("2022-07-21", "2022-07-25"),
+                    "test": ("2022-07-26", "2022-07-30")}
+        values = df.to_numpy()
+        for name, segment in split_segments(df, segments).items():
+            beg, end = segments[name]
+            datetimes = segment.index.get_level_values("datetime")
+            self.assertEqual((datetimes.min(), datetimes.max()), (pd.Timestamp(beg), pd.Timestamp(end)))
+            self.assertEqual(len(segment), 20 * len(datetimes.unique()))
+            # a view of `df`, not a copy
+            self.assertTrue(np.shares_memory(segment.to_numpy(), values), name)
+        # the instrument level is not sorted: "I10" < "I2"
+        self.assertFalse(df.index.is_monotonic_increasing)
+
+    def test_to_transform(self):
+        df = self.df.copy()
+        df.iloc[[3, 50], 0] = np.inf
+        pipeline = ProcessorPipeline(infer_processors=[
+            ProcessInf(), ZScoreNorm(self.fit_start_time, self.fit_end_time, fields_group="feature"),
+            RobustZScoreNorm(self.fit_start_time, self.fit_end_time, fields_group="feature"),
+            Fillna(fields_group="feature"),
+        ])
+        pipeline.fit_process(df, data_key=DK_I)
+        transform = pipeline.to_transform()
+        self.assertListEqual(transform.columns, df["feature"].columns.tolist())
+        x = df["feature"].to_numpy(dtype=np.float64, copy=True)
+        np.testing.assert_allclose(transform(x), pipeline.process(df)["feature"].values, rtol=1e-12, atol=1e-12)
+        # a cross-sectional processor does not transform every row on its own
+        with self.assertRaises(NotImplementedError):
+            ProcessorPipeline(infer_processors=[CSZScoreNorm(fields_group="feature")]).to_transform()
+
+
+if __name__ == '__main__':
+    unittest.main()
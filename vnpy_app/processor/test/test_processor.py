@@ -0,0 +1,230 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from vnpy_app.processor.processor import (CSRankNorm, CSZFillna, CSZScoreNorm, Fillna, MinMaxNorm, ProcessInf,
+                                          RobustZScoreNorm, ZScoreNorm, _cs_apply, _cs_mean, get_feature_block,
+                                          get_float_groups, set_feature_block)
+from vnpy_app.processor.utils import get_datetime_segments
+
+
+def make_panel(n_dates=30, n_instruments=20, n_features=5, seed=0):
+    """a panel of features and a label in the layout of `fetch_df_by_index`, sorted by datetime"""
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product(
+        [pd.date_range("2022-07-01", periods=n_dates), ["I{}".format(k) for k in range(n_instruments)]],
+        names=["datetime", "instrument"])
+    columns = pd.MultiIndex.from_tuples([("feature", "F{}".format(k)) for k in range(n_features)]
+                                        + [("label", "LABEL0")])
+    df = pd.DataFrame(rng.normal(size=(len(index), n_features + 1)), index=index, columns=columns)
+    df = df.mask(rng.random(df.shape) < 0.1)
+    # ties for the ranks, and a datetime without any value of a feature
+    df.iloc[:, 1] = df.iloc[:, 1].round(1)
+    df.loc[index[0][0], ("feature", "F2")] = np.nan
+    return df
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.df = make_panel()
+        # the same rows in other orders: shuffled, and by instrument as `pd.concat` of the instruments
+        self.panels = [self.df, self.df.sample(frac=1, random_state=0), self.df.sort_index(level="instrument")]
+
+    def test_datetime_segments(self):
+        order, bounds, lengths = get_datetime_segments(self.df)
+        self.assertIsNone(order)
+        np.testing.assert_array_equal(bounds, np.arange(30) * 20)
+        np.testing.assert_array_equal(lengths, np.full(30, 20))
+        for df in self.panels[1:] + [self.df.droplevel("instrument").sample(frac=1, random_state=1)]:
+            order, bounds, lengths = get_datetime_segments(df)
+            datetimes = df.index.get_level_values("datetime")[order]
+            # the rows of every datetime are contiguous, in the order of `df`
+            self.assertTrue(datetimes[bounds].is_unique)
+            self.assertTrue((datetimes == datetimes[np.repeat(bounds, lengths)]).all())
+            self.assertEqual(lengths.sum(), len(df))
+            for beg, length in zip(bounds, lengths):
+                self.assertTrue(np.all(np.diff(order[beg:beg + length]) > 0))
+
+    def test_cs_apply(self):
+        def demean(x, bounds, lengths):
+            x -= np.repeat(_cs_mean(x, bounds)[0], lengths, axis=0)
+
+        for df in self.panels:
+            expected = df["feature"].groupby("datetime").transform(lambda x: x - x.mean())
+            result = _cs_apply(df.copy(), df.columns[:5], demean)
+            np.testing.assert_allclose(result["feature"].values, expected.values, rtol=1e-12, atol=1e-12)
+            pd.testing.assert_frame_equal(result["label"], df["label"])
+
+    def test_cs_processors(self):
+        for proc, func in [
+            (CSZScoreNorm(fields_group="feature"), lambda x: (x - x.mean()) / x.std()),
+            (CSRankNorm(fields_group="feature"), lambda x: (x.rank(pct=True) - 0.5) * 3.46),
+            (CSZFillna(fields_group="feature"), lambda x: x.fillna(x.mean())),
+        ]:
+            for df in self.panels:
+                expected = df["feature"].groupby("datetime").transform(func)
+                result = proc(df.copy())
+                self.assertTrue(result.index.equals(df.index))
+                np.testing.assert_allclose(result["feature"].values, expected.values, rtol=1e-10, atol=1e-12,
+                                           err_msg=type(proc).__name__)
+                pd.testing.assert_frame_equal(result["label"], df["label"])
+
+    def test_cs_row_order(self):
+        # every row keeps its values whatever the order of the rows, e.g. by instrument
+        for proc in [CSZScoreNorm(fields_group="feature"), CSRankNorm(fields_group="feature"),
+                     CSZFillna(fields_group="feature")]:
+            expected = proc(self.df.copy())
+            for df in self.panels[1:]:
+                pd.testing.assert_frame_equal(proc(df.copy()).loc[self.df.index], expected, check_exact=False,
+                                              rtol=1e-12, atol=1e-12)
+
+    def test_partial_fit(self):
+        # chunks of the fit window, which `fit` cuts from the whole data
+        dates = self.df.index.levels[0]
+        window = self.df.loc[:"2022-07-20"]
+        chunks = [window.loc[beg:end] for beg, end in zip(dates[:20:7], dates[6:20:7].append(dates[19:20]))]
+        for cls, attrs in [(ZScoreNorm, ["mean_train", "std_train", "ignore"]),
+                           (MinMaxNorm, ["min_val", "max_val", "ignore"])]:
+            expected = cls("2022-07-01", "2022-07-20", fields_group="feature")
+            expected.fit(self.df)
+            proc = cls("2022-07-01", "2022-07-20", fields_group="feature")
+            # an empty chunk first, e.g. a day without data
+            proc.partial_fit(window.iloc[:0])
+            for chunk in chunks:
+                proc.partial_fit(chunk)
+            for attr in attrs:
+                np.testing.assert_allclose(getattr(proc, attr), getattr(expected, attr), rtol=1e-12,
+                                           err_msg="{}.{}".format(cls.__name__, attr))
+            # the new days after the fit window are added to the fitted statistics
+            whole = cls("2022-07-01", "2022-07-30", fields_group="feature")
+            whole.fit(self.df)
+            proc.partial_fit(self.df.loc["2022-07-21":])
+            for attr in attrs:
+                np.testing.assert_allclose(getattr(proc, attr), getattr(whole, attr), rtol=1e-12,
+                                           err_msg="{}.{}".format(cls.__name__, attr))
+            # `fit` starts over
+            proc.fit(self.df)
+            np.testing.assert_allclose(getattr(proc, attrs[0]), getattr(expected, attrs[0]), rtol=1e-12)
+        # the sketches of `RobustZScoreNorm` keep every distinct value of a small fit window, so the statistics are
+        # the exact ones, ties included (F1 is rounded)
+        expected = RobustZScoreNorm("2022-07-01", "2022-07-20", fields_group="feature", incremental=True)
+        expected.fit(self.df)
+        proc = RobustZScoreNorm("2022-07-01", "2022-07-20", fields_group="feature")
+        for chunk in chunks:
+            proc.partial_fit(chunk)
+        np.testing.assert_allclose(proc.mean_train, expected.mean_train, rtol=1e-12, atol=1e-15)
+        np.testing.assert_allclose(proc.std_train, expected.std_train, rtol=1e-12)
+        # a processor fitted with `incremental` keeps its data and adds the new days, which are too many distinct
+        # values for the sketches of the continuous columns, whose statistics are then estimated
+        whole = RobustZScoreNorm("2022-07-01", "2022-07-30", fields_group="feature")
+        whole.fit(self.df)
+        expected.partial_fit(self.df.loc["2022-07-21":])
+        np.testing.assert_allclose(expected.mean_train, whole.mean_train, atol=2e-2 * whole.std_train.min())
+        np.testing.assert_allclose(expected.std_train, whole.std_train, rtol=2e-2)
+        np.testing.assert_allclose(expected.std_train[1], whole.std_train[1], rtol=1e-12)
+        # the data of a plain `fit` is not kept
+        with self.assertRaises(ValueError):
+            whole.partial_fit(self.df.loc["2022-07-21":])
+
+    def test_ignored_columns(self):
+        # a constant column is kept as it is, and the other columns are still normalized
+        df = self.df.copy()
+        df[("feature", "F3")] = 1.
+        x = df["feature"]
+        for proc, expected in [
+            (ZScoreNorm("2022-07-01", "2022-07-30", fields_group="feature"), (x - x.mean()) / x.std(ddof=0)),
+            (MinMaxNorm("2022-07-01", "2022-07-30", fields_group="feature"), (x - x.min()) / (x.max() - x.min())),
+        ]:
+            proc.fit(df)
+            np.testing.assert_array_equal(proc.ignore, [False, False, False, True, False])
+            expected["F3"] = 1.
+            result = proc(df.copy())
+            np.testing.assert_allclose(result["feature"].values, expected.values, rtol=1e-10,
+                                       err_msg=type(proc).__name__)
+            pd.testing.assert_frame_equal(result["label"], df["label"])
+
+    def make_mixed(self):
+        """float32 features, with infinite values, and a float64 label"""
+        df = self.df.copy()
+        df.iloc[[3, 40], 0] = np.inf
+        df.iloc[7, 4] = -np.inf
+        return df.astype({column: np.float32 for column in df.columns[:5]})
+
+    def test_feature_block(self):
+        df = self.make_mixed()
+        df[("feature", "INT")] = np.arange(len(df))
+        groups = get_float_groups(df, df.columns)
+        self.assertListEqual([group.tolist() for group in groups], [df.columns[:5].tolist(), [("label", "LABEL0")]])
+        x = get_feature_block(df, groups[0])
+        self.assertEqual(x.dtype, np.float32)
+        self.assertFalse(np.shares_memory(x, df[groups[0]].to_numpy()))
+        # a block of mixed columns is processed in float64
+        self.assertEqual(get_feature_block(df, df.columns[5:]).dtype, np.float64)
+        self.assertEqual(get_feature_block(df, df.columns[:0]).shape, (len(df), 0))
+        x[:, 1] = 5
+        set_feature_block(df, groups[0], x, changed=np.arange(5) == 1)
+        self.assertTrue((df[("feature", "F1")] == 5).all())
+        self.assertEqual(df[("feature", "F1")].dtype, np.float32)
+        # a block of another dtype replaces the columns
+        set_feature_block(df, df.columns[6:], np.zeros((len(df), 1)))
+        self.assertEqual(df[("feature", "INT")].dtype, np.float64)
+
+    def test_mixed_dtypes(self):
+        df = self.make_mixed()
+        # the same values in float64
+        df64 = df.astype(np.float64)
+        for proc in [ProcessInf(), Fillna(), Fillna(fields_group="feature", fill_value=-1),
+                     ZScoreNorm("2022-07-01", "2022-07-20", fields_group="feature"),
+                     MinMaxNorm("2022-07-01", "2022-07-20", fields_group="feature"),
+                     RobustZScoreNorm("2022-07-01", "2022-07-20", fields_group="feature"),
+                     CSZScoreNorm(fields_group="feature"), CSRankNorm(fields_group="feature"),
+                     CSZFillna(fields_group="feature")]:
+            name = type(proc).__name__
+            # the normalizations are applied after `ProcessInf`
+            source = df if isinstance(proc, (ProcessInf, Fillna)) else ProcessInf()(df.copy())
+            proc.fit(source)
+            result = proc(source.copy())
+            pd.testing.assert_series_equal(result.dtypes, df.dtypes, obj=name)
+            expected = proc(source.astype(np.float64))
+            # computed from the float32 values, up to the rounding of float32
+            np.testing.assert_allclose(result.values.astype(np.float64), expected.values, rtol=1e-5, atol=1e-5,
+                                       err_msg=name)
+        # the statistics are computed in float64
+        proc = RobustZScoreNorm("2022-07-01", "2022-07-20", fields_group="feature")
+        proc.fit(ProcessInf()(df64.copy()))
+        expected = proc.mean_train, proc.std_train
+        proc.fit(ProcessInf()(df.copy()))
+        np.testing.assert_array_equal(proc.mean_train, expected[0])
+        np.testing.assert_array_equal(proc.std_train, expected[1])
+
+    def test_fillna_others(self):
+        df = self.make_mixed()
+        df[("feature", "NAME")] = pd.Series(["a", None] * (len(df) // 2), index=df.index, dtype=object)
+        df[("feature", "COUNT")] = pd.array([1, None] * (len(df) // 2), dtype="Int64")
+        result = Fillna(fields_group="feature")(df.copy())
+        self.assertListEqual(result[("feature", "NAME")].tolist(), ["a", 0] * (len(df) // 2))
+        self.assertListEqual(result[("feature", "COUNT")].tolist(), [1, 0] * (len(df) // 2))
+        self.assertFalse(result["feature"].isna().any().any())
+        self.assertEqual(result[("feature", "F0")].dtype, np.float32)
+        # the label is not in the group
+        pd.testing.assert_frame_equal(result["label"], df["label"])
+
+    def test_clip_outlier(self):
+        df = self.make_mixed()
+        df = ProcessInf()(df)
+        df["label"] *= 10
+        proc = RobustZScoreNorm("2022-07-01", "2022-07-20", fields_group="feature")
+        proc.fit(df)
+        result = proc(df.copy())
+        self.assertLessEqual(np.nanmax(np.abs(result.values)), 3)
+        # as `df.clip`, the other columns are clipped as well, and keep their dtype
+        pd.testing.assert_frame_equal(result["label"], df["label"].clip(-3, 3))
+        pd.testing.assert_series_equal(result.dtypes, df.dtypes)
+        proc = RobustZScoreNorm("2022-07-01", "2022-07-20", fields_group="feature", clip_outlier=False)
+        proc.fit(df)
+        pd.testing.assert_frame_equal(proc(df.copy())["label"], df["label"])
+
+
+if __name__ == '__main__':
+    unittest.main()
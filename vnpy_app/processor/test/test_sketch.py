@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+
+from vnpy_app.processor.sketch import TDigest
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        size = 200000
+        self.samples = {
+            "normal": rng.normal(3, 2, size=size),
+            "heavy-tailed": rng.standard_t(2, size=size),
+            "discrete": rng.integers(0, 5, size=size).astype(float),
+        }
+
+    def test_median_mad(self):
+        for name, values in self.samples.items():
+            digest = TDigest()
+            for chunk in np.array_split(values, 20):
+                digest.update(chunk)
+            self.assertEqual(digest.count, len(values))
+            median = np.median(values)
+            mad = np.median(np.abs(values - median))
+            self.assertAlmostEqual(digest.quantile(0.5), median, delta=1e-2 * mad, msg=name)
+            self.assertAlmostEqual(digest.mad(), mad, delta=1e-2 * mad, msg=name)
+            self.assertEqual((digest.quantile(0), digest.quantile(1)), (values.min(), values.max()))
+
+    def test_ties(self):
+        # a few distinct values are kept exactly, so the ties of rounded values are not smoothed out
+        values = np.round(np.random.default_rng(1).normal(size=100000), 1)
+        digest = TDigest()
+        for chunk in np.array_split(values, 20):
+            digest.update(chunk)
+        self.assertTrue(digest.exact)
+        median = np.median(values)
+        self.assertAlmostEqual(digest.quantile(0.5), median, delta=1e-12)
+        self.assertAlmostEqual(digest.mad(), np.median(np.abs(values - median)), delta=1e-12)
+        np.testing.assert_allclose(digest.quantile([0.1, 0.3, 0.9]), np.quantile(values, [0.1, 0.3, 0.9]),
+                                   rtol=1e-12)
+        self.assertAlmostEqual(digest.cdf(0.05), np.mean(values < 0.05), delta=1e-12)
+        # too many distinct values for the centroids
+        self.assertFalse(digest.merge(TDigest().update(self.samples["normal"])).exact)
+
+    def test_merge(self):
+        values = self.samples["normal"].copy()
+        values[::100] = np.nan
+        values[1] = np.inf
+        digests = [TDigest().update(chunk) for chunk in np.array_split(values, 7)]
+        digest = TDigest()
+        for other in digests:
+            digest.merge(other)
+        finite = values[np.isfinite(values)]
+        self.assertEqual(digest.count, len(finite))
+        np.testing.assert_allclose(digest.quantile([0.1, 0.5, 0.9]), np.quantile(finite, [0.1, 0.5, 0.9]), atol=1e-2)
+        # the memory does not grow with the data
+        self.assertLessEqual(len(digest.means), digest.compression)
+        # an empty digest is a no-op
+        self.assertEqual(digest.merge(TDigest()).count, len(finite))
+
+    def test_empty(self):
+        digest = TDigest().update([np.nan, np.inf])
+        self.assertEqual(digest.count, 0)
+        self.assertTrue(np.isnan(digest.quantile(0.5)))
+        self.assertTrue(np.isnan(digest.quantile([0.2, 0.8])).all())
+        self.assertTrue(np.isnan(digest.cdf(0)))
+        self.assertTrue(np.isnan(digest.mad()))
+
+
+if __name__ == '__main__':
+    unittest.main()
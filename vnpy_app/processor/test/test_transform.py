@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from vnpy_app.processor import ArrayTransform
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.transform = ArrayTransform(["F0", "F1", "F2"], [
+            ("inf", {}),
+            ("affine", {"shift": np.array([1., 2., 3.]), "scale": np.array([2., 4., 1.])}),
+            ("clip", {"low": -3, "high": 3}),
+            ("fillna", {"value": 0}),
+        ])
+        self.x = np.array([[1., 6., np.inf], [np.nan, -20., 4.]])
+
+    def test_call(self):
+        expected = np.array([[0., 1., 0.], [0., -3., 1.]])
+        np.testing.assert_array_equal(self.transform(self.x.copy()), expected)
+        # one row, and into `out`
+        np.testing.assert_array_equal(self.transform(self.x[1].copy()), expected[1])
+        out = np.empty_like(self.x)
+        x = self.x.copy()
+        self.assertIs(self.transform(x, out=out), out)
+        np.testing.assert_array_equal(out, expected)
+        np.testing.assert_array_equal(x, self.x)
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as path:
+            file = os.path.join(path, "transform.npz")
+            self.transform.save(file)
+            transform = ArrayTransform.load(file)
+        self.assertListEqual(transform.columns, self.transform.columns)
+        self.assertListEqual([kind for kind, _ in transform.steps], [kind for kind, _ in self.transform.steps])
+        np.testing.assert_array_equal(transform(self.x.copy()), self.transform(self.x.copy()))
+        with self.assertRaises(ValueError):
+            ArrayTransform(steps=[("affine", {"shift": 0})])
+
+    def test_get_indexer(self):
+        columns = ["F2", "OTHER", "F0", "F1"]
+        indexer = self.transform.get_indexer(columns)
+        np.testing.assert_array_equal(indexer, [2, 3, 0])
+        x = np.column_stack([self.x[:, 2], np.ones(2), self.x[:, 0], self.x[:, 1]])
+        np.testing.assert_array_equal(self.transform(x[:, indexer]), self.transform(self.x.copy()))
+        with self.assertRaises(KeyError):
+            self.transform.get_indexer(["F0", "F2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+from typing import List, Text
+
+import numpy as np
+import pandas as pd
+
+# the steps of an `ArrayTransform` and their parameters
+STEPS = {
+    "affine": ("shift", "scale"),
+    "clip": ("low", "high"),
+    "fillna": ("value",),
+    "inf": (),
+}
+
+
+class ArrayTransform:
+    """
+    The fitted infer processors as numpy operations on a feature array of shape (rows, columns) or (columns,), for
+    low latency inference: no DataFrame, no index alignment, and the array is transformed in place.
+
+    The transform is a sequence of steps, whose parameters are arrays of one value per column, or scalars:
+        affine: x = (x - shift) / scale
+        clip: x = clip(x, low, high)
+        fillna: nan -> value
+        inf: +-inf -> nan
+
+    Example:
+        pipeline.to_transform().save("transform.npz")
+        ...
+        transform = ArrayTransform.load("transform.npz")
+        indexer = transform.get_indexer(df_feature.columns)  # once
+        x = df_feature.to_numpy(dtype=np.float64)[:, indexer]
+        transform(x)
+    """
+
+    def __init__(self, columns: List[Text] = None, steps: list = ()):
+        self.columns = None if columns is None else list(columns)
+        # (kind, {name: value})
+        self.steps = list(steps)
+        for kind, params in self.steps:
+            if kind not in STEPS or set(params) != set(STEPS[kind]):
+                raise ValueError("Invalid step {} {}, the steps are {}".format(kind, list(params), STEPS))
+
+    def then(self, other: "ArrayTransform") -> "ArrayTransform":
+        """the transform applying `self` and then `other`"""
+        if self.columns is not None and other.columns is not None and self.columns != other.columns:
+            raise ValueError("The columns of the transforms do not match")
+        return ArrayTransform(self.columns if self.columns is not None else other.columns, self.steps + other.steps)
+
+    def get_indexer(self, columns) -> np.ndarray:
+        """the positions of the columns of the transform in `columns`, to reorder a feature array once"""
+        indexer = pd.Index(columns).get_indexer(self.columns)
+        if (indexer < 0).any():
+            raise KeyError("Missing columns {}".format([c for c, i in zip(self.columns, indexer) if i < 0]))
+        return indexer
+
+    def __call__(self, x: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """apply the transform to `x`, one row or a batch of rows of float features, in place (or into `out`)"""
+        if out is None:
+            out = x
+        elif out is not x:
+            np.copyto(out, x)
+        for kind, params in self.steps:
+            if kind == "affine":
+                np.subtract(out, params["shift"], out=out)
+                np.divide(out, params["scale"], out=out)
+            elif kind == "clip":
+                np.clip(out, params["low"], params["high"], out=out)
+            elif kind == "fillna":
+                np.copyto(out, params["value"], where=np.isnan(out))
+            else:
+                np.copyto(out, np.nan, where=np.isinf(out))
+        return out
+
+    def save(self, path: Text):
+        """save the transform to the `.npz` file `path`"""
+        arrays = {"kinds": np.array([kind for kind, _ in self.steps], dtype=str)}
+        if self.columns is not None:
+            arrays["columns"] = np.array(self.columns, dtype=str)
+        for i, (_, params) in enumerate(self.steps):
+            for name, value in params.items():
+                arrays["{}_{}".format(i, name)] = np.asarray(value, dtype=np.float64)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: Text) -> "ArrayTransform":
+        with np.load(path) as f:
+            columns = f["columns"].tolist() if "columns" in f else None
+            steps = [(kind, {name: f["{}_{}".format(i, name)] for name in STEPS[kind]})
+                     for i, kind in enumerate(f["kinds"].tolist())]
+        return cls(columns, steps)
+
+
+__all__ = [
+    "ArrayTransform",
+]
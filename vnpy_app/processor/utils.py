@@ -1,5 +1,6 @@
 from typing import Union
 
+import numpy as np
 import pandas as pd
 
 
@@ -32,6 +33,39 @@ def get_level_index(df: pd.DataFrame, level: Union[str, int]) -> int:
         raise NotImplementedError(f"This type of input is not supported")
 
 
+def get_datetime_segments(df: pd.DataFrame, level: Union[str, int] = "datetime"):
+    """
+
+    get the rows of every datetime of `df` as contiguous segments, for the cross-sectional processors
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        data
+    level : Union[str, int]
+        the datetime level of the index
+
+    Returns
+    -------
+    order : np.ndarray
+        the rows sorted by datetime, None if the rows of every datetime are already contiguous
+    bounds : np.ndarray
+        the first sorted row of every datetime
+    lengths : np.ndarray
+        the number of rows of every datetime
+    """
+    if isinstance(df.index, pd.MultiIndex):
+        codes = np.asarray(df.index.codes[get_level_index(df, level)])
+    else:
+        codes = pd.factorize(df.index, use_na_sentinel=False)[0]
+    order = None
+    if len(codes) > 1 and (np.diff(codes) < 0).any():
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+    bounds = np.flatnonzero(np.diff(codes, prepend=codes[:1] - 1))
+    return order, bounds, np.diff(bounds, append=len(codes))
+
+
 def fetch_df_by_index(
         df: pd.DataFrame,
         selector: Union[pd.Timestamp, slice, str, list],
@@ -55,3 +55,13 @@ INTERVAL_DELTA_MAP: Dict[Interval, timedelta] = {
     Interval.HOUR: timedelta(hours=1),
     Interval.DAILY: timedelta(days=1),
 }
+
+# bars of a trading day, e.g. 4 hours in the A-share market, to convert a number of bars into days of history
+INTERVAL_BARS_MAP: Dict[Interval, float] = {
+    # a snapshot every 3 seconds
+    Interval.TICK: 4800,
+    Interval.MINUTE: 240,
+    Interval.HOUR: 4,
+    Interval.DAILY: 1,
+    Interval.WEEKLY: 0.2,
+}
@@ -1,12 +1,13 @@
 from abc import ABC
 from copy import copy
+from math import ceil, isinf
 from typing import Any, Callable, List
 
 from vnpy.trader.constant import Interval, Direction, Offset
 from vnpy.trader.object import BarData, TickData, OrderData, TradeData
 from vnpy.trader.utility import virtual
 
-from .base import StopOrder, EngineType
+from .base import StopOrder, EngineType, INTERVAL_BARS_MAP
 
 
 class CtaTemplate(ABC):
@@ -314,6 +315,35 @@ class CtaTemplate(ABC):
         for bar in bars:
             callback(bar)
 
+    def load_bar_size(
+        self,
+        size: int,
+        interval: Interval = Interval.MINUTE,
+        callback: Callable = None,
+        use_database: bool = False,
+        bars_per_day: float = None
+    ) -> None:
+        """
+        Load enough historical bar data for `size` bars, e.g. the lookback of the strategy's expressions.
+
+        `bars_per_day` is the number of bars of a trading day, see INTERVAL_BARS_MAP. With Interval.TICK,
+        the ticks are loaded by `load_tick` instead.
+        """
+        if isinf(size):
+            raise ValueError("Cannot load an unbounded history of bars")
+        if bars_per_day is None:
+            if interval not in INTERVAL_BARS_MAP:
+                raise ValueError(f"Unknown number of bars per day of the interval {interval}, "
+                                 "pass bars_per_day or use load_bar")
+            bars_per_day = INTERVAL_BARS_MAP[interval]
+        trading_days: int = ceil(size / bars_per_day)
+        # weekends, and one more day for a holiday
+        days: int = trading_days + 2 * ceil(trading_days / 5) + 1
+        if interval == Interval.TICK:
+            self.load_tick(days)
+        else:
+            self.load_bar(days, interval, callback, use_database)
+
     def load_tick(self, days: int) -> None:
         """
         Load historical tick data for initializing strategy.
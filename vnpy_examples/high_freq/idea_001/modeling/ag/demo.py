@@ -23,7 +23,8 @@ def get_dataset():
             df = load_ticks(symbol + '88', exchange, beg, end)
             df.drop(columns=['exchange'], inplace=True)
             df.to_parquet('tick_data.parquet')
-    df_factors = get_factors(df)
+    # float32 is plenty for LightGBM and halves the dataset, the label is kept in float64
+    df_factors = get_factors(df, dtype=np.float32)
     df_factors['label'] = df_factors['label'].mask(df_factors['label'].abs() >= 0.005, np.nan)
     df_factors['datetime'] = pd.to_datetime(df_factors['datetime'])
     df_factors.set_index(['datetime', 'instrument'], inplace=True)
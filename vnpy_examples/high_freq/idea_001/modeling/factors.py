@@ -1,5 +1,7 @@
 import pandas as pd
 
+from vnpy_app.expression.rolling import rolling_stats
+
 
 class FactorCollection:
     def __init__(self, df):
@@ -30,6 +32,27 @@ class FactorCollection:
         lower = df[[f'ask_volume_{i + 1}' for i in range(5)]].apply(lambda x: getattr(x, function)())
         return upper / lower
 
+    def rolling_stats(self, series) -> dict:
+        """every (window, function) rolling statistic of `series`, computed in one pass"""
+        stats = [(win, function) for win in self.rolling_windows for function in self.functions]
+        values = rolling_stats(series.values, stats)
+        return {stat: pd.Series(value, index=series.index) for stat, value in values.items()}
+
+    def calc_wap1_stats(self, i):
+        return self.rolling_stats(self._calc_wap1(i))
+
+    def calc_wap2_stats(self, i):
+        return self.rolling_stats(self._calc_wap2(i))
+
+    def volume_ratio_stats(self, i):
+        return self.rolling_stats(self._volume_ratio(i))
+
+    def p_rolling_stats(self):
+        return self.rolling_stats(self.df['last_price'])
+
+    def rtn_rolling_stats(self):
+        return self.rolling_stats(self.df['last_price'].pct_change())
+
     def calc_wap1(self, i, win, function):
         return getattr(self._calc_wap1(i).rolling(win), function)()
 
@@ -33,30 +33,37 @@ def mse(y_true, y_pred):
     return 'mse', np.mean((y_true - y_pred.label) ** 2), False
 
 
-def get_factors(df):
+def get_factors(df, dtype=None):
+    # the features are cast to `dtype`, e.g. np.float32, as soon as they are computed
+    def store(values):
+        return values if dtype is None else values.astype(dtype)
+
     fc = FactorCollection(df)
     windows = fc.rolling_windows
     functions = fc.functions
     levels = [i for i in range(1, 6)]
     c = dict()
     logger.info('calculating collection001')
+    # all windows and functions of a base series are computed in one pass
     for l in levels:
+        with TimeInspector.logt(f'calculating {l}'):
+            wap1, wap2, vr = fc.calc_wap1_stats(l), fc.calc_wap2_stats(l), fc.volume_ratio_stats(l)
         for w in windows:
             for f in functions:
-                with TimeInspector.logt(f'calculating {f} {w} {l}'):
-                    c[f'wap1_l{l}_w{w}_f{f}'] = fc.calc_wap1(l, w, f)
-                    c[f'wap2_l{l}_w{w}_f{f}'] = fc.calc_wap2(l, w, f)
-                    c[f'vr_l{l}_w{w}_f{f}'] = fc.volume_ratio(l, w, f)
+                c[f'wap1_l{l}_w{w}_f{f}'] = store(wap1[(w, f)])
+                c[f'wap2_l{l}_w{w}_f{f}'] = store(wap2[(w, f)])
+                c[f'vr_l{l}_w{w}_f{f}'] = store(vr[(w, f)])
     logger.info('calculating collection002')
+    with TimeInspector.logt('calculating price and return'):
+        p_roll, r_roll = fc.p_rolling_stats(), fc.rtn_rolling_stats()
     for w in windows:
         for f in functions:
-            with TimeInspector.logt(f'calculating {f} {w}'):
-                c[f'p_roll_w{w}_f{f}'] = fc.p_rolling_stat(w, f)
-                c[f'r_roll_w{w}_f{f}'] = fc.rtn_rolling_stat(w, f)
+            c[f'p_roll_w{w}_f{f}'] = store(p_roll[(w, f)])
+            c[f'r_roll_w{w}_f{f}'] = store(r_roll[(w, f)])
     logger.info('calculating collection003')
     for w in windows:
         with TimeInspector.logt(f'calculating {w}'):
-            c[f'rv_roll_w{w}'] = fc.rv_rolling_corr(w)
+            c[f'rv_roll_w{w}'] = store(fc.rv_rolling_corr(w))
     c['label'] = fc.label()
     c['datetime'] = df['datetime']
     c['instrument'] = df['symbol']
@@ -75,26 +82,18 @@ def get_segments():
     df = df.loc[segments['train'][0]:segments['test'][1]]
     df.sort_index(inplace=True)
     df.columns = pd.MultiIndex.from_tuples([('feature', i) if i != 'label' else ('label', i) for i in df.columns])
-    logger.info('normalizing')
-    p1 = RobustZScoreNorm(segments['train'][0], segments['train'][1], fields_group='feature')
-    p1.fit(df)
-    mean_train = p1.mean_train
-    std_train = p1.std_train
-    feature_names = df['feature'].columns
-    pd.Series(mean_train, index=feature_names).to_pickle('mean_train.pkl')
-    pd.Series(std_train, index=feature_names).to_pickle('std_train.pkl')
-    df = p1(df)
-    logger.info('filling na')
-    p2 = Fillna(fields_group='feature')
-    df = p2(df)
-    logger.info('dropping na label')
-    p3 = DropnaLabel()
-    df = p3(df)
-    c = dict()
-    for k, v in segments.items():
-        beg, end = v
-        c[k] = df.loc[beg:end].copy()
-    return c
+    logger.info('processing')
+    pipeline = ProcessorPipeline(
+        infer_processors=[RobustZScoreNorm(segments['train'][0], segments['train'][1], fields_group='feature'),
+                          Fillna(fields_group='feature')],
+        learn_processors=[DropnaLabel()],
+    )
+    # `df` is not used afterwards, so it is normalized in place rather than copied
+    df = pipeline.fit_process(df, inplace=True)
+    # the fitted normalization for live inference, see `Strategy001`
+    pipeline.to_transform().save('transform.npz')
+    # the segments are views of `df`
+    return split_segments(df, segments)
 
 
 def train_regress_model():
@@ -39,8 +39,7 @@ class Backtest:
         params = get_backtest_params(symbol)
         setting = {
             'model_path': '../modeling/ag/model.txt',
-            'mean_train_path': '../modeling/ag/mean_train.pkl',
-            'std_train_path': '../modeling/ag/std_train.pkl',
+            'transform_path': '../modeling/ag/transform.npz',
         }
         all_params = {**self.strategy_params, **params, 'setting': setting, 'symbol': symbol}
         template(**all_params)
@@ -50,8 +49,7 @@ class Backtest:
         params = get_backtest_params(symbol)
         setting = {
             'model_path': '../modeling/ag/model.txt',
-            'mean_train_path': '../modeling/ag/mean_train.pkl',
-            'std_train_path': '../modeling/ag/std_train.pkl',
+            'transform_path': '../modeling/ag/transform.npz',
         }
         all_params = {**self.strategy_params, **params, 'setting': setting, 'symbol': symbol}
         template(**all_params)
@@ -1,8 +1,9 @@
 import lightgbm as lgb
-import pandas as pd
+import numpy as np
 
 from vnpy.trader.object import TickData, BarData, TradeData, OrderData
 from vnpy.trader.utility import BarGenerator
+from vnpy_app.processor import ArrayTransform
 from vnpy_app.utility.converter import convert_ticks
 from vnpy_app.utility.log import get_module_logger
 from vnpy_app.vnpy_ctastrategy import CtaTemplate
@@ -24,8 +25,9 @@ class Strategy001(CtaTemplate):
         self.tick_cnt = 0
         self.logger = get_module_logger('user.' + __name__)
         self.model = lgb.Booster(model_file=setting['model_path'])
-        self.train_mean = pd.read_pickle(setting['mean_train_path'])
-        self.train_std = pd.read_pickle(setting['std_train_path'])
+        # the fitted processors of the training, as numpy operations
+        self.transform = ArrayTransform.load(setting['transform_path'])
+        self.indexer = None
 
     def on_init(self):
         """
@@ -60,9 +62,11 @@ class Strategy001(CtaTemplate):
         df = convert_ticks(self.ticks)
         df_all = get_factors(df)
         df_feature = df_all.drop(columns=['datetime', 'instrument', 'label'])
-        df_feature = (df_feature - self.train_mean) / self.train_std
-        ds_feature = lgb.Dataset(df_feature)
-        pred = self.model.predict(ds_feature.data)
+        if self.indexer is None:
+            # the features are reordered as the transform once, every tick is then plain numpy
+            self.indexer = self.transform.get_indexer(df_feature.columns)
+        x = self.transform(df_feature.to_numpy(dtype=np.float64)[:, self.indexer])
+        pred = self.model.predict(x)
         if pred[0] > 0.0001 and self.pos == 0:
             self.logger.info(f"{tick.datetime}, long, {tick.last_price}")
             self.buy(tick.last_price + 1, 1)
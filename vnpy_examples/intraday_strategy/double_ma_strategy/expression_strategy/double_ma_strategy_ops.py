@@ -1,8 +1,7 @@
 from vnpy.trader.object import TickData, BarData, TradeData, OrderData
 from vnpy.trader.utility import BarGenerator, ArrayManager
 from vnpy_app.utility.log import get_module_logger
-from vnpy_app.utility.manager import MarketDataManager
-from vnpy_app.expression.parser import calculate_field
+from vnpy_app.expression.dag import compile_field
 
 from vnpy_app.vnpy_ctastrategy import (
     CtaTemplate,
@@ -23,10 +22,12 @@ class DoubleMaStrategy(CtaTemplate):
         """"""
         super().__init__(cta_engine, strategy_name, vt_symbol, setting)
 
-        bar_size = 25
+        self.fast_plan = compile_field(f'Mean($close, {self.fast_window})')
+        self.slow_plan = compile_field(f'Mean($close, {self.slow_window})')
+        # the last 2 values of the averages are compared
+        self.bar_size = max(self.fast_plan.get_lookback(), self.slow_plan.get_lookback()) + 1
         self.bg = BarGenerator(self.on_bar)
-        self.am = ArrayManager(bar_size)
-        self.em = MarketDataManager(bar_size)
+        self.am = ArrayManager(self.bar_size)
         self.logger = get_module_logger(__name__)
 
     def on_init(self):
@@ -34,7 +35,7 @@ class DoubleMaStrategy(CtaTemplate):
         Callback when strategy is inited.
         """
         self.write_log("策略初始化")
-        self.load_bar(10)
+        self.load_bar_size(self.bar_size)
 
     def on_start(self):
         """
@@ -62,18 +63,17 @@ class DoubleMaStrategy(CtaTemplate):
         """
         am = self.am
         am.update_bar(bar)
-        em = self.em
-        em.update_bar(bar)
         if not am.inited:
             return
-        df = em.market_data
-        df['fast'] = calculate_field(df, f'Mean($close, {self.fast_window})')
-        df['slow'] = calculate_field(df, f'Mean($close, {self.slow_window})')
-
-        cross_over = (df['fast'].iloc[-1] > df['slow'].iloc[-1]
-                      and df['fast'].iloc[-2] < df['slow'].iloc[-2])
-        cross_below = (df['fast'].iloc[-1] < df['slow'].iloc[-1]
-                       and df['fast'].iloc[-2] > df['slow'].iloc[-2])
+        # only the last 2 bars are compared, on the arrays of the ArrayManager
+        data = {"$close": am.close}
+        fast = self.fast_plan.evaluate(data, last_n=2, backend="numpy")
+        slow = self.slow_plan.evaluate(data, last_n=2, backend="numpy")
+
+        cross_over = (fast[-1] > slow[-1]
+                      and fast[-2] < slow[-2])
+        cross_below = (fast[-1] < slow[-1]
+                       and fast[-2] > slow[-2])
 
         if cross_over:
             if self.pos == 0: